@@ -1,6 +1,15 @@
-from decimal import Decimal
+import threading
+import time
+from collections import Counter
+
 from django.conf import settings
-from store.models import Product, Size, Color
+from django.core.cache import cache
+from django.utils import timezone
+from store.models import Product
+from store import refdata, sales
+
+# Daily counters are kept a while so recent days can be compared
+METRICS_TIMEOUT = 60 * 60 * 24 * 8
 
 class Cart:
     def __init__(self, request):
@@ -8,10 +17,17 @@ class Cart:
         Initialize the cart.
         """
         self.session = request.session
+        # Resolved items and running totals, shared by every Cart built for
+        # this request (the view, the context processor, the page cache),
+        # so the products are fetched at most once per request
+        if not hasattr(request, '_cart_memo'):
+            request._cart_memo = {}
+        self._memo = request._cart_memo
         cart = self.session.get(settings.CART_SESSION_ID)
-        if not cart:
-            # save an empty cart in the session
-            cart = self.session[settings.CART_SESSION_ID] = {}
+        if cart is None:
+            # Virtual until the first add(): read-only visits never write
+            # (or create) a session just to hold an empty cart
+            cart = self._memo.setdefault('virtual_cart', {})
         self.cart = cart
 
     def add(self, product, quantity=1, override_quantity=False, size=None, color=None):
@@ -29,6 +45,9 @@ class Cart:
             
         cart_item_key = "_".join(parts)
 
+        if settings.CART_SESSION_ID not in self.session:
+            self.session[settings.CART_SESSION_ID] = self.cart
+        old_quantity = self.cart.get(cart_item_key, {}).get('quantity', 0)
         if cart_item_key not in self.cart:
             self.cart[cart_item_key] = {
                 'quantity': 0, 
@@ -42,6 +61,7 @@ class Cart:
             self.cart[cart_item_key]['quantity'] = quantity
         else:
             self.cart[cart_item_key]['quantity'] += quantity
+        self._changed(self.cart[cart_item_key]['quantity'] - old_quantity)
         self.save()
 
     def save(self):
@@ -62,12 +82,35 @@ class Cart:
         cart_item_key = "_".join(parts)
 
         if cart_item_key in self.cart:
-            del self.cart[cart_item_key]
+            removed = self.cart.pop(cart_item_key)
+            self._changed(-removed['quantity'])
             self.save()
 
+    def _changed(self, quantity_delta):
+        # Re-resolve on next read; keep the item count without re-summing
+        self._memo.pop('items', None)
+        self._memo.pop('total', None)
+        if 'count' in self._memo:
+            self._memo['count'] += quantity_delta
+
     def __iter__(self):
         """
-        Iterate over the items in the cart and get the products from the database.
+        Iterate over the items in the cart, with their products resolved.
+        Items are resolved once per request and the same dicts are handed
+        out every time, so annotations (e.g. update_quantity_form) stick.
+        """
+        return iter(self._items())
+
+    def _items(self):
+        if 'items' not in self._memo:
+            items = list(self._resolve())
+            self._memo['items'] = items
+            self._memo['total'] = sum(item['total_price'] for item in items)
+        return self._memo['items']
+
+    def _resolve(self):
+        """
+        Get the products of the cart's items from the database.
         """
         # Collect all product IDs from the cart items
         product_ids = set()
@@ -99,20 +142,16 @@ class Cart:
             if c:
                 color_codes.add(c)
         
-        # Fetch Size and Color objects
-        size_map = {}
-        if size_codes:
-            sizes = Size.objects.filter(code__in=size_codes)
-            for size in sizes:
-                size_map[size.code] = size.name
-
-        color_map = {}
-        if color_codes:
-            colors = Color.objects.filter(code__in=color_codes)
-            for color in colors:
-                color_map[color.code] = color.name
-
-        products = Product.objects.filter(id__in=product_ids)
+        # Resolve Size and Color names from the reference-data cache
+        sizes = refdata.get_sizes()
+        size_map = {code: sizes[code].name for code in size_codes if code in sizes}
+
+        colors = refdata.get_colors()
+        color_map = {code: colors[code].name for code in color_codes if code in colors}
+
+        products = list(Product.objects.filter(id__in=product_ids))
+        # Running flash sales, for the whole cart in one lookup
+        sales.resolve(products)
         
         # Create a dictionary for faster lookup
         product_dict = {str(p.id): p for p in products}
@@ -130,7 +169,10 @@ class Cart:
             
             if p_id and p_id in product_dict:
                 item['product'] = product_dict[p_id]
-                item['net_price'] = Decimal(item['price'])
+                # Priced now, not when added: discounts and flash sales
+                # apply from the moment they start until they end
+                item['price'] = item['product'].discounted_price
+                item['net_price'] = item['price']
                 item['total_price'] = item['net_price'] * item['quantity']
 
                 # Resolve Size Name
@@ -155,12 +197,89 @@ class Cart:
         """
         Count all items in the cart.
         """
-        return sum(item['quantity'] for item in self.cart.values())
+        if 'count' not in self._memo:
+            self._memo['count'] = sum(item['quantity'] for item in self.cart.values())
+        return self._memo['count']
 
     def get_total_price(self):
-        return sum(Decimal(item['price']) * item['quantity'] for item in self.cart.values())
+        self._items()
+        return self._memo['total']
 
     def clear(self):
         # remove cart from session
-        del self.session[settings.CART_SESSION_ID]
-        self.save()
\ No newline at end of file
+        self.cart.clear()
+        self._memo.update(items=[], total=0, count=0)
+        if self.session.pop(settings.CART_SESSION_ID, None) is not None:
+            self.save()
+
+
+# ==========================================
+# SESSION WRITE METRICS
+# ==========================================
+def _avoided_writes_key(day):
+    return f'cart:session_writes_avoided:{day.isoformat()}'
+
+
+# Counts are kept in process memory and added to the shared cache in
+# batches, so the hot path of an anonymous page view never writes to the
+# cache. Up to one batch per worker is lost if the worker exits.
+FLUSH_EVERY = 100
+FLUSH_INTERVAL = 60
+
+_metrics_lock = threading.Lock()
+_unflushed = Counter()
+_last_flush = time.monotonic()
+
+
+def record_avoided_session_write(request):
+    """
+    Count a request whose cart stayed virtual and whose session wasn't
+    otherwise changed: before carts were lazy it would have saved an empty
+    cart (a django_session write, and a cookie). Called by
+    cart.middleware.SessionWriteMetricsMiddleware.
+
+    Each worker counts in memory and flushes every FLUSH_EVERY requests or
+    FLUSH_INTERVAL seconds into the default cache, shared by every worker
+    (settings.CACHES). On the file-based cache concurrent flushes can
+    still race (its incr is a get then a set), so with several workers
+    the total is a close lower bound; Redis counts exactly. Not in the
+    database: a write per request to count avoided writes would undo the
+    saving.
+    """
+    memo = getattr(request, '_cart_memo', None)
+    if memo is None or 'virtual_cart' not in memo:
+        return False
+    session = request.session
+    if session.modified or settings.CART_SESSION_ID in session:
+        return False
+    with _metrics_lock:
+        _unflushed[timezone.localdate()] += 1
+        due = (
+            sum(_unflushed.values()) >= FLUSH_EVERY
+            or time.monotonic() - _last_flush >= FLUSH_INTERVAL
+        )
+    if due:
+        flush_session_write_metrics()
+    return True
+
+
+def flush_session_write_metrics():
+    """Add this process's unflushed counts to the shared daily counters."""
+    global _last_flush
+    with _metrics_lock:
+        counts = dict(_unflushed)
+        _unflushed.clear()
+        _last_flush = time.monotonic()
+    for day, count in counts.items():
+        key = _avoided_writes_key(day)
+        if not cache.add(key, count, METRICS_TIMEOUT):
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                cache.set(key, count, METRICS_TIMEOUT)
+
+
+def avoided_session_writes(day=None):
+    """Session writes avoided on `day` (default today), for the dashboard."""
+    flush_session_write_metrics()
+    return cache.get(_avoided_writes_key(day or timezone.localdate()), 0)
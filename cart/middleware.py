@@ -0,0 +1,18 @@
+from .cart import record_avoided_session_write
+
+
+class SessionWriteMetricsMiddleware:
+    """
+    Counts the session writes lazy carts avoid (see
+    cart.cart.record_avoided_session_write). Must come after
+    SessionMiddleware, so it sees the response before the session is saved.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if hasattr(request, 'session'):
+            record_avoided_session_write(request)
+        return response
@@ -1,3 +1,116 @@
-from django.test import TestCase
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.sessions.backends.cache import SessionStore
+from django.contrib.sessions.backends.db import SessionStore as DbSessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import cache, caches
+from django.db import connection
+from django.test import RequestFactory, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from store import refdata, sales
+from store.models import Category, Product
+
+from . import cart as cart_module
+from .cart import Cart, avoided_session_writes, flush_session_write_metrics
+
+
+def make_product(category, name, price='100.00', **kwargs):
+    slug = kwargs.pop('slug', name.lower().replace(' ', '-'))
+    return Product.objects.create(category=category, name=name, slug=slug, price=Decimal(price), **kwargs)
+
+
+class CartMemoTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        rings = Category.objects.create(name='Rings', slug='rings')
+        self.ruby = make_product(rings, 'Ruby Ring', price='100.00', stock=5)
+        self.opal = make_product(rings, 'Opal Ring', price='80.00', stock=5)
+
+    def make_request(self):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        return request
+
+    def test_items_resolve_once_per_request_across_carts(self):
+        request = self.make_request()
+        Cart(request).add(self.ruby, quantity=2)
+        refdata.get_refdata(), sales.get_index()  # per-worker caches
+        with self.assertNumQueries(1):
+            cart = Cart(request)
+            self.assertEqual([item['product'] for item in cart], [self.ruby])
+            list(Cart(request))
+            self.assertEqual(Cart(request).get_total_price(), Decimal('200.00'))
+
+    def test_add_remove_clear_keep_counters_and_refresh_items(self):
+        request = self.make_request()
+        cart = Cart(request)
+        cart.add(self.ruby, quantity=2)
+        self.assertEqual((len(cart), cart.get_total_price()), (2, Decimal('200.00')))
+        cart.add(self.opal, quantity=1)
+        cart.add(self.ruby, quantity=1, override_quantity=True)
+        self.assertEqual((len(cart), cart.get_total_price()), (2, Decimal('180.00')))
+        self.assertEqual(len(Cart(request)), 2)
+        cart.remove(self.opal)
+        self.assertEqual((len(cart), [item['product'] for item in cart]), (1, [self.ruby]))
+        cart.clear()
+        self.assertEqual((len(cart), cart.get_total_price(), list(cart)), (0, 0, []))
+
+    def test_cart_detail_resolves_once_and_keeps_update_forms(self):
+        self.client.post(reverse('cart:cart_add', args=[self.ruby.id]), {'quantity': 3})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(len([q for q in queries if 'FROM "store_product"' in q['sql']]), 1)
+        # The forms set by the view are the ones the template renders
+        self.assertContains(response, '<option value="3" selected>')
+
+
+class LazyCartSessionTests(TestCase):
+    def setUp(self):
+        flush_session_write_metrics()
+        cache.clear()
+        rings = Category.objects.create(name='Rings', slug='rings')
+        self.ruby = make_product(rings, 'Ruby Ring', stock=5)
+
+    def test_browsing_never_writes_a_session(self):
+        for url in (reverse('store:product_list'), self.ruby.get_absolute_url(), reverse('cart:cart_detail')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('sessionid', response.cookies)
+        self.assertFalse(Session.objects.exists())
+        self.assertEqual(avoided_session_writes(), 3)
+
+    def test_avoided_writes_are_flushed_to_the_cache_in_batches(self):
+        key = cart_module._avoided_writes_key(timezone.localdate())
+        with mock.patch.object(cart_module, 'FLUSH_EVERY', 3):
+            for _ in range(2):
+                self.client.get(reverse('cart:cart_detail'))
+            self.assertIsNone(cache.get(key))
+            self.client.get(reverse('cart:cart_detail'))
+            self.assertEqual(cache.get(key), 3)
+
+            # Another worker's batch adds to the shared total
+            with mock.patch('cart.cart.cache', caches.create_connection('default')):
+                for _ in range(3):
+                    self.client.get(reverse('cart:cart_detail'))
+        self.assertEqual(avoided_session_writes(), 6)
+
+    def test_first_add_creates_the_session(self):
+        response = self.client.post(reverse('cart:cart_add', args=[self.ruby.id]), {'quantity': 2})
+        self.assertIn('sessionid', response.cookies)
+        self.assertEqual(Session.objects.count(), 1)
+        self.assertEqual(self.client.session['cart'][str(self.ruby.id)]['quantity'], 2)
+        self.assertEqual(avoided_session_writes(), 0)
+        self.assertContains(self.client.get(reverse('cart:cart_detail')), 'Ruby Ring')
+
+    def test_clear_and_remove_on_a_virtual_cart(self):
+        request = RequestFactory().get('/')
+        request.session = DbSessionStore()
+        cart = Cart(request)
+        cart.remove(self.ruby)
+        cart.clear()
+        self.assertEqual(len(cart), 0)
+        self.assertFalse(request.session.modified)
@@ -1,7 +1,8 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.views.decorators.http import require_POST
-from store.models import Product, Size, Color, ProductVariant
+from store.models import Product
+from store import variants
 from .cart import Cart
 from .forms import CartAddProductForm
 
@@ -21,37 +22,21 @@ def cart_add(request, product_id):
         color_to_add = cd.get('color')
 
         # Variation Stock Logic
-        variant = None
+        variant_id = None
         stock_limit = product.stock
         
-        # Try to find specific variant
-        if product.variants.exists():
-            try:
-                # Resolve Size object (handle 'Adjustable' or None)
-                s_obj = None
-                if size_to_add and size_to_add != 'Adjustable':
-                    s_obj = Size.objects.filter(code=size_to_add).first()
-                
-                # Resolve Color object
-                c_obj = None
-                if color_to_add:
-                    c_obj = Color.objects.filter(code=color_to_add).first()
-
-                # Look for exact variant match
-                variant = ProductVariant.objects.filter(product=product, size=s_obj, color=c_obj).first()
-                
-                if variant:
-                    stock_limit = variant.stock
-            except Exception as e:
-                # Fallback to global stock if something fails
-                pass
+        # Look the selection up in the product's variant stock index
+        # (one cached map, shared with the product page)
+        found = variants.lookup(variants.get_stock_index(product.id), size_to_add, color_to_add)
+        if found:
+            variant_id, stock_limit = found
 
         # Calculate current quantity of this specific variation in cart
         current_quantity = 0
         for item in cart:
             if str(item['product'].id) == str(product.id):
                 # If we found a variant, only count items matching this variation
-                if variant:
+                if variant_id:
                     if item.get('size') == size_to_add and item.get('color') == color_to_add:
                         current_quantity += item['quantity']
                 else:
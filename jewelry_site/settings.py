@@ -53,6 +53,38 @@ INSTALLED_APPS = [
 
 # ... existing middleware code ...
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+#
+# Must be shared by every worker process and by management commands: the
+# namespace versions in it (store.caching) are how a save in one process
+# invalidates the page cache, the reference data held in each worker's
+# memory (store.refdata), the sale index and the variant stock index in all
+# the others. Redis when REDIS_URL is set (needed with several hosts),
+# otherwise files on this host. A process-local backend such as
+# LocMemCache fails `manage.py check` (store.E001).
+REDIS_URL = os.getenv('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.getenv('CACHE_DIR', str(BASE_DIR / 'cache')),
+            'OPTIONS': {'MAX_ENTRIES': 20000},
+        }
+    }
+
+
+# Tests get their own temporary cache and theme CSS directory
+TEST_RUNNER = 'jewelry_site.test_runner.IsolatedTestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -67,9 +99,10 @@ AUTH_PASSWORD_VALIDATORS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    "whitenoise.middleware.WhiteNoiseMiddleware", # Whitenoise
+    'store.middleware.StoreWhiteNoiseMiddleware', # Whitenoise (+ immutable theme stylesheets)
     'store.middleware.VisitorTrackingMiddleware', # Custom Visitor Tracking
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'cart.middleware.SessionWriteMetricsMiddleware', # Counts session writes avoided by lazy carts
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -140,6 +173,11 @@ STATICFILES_DIRS = [
 ]
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Compiled theme stylesheets (theme-<hash>.css), written on Theme.save()
+# and served by WhiteNoise at the site root
+THEME_CSS_ROOT = BASE_DIR / 'theme_css'
+WHITENOISE_ROOT = THEME_CSS_ROOT
+
 # Whitenoise Storage (Compression + Caching)
 STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
 
@@ -155,6 +193,16 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 CART_SESSION_ID = 'cart'
 
+# Products per page on listing/search pages (keyset pagination)
+STORE_PAGE_SIZE = 24
+
+# Seconds an anonymous storefront page stays in the full-page cache
+# (pages are also invalidated as soon as the products/theme they show change)
+PAGE_CACHE_TIMEOUT = 60 * 10
+
+# Seconds a rendered product card stays cached (keys change when a product is saved)
+PRODUCT_CARD_CACHE_TIMEOUT = 60 * 60 * 24
+
 # Authentication Redirects
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
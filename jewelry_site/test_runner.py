@@ -0,0 +1,37 @@
+"""
+Test runner that keeps the suite away from the site's real cache and
+compiled theme CSS.
+
+Tests call cache.clear(), which on the configured backend would wipe the
+live page cache (or flush a production Redis when REDIS_URL is set), and
+saving a Theme writes stylesheets to THEME_CSS_ROOT. For the run, both
+point into a temporary directory that is removed afterwards.
+"""
+import shutil
+import tempfile
+from pathlib import Path
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class IsolatedTestRunner(DiscoverRunner):
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._tmpdir = Path(tempfile.mkdtemp(prefix='jewelry-tests-'))
+        self._isolated_settings = override_settings(
+            CACHES={
+                'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': str(self._tmpdir / 'cache'),
+                }
+            },
+            THEME_CSS_ROOT=self._tmpdir / 'theme_css',
+            WHITENOISE_ROOT=self._tmpdir / 'theme_css',
+        )
+        self._isolated_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._isolated_settings.disable()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
@@ -2,26 +2,26 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
-from django.contrib.sitemaps.views import sitemap
 from django.views.generic.base import TemplateView
-from store.sitemaps import ProductSitemap, CategorySitemap, StaticViewSitemap
-
-sitemaps = {
-    'static': StaticViewSitemap,
-    'products': ProductSitemap,
-    'categories': CategorySitemap,
-}
+from store import sitemaps
+from store.views import theme_stylesheet
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('accounts/', include('accounts.urls')),
     path('cart/', include('cart.urls', namespace='cart')),
     path('orders/', include('orders.urls', namespace='orders')), # <-- Connected the cart app
+    # Read-only storefront JSON API (before store.urls, whose category slugs match anything)
+    path('api/v1/', include('store.api_urls', namespace='api_v1')),
     path('', include('store.urls')),
     
     # SEO: Sitemap & Robots
-    path('sitemap.xml', sitemap, {'sitemaps': sitemaps}, name='django.contrib.sitemaps.views.sitemap'),
+    path('sitemap.xml', sitemaps.index, name='sitemap_index'),
+    path('sitemap-<section>.xml', sitemaps.section, name='sitemap_section'),
     path('robots.txt', TemplateView.as_view(template_name="store/robots.txt", content_type="text/plain")),
+
+    # Compiled theme CSS (normally served by WhiteNoise from THEME_CSS_ROOT)
+    path('theme-<str:css_hash>.css', theme_stylesheet, name='theme_stylesheet'),
 ]
 
 if settings.DEBUG:
@@ -1,5 +1,7 @@
 from django.contrib import admin
 from django.contrib import messages
+from store.exports import ExportAdminMixin
+from .exports import OrderExport, OrderItemExport
 from .models import Order, OrderItem, PathaoCity, PathaoZone, PathaoArea
 
 
@@ -64,7 +66,7 @@ update_pathao_status.short_description = "Update Pathao status for selected orde
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ExportAdminMixin, admin.ModelAdmin):
     list_display = ['id', 'first_name', 'last_name', 'email', 'phone',
                     'address', 'city', 'payment_method', 'paid', 'status',
                     'sent_to_pathao', 'pathao_consignment_id', 'created']
@@ -73,6 +75,8 @@ class OrderAdmin(admin.ModelAdmin):
     search_fields = ['first_name', 'last_name', 'email', 'phone', 'pathao_consignment_id']
     inlines = [OrderItemInline]
     actions = [send_to_pathao, update_pathao_status]
+    exports = [OrderExport, OrderItemExport]
+    change_list_template = 'admin/store/change_list_export.html'
     
     fieldsets = (
         ('Customer Information', {
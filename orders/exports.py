@@ -0,0 +1,88 @@
+"""
+Streaming exports of orders and order lines for the accountant (see
+store.exports). Both read values() rows only; order totals are summed by
+the database rather than by loading every OrderItem.
+"""
+from decimal import Decimal
+
+from django.db.models import DecimalField, ExpressionWrapper, F, Sum, Value
+from django.db.models.functions import Coalesce
+
+from store.exports import Export
+
+from .models import Order, OrderItem
+
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+CENTS = Decimal('0.01')
+
+
+def _subtotal(row):
+    # SQLite drops the scale of computed decimals
+    return Decimal(row['subtotal']).quantize(CENTS)
+
+
+def _shipping(row):
+    return Order.SHIPPING_COSTS.get(row['shipping_zone'], Order.SHIPPING_COSTS['inside_dhaka'])
+
+
+def _total(row):
+    return _subtotal(row) + _shipping(row) - row['payment_discount']
+
+
+def _line_total(row):
+    return row['price'] * row['quantity']
+
+
+def _line_cost(row):
+    if row['cost_price'] is None:
+        return None
+    return row['cost_price'] * row['quantity']
+
+
+class OrderExport(Export):
+    name = 'orders'
+    label = 'Orders'
+    model = Order
+    fields = (
+        'id', 'created', 'status', 'paid', 'payment_method', 'transaction_id', 'first_name', 'last_name',
+        'email', 'phone', 'address', 'city', 'postal_code', 'shipping_zone', 'payment_discount',
+        'pathao_consignment_id', 'item_count', 'subtotal',
+    )
+    columns = (
+        ('Order', 'id'), ('Date', 'created'), ('Status', 'status'), ('Paid', 'paid'),
+        ('Payment method', 'payment_method'), ('Transaction ID', 'transaction_id'),
+        ('First name', 'first_name'), ('Last name', 'last_name'), ('Email', 'email'), ('Phone', 'phone'),
+        ('Address', 'address'), ('City', 'city'), ('Postal code', 'postal_code'),
+        ('Shipping zone', 'shipping_zone'), ('Items', 'item_count'), ('Subtotal', _subtotal),
+        ('Shipping', _shipping), ('Payment discount', 'payment_discount'), ('Total', _total),
+        ('Pathao consignment', 'pathao_consignment_id'),
+    )
+
+    def filter(self, queryset, start=None, end=None):
+        # Aggregated after filtering, so the filters stay plain WHERE clauses
+        return super().filter(queryset, start, end).annotate(
+            item_count=Coalesce(Sum('items__quantity'), 0),
+            subtotal=Coalesce(
+                Sum(ExpressionWrapper(F('items__price') * F('items__quantity'), output_field=MONEY)),
+                Value(Decimal('0')), output_field=MONEY,
+            ),
+        )
+
+
+class OrderItemExport(Export):
+    name = 'order_items'
+    label = 'Order lines'
+    model = OrderItem
+    date_field = 'order__created'
+    related_filter = 'order__in'
+    ordering = ('order_id', 'pk')
+    fields = (
+        'order_id', 'order__created', 'order__status', 'order__paid', 'product_id', 'product__name',
+        'product__category__name', 'quantity', 'price', 'cost_price',
+    )
+    columns = (
+        ('Order', 'order_id'), ('Date', 'order__created'), ('Status', 'order__status'), ('Paid', 'order__paid'),
+        ('Product ID', 'product_id'), ('Product', 'product__name'), ('Category', 'product__category__name'),
+        ('Quantity', 'quantity'), ('Unit price', 'price'), ('Line total', _line_total),
+        ('Unit cost', 'cost_price'), ('Line cost', _line_cost),
+    )
@@ -33,6 +33,11 @@ class Order(models.Model):
         ('intercity_dhaka', 'Intercity Dhaka (120 TK)'),
         ('outside_dhaka', 'Outside Dhaka (150 TK)'),
     ]
+    SHIPPING_COSTS = {
+        'inside_dhaka': 80,
+        'intercity_dhaka': 120,
+        'outside_dhaka': 150,
+    }
     shipping_zone = models.CharField(max_length=20, choices=SHIPPING_ZONE_CHOICES, default='inside_dhaka')
 
     ORDER_STATUS_CHOICES = [
@@ -72,12 +77,7 @@ class Order(models.Model):
         return f'Order {self.id}'
         
     def get_shipping_cost(self):
-        if self.shipping_zone == 'outside_dhaka':
-            return 150
-        elif self.shipping_zone == 'intercity_dhaka':
-            return 120
-        else: # inside_dhaka
-            return 80
+        return self.SHIPPING_COSTS.get(self.shipping_zone, self.SHIPPING_COSTS['inside_dhaka'])
 
     def get_total_cost(self):
         subtotal = sum(item.get_cost() for item in self.items.all())
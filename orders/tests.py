@@ -1,3 +1,75 @@
+import csv
+from datetime import date, datetime
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from store.models import Category, Product
+
+from .exports import OrderExport, OrderItemExport
+from .models import Order, OrderItem
+
+
+def make_product(category, name, price='100.00', **kwargs):
+    slug = kwargs.pop('slug', name.lower().replace(' ', '-'))
+    return Product.objects.create(category=category, name=name, slug=slug, price=Decimal(price), **kwargs)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        self.client.login(username='admin', password='secret123')
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+
+    def read_csv(self, response):
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.DictReader(StringIO(content)))
+
+    def make_order(self, created, *lines):
+        order = Order.objects.create(first_name='Ayesha', address='Road 1', postal_code='1207', city='Dhaka',
+                                     shipping_zone='outside_dhaka', payment_discount=Decimal('10'))
+        Order.objects.filter(pk=order.pk).update(created=created)
+        for product, price, quantity in lines:
+            OrderItem.objects.create(order=order, product=product, price=Decimal(price), quantity=quantity)
+        return order
+
+    def test_order_exports_with_date_range(self):
+        ring = make_product(self.rings, 'Ruby Ring', price='100.00')
+        tz = timezone.get_current_timezone()
+        old = self.make_order(timezone.make_aware(datetime(2025, 1, 31, 23, 30), tz), (ring, '100.00', 1))
+        march = self.make_order(timezone.make_aware(datetime(2025, 3, 1, 0, 15), tz),
+                                (ring, '100.00', 2), (ring, '50.00', 1))
+
+        rows = self.read_csv(OrderExport().response(start=date(2025, 2, 1), end=date(2025, 3, 1)))
+        self.assertEqual([row['Order'] for row in rows], [str(march.pk)])
+        self.assertEqual((rows[0]['Items'], rows[0]['Subtotal'], rows[0]['Shipping'], rows[0]['Total']),
+                         ('3', '250.00', '150', '390.00'))
+        self.assertEqual(rows[0]['Date'], '2025-03-01 00:15:00')
+
+        lines = self.read_csv(OrderItemExport().response(end=date(2025, 1, 31)))
+        self.assertEqual([(row['Order'], row['Product'], row['Line total']) for row in lines],
+                         [(str(old.pk), 'Ruby Ring', '100.00')])
+
+    def test_admin_order_export_keeps_changelist_filters(self):
+        ring = make_product(self.rings, 'Ruby Ring')
+        paid = self.make_order(timezone.now(), (ring, '100.00', 1))
+        self.make_order(timezone.now(), (ring, '100.00', 1))
+        Order.objects.filter(pk=paid.pk).update(paid=True)
+
+        changelist = self.client.get(reverse('admin:orders_order_changelist'))
+        self.assertContains(changelist, reverse('admin:orders_order_export'))
+        url = reverse('admin:orders_order_export') + '?paid__exact=1'
+        self.assertContains(self.client.get(url), 'Order lines')
+
+        response = self.client.post(url, {'dataset': 'order_items', 'file_format': 'csv'})
+        self.assertIn('attachment; filename="order_items-', response['Content-Disposition'])
+        self.assertEqual([row['Order'] for row in self.read_csv(response)], [str(paid.pk)])
 
-# Create your tests here.
+        response = self.client.post(url, {'file_format': 'csv', 'dataset': 'orders',
+                                          'start': '2025-03-02', 'end': '2025-03-01'})
+        self.assertContains(response, 'The start date must not be after the end date.')
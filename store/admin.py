@@ -1,9 +1,15 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin import helpers
+from django.template.response import TemplateResponse
 from django.utils.html import format_html, mark_safe
 from import_export import resources, fields
 from import_export.admin import ImportExportModelAdmin
 from import_export.widgets import ForeignKeyWidget, ManyToManyWidget
-from .models import Category, Product, Size, Color, Theme, HeroSection, ProductImage, ProductVariant
+from .models import Category, Product, Size, Color, Theme, HeroSection, ProductImage, ProductVariant, ProductImportJob, RepricingBatch, SaleRule
+from .page_cache import invalidate_tags
+from . import bulk_import, refdata, repricing
+from .exports import ExportAdminMixin, ProductExport
 
 
 # ==========================================
@@ -108,9 +114,143 @@ class ProductVariantInline(admin.TabularInline):
     extra = 1
 
 
+# ==========================================
+# LARGE PRODUCT IMPORTS (background)
+# ==========================================
+@admin.register(ProductImportJob)
+class ProductImportJobAdmin(admin.ModelAdmin):
+    """
+    Upload a supplier sheet and it is queued for `import_products --pending`
+    (run from cron or a worker, see store.bulk_import); reload the list to
+    follow its progress. For small files the Import button on Products
+    works too.
+    """
+    list_display = ['__str__', 'file', 'progress_display', 'created_count', 'updated_count', 'error_count', 'created', 'finished_at']
+    list_filter = ['status']
+    readonly_fields = ['status', 'progress_display', 'total_rows', 'processed_rows', 'created_count',
+                       'updated_count', 'error_count', 'errors_display', 'started_at', 'finished_at']
+
+    def get_fields(self, request, obj=None):
+        if obj is None:
+            return ['file']
+        return ['file', *self.readonly_fields]
+
+    def get_readonly_fields(self, request, obj=None):
+        if obj is None:
+            return []
+        return ['file', *self.readonly_fields]
+
+    def progress_display(self, obj):
+        return f"{obj.progress}% ({obj.processed_rows}/{obj.total_rows} rows)"
+    progress_display.short_description = 'Progress'
+
+    def errors_display(self, obj):
+        if not obj.errors:
+            return '-'
+        lines = [f"Row {error['row']}: {error['error']}" if error['row'] else error['error'] for error in obj.errors]
+        if obj.error_count > len(obj.errors):
+            lines.append(f"... and {obj.error_count - len(obj.errors)} more")
+        return format_html('<pre style="margin: 0;">{}</pre>', '\n'.join(lines))
+    errors_display.short_description = 'Errors'
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if not change:
+            self.message_user(request, f"{obj} queued for the import runner; reload this page to follow its progress.")
+
+
+# ==========================================
+# FLASH SALES
+# ==========================================
+@admin.register(SaleRule)
+class SaleRuleAdmin(admin.ModelAdmin):
+    list_display = ['name', 'discount_percentage', 'starts_at', 'ends_at', 'product', 'category', 'metal', 'is_active']
+    list_filter = ['is_active', 'metal', 'category']
+    list_editable = ['is_active']
+    search_fields = ['name', 'product__name']
+    raw_id_fields = ['product']
+    date_hierarchy = 'starts_at'
+
+    fieldsets = (
+        (None, {
+            'fields': ('name', 'discount_percentage', 'is_active')
+        }),
+        ('Schedule', {
+            'fields': ('starts_at', 'ends_at'),
+            'description': 'The sale starts exactly at the start time and ends exactly at the end time.'
+        }),
+        ('Applies to', {
+            'fields': ('product', 'category', 'metal'),
+            'description': 'Choose exactly one. A category includes its subcategories. Overlapping sales don\'t stack: the biggest discount wins.'
+        }),
+    )
+
+
+# ==========================================
+# BULK REPRICING
+# ==========================================
+class RepricingForm(forms.Form):
+    """The rule for the "Reprice selected products" action (see store.repricing)."""
+    DISCOUNT_CHOICES = [
+        ('keep', 'Keep current discounts'),
+        ('percentage', 'Set percentage discount'),
+        ('amount', 'Set fixed discount (TK)'),
+        ('clear', 'Remove discounts'),
+    ]
+
+    price_change = forms.DecimalField(required=False, help_text="Percent change of the price, e.g. 5 or -10")
+    rounding_step = forms.DecimalField(required=False, min_value=0, help_text="Round prices to a multiple of this, e.g. 10")
+    rounding = forms.ChoiceField(choices=[('nearest', 'Nearest'), ('up', 'Up'), ('down', 'Down')], initial='nearest')
+    discount = forms.ChoiceField(choices=DISCOUNT_CHOICES, initial='keep')
+    discount_value = forms.DecimalField(required=False, min_value=0, help_text="Percentage or TK, for the discount options above")
+    description = forms.CharField(required=False, max_length=200, help_text="e.g. Eid campaign")
+
+    def clean(self):
+        cleaned = super().clean()
+        if cleaned.get('discount') in ('percentage', 'amount') and cleaned.get('discount_value') is None:
+            self.add_error('discount_value', 'Enter the discount.')
+        return cleaned
+
+    def rule(self):
+        data = self.cleaned_data
+        return {
+            'price_change': data['price_change'],
+            'rounding_step': data['rounding_step'],
+            'rounding': data['rounding'],
+            'discount_percentage': data['discount_value'] if data['discount'] == 'percentage' else None,
+            'discount_amount': data['discount_value'] if data['discount'] == 'amount' else None,
+            'clear_discount': data['discount'] == 'clear',
+            'description': data['description'],
+        }
+
+
+@admin.register(RepricingBatch)
+class RepricingBatchAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'product_count', 'rule', 'created', 'rolled_back_at']
+    readonly_fields = ['description', 'rule', 'product_count', 'created', 'rolled_back_at']
+    actions = ['rollback_batches']
+
+    def has_add_permission(self, request):
+        # Batches are created by the Product "Reprice" action / reprice_products command
+        return False
+
+    @admin.action(description='Roll back selected repricing batches')
+    def rollback_batches(self, request, queryset):
+        # Newest first, so overlapping batches unwind in order
+        for batch in queryset.order_by('-created'):
+            try:
+                restored = repricing.rollback(batch)
+            except repricing.RepricingError as e:
+                self.message_user(request, str(e), level='error')
+            else:
+                self.message_user(request, f"Rolled back {batch}: restored {restored} products.")
+
+
 @admin.register(Product)
-class ProductAdmin(ImportExportModelAdmin):
+class ProductAdmin(ExportAdminMixin, ImportExportModelAdmin):
     resource_class = ProductResource
+    # Streams ProductExport behind import_export's Export button
+    exports = [ProductExport]
     inlines = [ProductImageInline, ProductVariantInline]
     list_display = ['name', 'price', 'stock', 'available', 'display_sizes', 'display_colors', 'updated']
     list_filter = ['available', 'is_adjustable', 'created', 'updated', 'category', 'metal']
@@ -118,6 +258,29 @@ class ProductAdmin(ImportExportModelAdmin):
     prepopulated_fields = {'slug': ('name',)}
     filter_horizontal = ('sizes', 'colors')
 
+    actions = ['reprice_products']
+
+    @admin.action(description='Reprice selected products')
+    def reprice_products(self, request, queryset):
+        form = RepricingForm(request.POST if 'apply' in request.POST else None)
+        if form.is_bound and form.is_valid():
+            rule = form.rule()
+            try:
+                batch = repricing.reprice(queryset, **rule)
+            except repricing.RepricingError as e:
+                form.add_error(None, str(e))
+            else:
+                self.message_user(request, f"Repriced {batch.product_count} products ({batch}). It can be rolled back under Repricing Batches.")
+                return None
+        return TemplateResponse(request, 'admin/store/product/reprice.html', {
+            **self.admin_site.each_context(request),
+            'title': 'Reprice products',
+            'opts': self.model._meta,
+            'form': form,
+            'queryset': queryset,
+            'action_checkbox_name': helpers.ACTION_CHECKBOX_NAME,
+        })
+
     def display_sizes(self, obj):
         return ", ".join([s.code for s in obj.sizes.all()])
     display_sizes.short_description = 'Sizes'
@@ -249,4 +412,7 @@ class HeroSectionAdmin(admin.ModelAdmin):
         HeroSection.objects.update(is_active=False)
         # Activate selected
         queryset.update(is_active=True)
+        # update() skips save signals, so invalidate the caches explicitly
+        invalidate_tags('hero')
+        refdata.invalidate()
         self.message_user(request, f"'{queryset.first().name}' is now the active hero section.")
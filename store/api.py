@@ -0,0 +1,416 @@
+"""
+Read-only storefront JSON API, version 1 (mounted at /api/v1/).
+
+    GET /api/v1/products/?category=rings&metal=Gold&sort=price_asc&limit=20
+    GET /api/v1/products/?fields=name,price,discounted_price,image&cursor=...
+    GET /api/v1/products/<id>/?fields=name,variants,images
+    GET /api/v1/products/<id>/variants/
+    GET /api/v1/products/<id>/images/
+    GET /api/v1/categories/
+
+Every query is a values() projection of just the columns the requested
+fields need (`?fields=` picks them; `id` is always included), so no model
+instances are built. Categories come from the in-memory reference data
+(store.refdata) and flash sales from the sale index (store.sales). Product
+lists use the storefront's keyset pagination (store.pagination): follow
+`next` until it is null.
+
+Responses carry an ETag derived from the page-cache tag versions the data
+depends on (see store.page_cache), so a matching If-None-Match gets a 304
+before any query runs, and bodies are cached under that ETag. Bodies are
+encoded with orjson when it is installed, else the standard json module.
+"""
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_safe
+
+from . import images, refdata, sales, variants
+from .caching import get_versions
+from .models import Product, ProductImage, resolve_discount
+from .page_cache import tag_namespace
+from .pagination import SORT_KEYS, get_page_size, paginate
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speed-up
+    orjson = None
+    import json
+
+API_VERSION = 'v1'
+MAX_LIMIT = 100
+SORTS = ('newest', 'price_asc', 'price_desc')
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _default(value):
+    # Decimals as strings, like the cursors do, so prices keep their cents
+    if hasattr(value, 'quantize'):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def dumps(data):
+    if orjson is not None:
+        return orjson.dumps(data, default=_default)
+    return json.dumps(data, default=_default, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+# ==========================================
+# FIELDS
+# ==========================================
+class Field:
+    """
+    One output field: the values() keys it needs and how to build it from a
+    row. `load(ids, context)` fields are fetched for all rows at once
+    ({product id: value}) and only offered on single-product responses,
+    whose cache tags cover them.
+    """
+
+    def __init__(self, *sources, get=None, load=None, pricing=False):
+        self.sources = sources
+        self.get = get or (lambda row, context, key=sources[0] if sources else None: row[key])
+        self.load = load
+        self.pricing = pricing
+
+
+class Context:
+    def __init__(self, request):
+        self.request = request
+        self.sales = {}
+        self.loaded = {}
+
+    def absolute(self, url):
+        return self.request.build_absolute_uri(url)
+
+
+def _image(name, meta, context):
+    if not name:
+        return None
+    storage = Product._meta.get_field('image').storage
+    data = {'url': context.absolute(storage.url(name))}
+    if meta and meta.get('name') == name and meta.get('widths'):
+        data.update({
+            'width': meta['width'],
+            'height': meta['height'],
+            'placeholder': meta.get('placeholder'),
+            'srcset': {
+                ext: ', '.join(
+                    f"{context.absolute(storage.url(images.derivative_name(name, width, ext)))} {width}w"
+                    for width in meta['widths']
+                )
+                for ext, _, _ in images.FORMATS
+            },
+        })
+    return data
+
+
+def _discount(row, context):
+    return resolve_discount(
+        row['price'], row['discount_percentage'], row['discount_amount'], context.sales.get(row['id']),
+    )
+
+
+def _category_slug(row, context):
+    category = refdata.get_category_by_id(row['category_id'])
+    return category.slug if category else None
+
+
+def _load_codes(field_name, code):
+    through = Product._meta.get_field(field_name).remote_field.through
+
+    def load(ids, context):
+        found = {}
+        for product_id, value in through.objects.filter(product_id__in=ids).order_by('pk').values_list('product_id', code):
+            found.setdefault(product_id, []).append(value)
+        return found
+    return load
+
+
+def _load_variants(ids, context):
+    # Single-product responses only, so one cached stock index each
+    return {
+        pk: [
+            {'id': variant_id, 'size': size, 'color': color, 'stock': stock}
+            for (size, color), (variant_id, stock) in variants.get_stock_index(pk).items()
+        ]
+        for pk in ids
+    }
+
+
+def _gallery_image(row, context):
+    return {'id': row['id'], **_image(row['image'], row['image_meta'], context)}
+
+
+def _load_images(ids, context):
+    found = {}
+    rows = ProductImage.objects.filter(product_id__in=ids).order_by('pk').values('id', 'product_id', 'image', 'image_meta')
+    for row in rows:
+        found.setdefault(row['product_id'], []).append(_gallery_image(row, context))
+    return found
+
+
+PRICING_SOURCES = ('id', 'price', 'discount_percentage', 'discount_amount', 'category_id', 'metal')
+
+PRODUCT_FIELDS = {
+    'id': Field('id'),
+    'name': Field('name'),
+    'slug': Field('slug'),
+    'url': Field('id', 'slug', get=lambda row, context: context.absolute(
+        reverse('store:product_detail', args=[row['id'], row['slug']]))),
+    'category': Field('category_id', get=_category_slug),
+    'description': Field('description'),
+    'price': Field('price'),
+    'discounted_price': Field(*PRICING_SOURCES, pricing=True, get=lambda row, context: _discount(row, context)[0]),
+    'discount_percentage': Field(*PRICING_SOURCES, pricing=True, get=lambda row, context: _discount(row, context)[1]),
+    'on_sale': Field(*PRICING_SOURCES, pricing=True, get=lambda row, context: row['id'] in context.sales),
+    'stock': Field('stock'),
+    'in_stock': Field('stock', get=lambda row, context: row['stock'] > 0),
+    'metal': Field('metal'),
+    'gemstone': Field('gemstone'),
+    'is_adjustable': Field('is_adjustable'),
+    'image': Field('image', 'image_meta', get=lambda row, context: _image(row['image'], row['image_meta'], context)),
+    'created': Field('created'),
+    'updated': Field('updated'),
+    'sizes': Field(load=_load_codes('sizes', 'size__code')),
+    'colors': Field(load=_load_codes('colors', 'color__code')),
+    'variants': Field(load=_load_variants),
+    'images': Field(load=_load_images),
+}
+
+PRODUCT_LIST_FIELDS = ('id', 'name', 'url', 'category', 'price', 'discounted_price', 'discount_percentage',
+                       'on_sale', 'in_stock', 'metal', 'image')
+PRODUCT_DETAIL_FIELDS = (*PRODUCT_LIST_FIELDS, 'slug', 'description', 'stock', 'gemstone', 'is_adjustable',
+                         'sizes', 'colors', 'variants', 'images', 'updated')
+
+CATEGORY_FIELDS = {
+    'id': Field('id'),
+    'name': Field('name'),
+    'slug': Field('slug'),
+    'parent': Field('parent_id'),
+    'url': Field('slug', get=lambda row, context: context.absolute(
+        reverse('store:product_list_by_category', args=[row['slug']]))),
+}
+
+
+def select_fields(request, available, default, single=False):
+    """The field names requested with ?fields= (default: `default`), id first."""
+    param = request.GET.get('fields')
+    if not param:
+        return list(default)
+    names = ['id', *(name.strip() for name in param.split(',') if name.strip() and name.strip() != 'id')]
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown field(s): {', '.join(unknown)}. Available: {', '.join(available)}.")
+    if not single:
+        loaded = [name for name in names if available[name].load]
+        if loaded:
+            raise ApiError(f"Field(s) only available on a single product: {', '.join(loaded)}.")
+    return list(dict.fromkeys(names))
+
+
+def sources(available, names, *extra):
+    keys = dict.fromkeys(['id', *extra])
+    for name in names:
+        keys.update(dict.fromkeys(available[name].sources))
+    return list(keys)
+
+
+def serialize(rows, available, names, context):
+    fields = [(name, available[name]) for name in names]
+    if any(field.pricing for _, field in fields):
+        context.sales = sales.resolve_rows(rows)
+    ids = [row['id'] for row in rows]
+    for name, field in fields:
+        if field.load and ids:
+            context.loaded[name] = field.load(ids, context)
+    return [
+        {
+            name: context.loaded[name].get(row['id'], []) if field.load else field.get(row, context)
+            for name, field in fields
+        }
+        for row in rows
+    ]
+
+
+# ==========================================
+# VIEWS
+# ==========================================
+def _etag(request, tags):
+    namespaces = [refdata.CACHE_NAMESPACE, *(tag_namespace(tag) for tag in ('sales', 'categories', *tags))]
+    versions = get_versions(namespaces)
+    sale_start = sales.segment_start()
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    material = [
+        API_VERSION, request.get_host(), request.path, repr(params),
+        sale_start.isoformat() if sale_start else '',
+        *(f'{name}={versions[name]}' for name in sorted(versions)),
+    ]
+    return hashlib.sha1('\n'.join(material).encode()).hexdigest()
+
+
+def _cache_timeout():
+    timeout = getattr(settings, 'STORE_API_CACHE_TIMEOUT', 60 * 60)
+    # Prices change when a flash sale starts or ends
+    boundary = sales.next_boundary()
+    if boundary is not None:
+        timeout = max(1, min(timeout, int((boundary - timezone.now()).total_seconds()) + 1))
+    return timeout
+
+
+def _finish(response, etag=None):
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    patch_cache_control(response, public=True, max_age=getattr(settings, 'STORE_API_MAX_AGE', 60))
+    return response
+
+
+def api_view(tags_func):
+    """
+    Decorator for API views that return the response data (or raise
+    ApiError / Http404). `tags_func(request,
+    *args, **kwargs)` names the page-cache tags the response depends on,
+    besides sales and categories.
+    """
+    def decorator(view_func):
+        @require_safe
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            etag = _etag(request, tags_func(request, *args, **kwargs))
+            # Django's If-None-Match handling: lists, weak validators, '*'
+            not_modified = get_conditional_response(request, etag=quote_etag(etag))
+            if not_modified is not None:
+                return _finish(not_modified, etag)
+
+            key = f'store:api:{etag}'
+            body = cache.get(key)
+            if body is None:
+                try:
+                    data = view_func(request, *args, **kwargs)
+                except ApiError as e:
+                    return HttpResponse(dumps({'error': str(e)}), status=e.status, content_type='application/json')
+                except Http404:
+                    return HttpResponse(dumps({'error': 'Not found.'}), status=404, content_type='application/json')
+                body = dumps(data)
+                cache.set(key, body, _cache_timeout())
+            return _finish(HttpResponse(body, content_type='application/json'), etag)
+        return wrapper
+    return decorator
+
+
+def _product_tags(request, pk):
+    return [f'product:{pk}']
+
+
+def _listing_tags(request):
+    return ['listing']
+
+
+def _limit(request):
+    limit = request.GET.get('limit')
+    if not limit:
+        return min(get_page_size(), MAX_LIMIT)
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise ApiError('limit must be a whole number.')
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ApiError(f'limit must be between 1 and {MAX_LIMIT}.')
+    return limit
+
+
+@api_view(_listing_tags)
+def product_list(request):
+    names = select_fields(request, PRODUCT_FIELDS, PRODUCT_LIST_FIELDS)
+    sort = request.GET.get('sort', 'newest')
+    if sort not in SORTS:
+        raise ApiError(f"sort must be one of {', '.join(SORTS)}.")
+    limit = _limit(request)
+
+    products = Product.objects.filter(available=True)
+    if request.GET.get('category'):
+        category = refdata.get_category(request.GET['category'])
+        if category is None:
+            raise ApiError(f"Unknown category '{request.GET['category']}'.", status=404)
+        products = products.filter(category__path__startswith=category.path)
+    if request.GET.get('metal'):
+        products = products.filter(metal=request.GET['metal'])
+
+    # The sort field is part of every cursor
+    rows = products.values(*sources(PRODUCT_FIELDS, names, SORT_KEYS[sort][0]))
+    rows, next_cursor = paginate(rows, sort, cursor=request.GET.get('cursor'), per_page=limit)
+
+    next_url = None
+    if next_cursor:
+        params = request.GET.copy()
+        params['cursor'] = next_cursor
+        next_url = request.build_absolute_uri(f'{request.path}?{params.urlencode()}')
+    return {
+        'data': serialize(rows, PRODUCT_FIELDS, names, Context(request)),
+        'next_cursor': next_cursor,
+        'next': next_url,
+    }
+
+
+def _get_product(pk, *keys):
+    row = Product.objects.filter(pk=pk, available=True).values(*keys).first()
+    if row is None:
+        raise Http404
+    return row
+
+
+@api_view(_product_tags)
+def product_detail(request, pk):
+    names = select_fields(request, PRODUCT_FIELDS, PRODUCT_DETAIL_FIELDS, single=True)
+    row = _get_product(pk, *sources(PRODUCT_FIELDS, names))
+    return {'data': serialize([row], PRODUCT_FIELDS, names, Context(request))[0]}
+
+
+@api_view(_product_tags)
+def product_variants(request, pk):
+    if not Product.objects.filter(pk=pk, available=True).exists():
+        raise Http404
+    return {'data': _load_variants([pk], None).get(pk, [])}
+
+
+@api_view(_product_tags)
+def product_images(request, pk):
+    row = _get_product(pk, 'id', 'image', 'image_meta')
+    context = Context(request)
+    return {
+        'data': {
+            'main': _image(row['image'], row['image_meta'], context),
+            'gallery': _load_images([pk], context).get(pk, []),
+        }
+    }
+
+
+def _walk(categories):
+    for category in categories:
+        yield category
+        yield from _walk(category.nav_children)
+
+
+@api_view(lambda request: [])
+def category_list(request):
+    """Every category, parents before their children (the nav's order)."""
+    names = select_fields(request, CATEGORY_FIELDS, tuple(CATEGORY_FIELDS))
+    rows = [
+        {'id': category.pk, 'name': category.name, 'slug': category.slug, 'parent_id': category.parent_id}
+        for category in _walk(refdata.get_category_tree())
+    ]
+    return {'data': serialize(rows, CATEGORY_FIELDS, names, Context(request))}
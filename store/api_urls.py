@@ -0,0 +1,15 @@
+from django.urls import path
+from . import api
+
+
+app_name = 'api'
+
+
+# Mounted at /api/v1/ (see store.api)
+urlpatterns = [
+    path('products/', api.product_list, name='product_list'),
+    path('products/<int:pk>/', api.product_detail, name='product_detail'),
+    path('products/<int:pk>/variants/', api.product_variants, name='product_variants'),
+    path('products/<int:pk>/images/', api.product_images, name='product_images'),
+    path('categories/', api.category_list, name='category_list'),
+]
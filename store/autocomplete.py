@@ -0,0 +1,238 @@
+"""
+In-process prefix index for search-as-you-type suggestions.
+
+Every suggestion (product, category, gemstone, metal) is indexed under each
+word-start of its label ("Ruby Ring" -> "ruby ring", "ring"), kept in one
+sorted list; a lookup is a bisect plus a short forward scan, no database.
+
+Product changes are applied incrementally in every worker: the saving
+process bumps a shared version and records the changed product id under it
+(see store.signals), other workers re-index just those products on their next
+lookup. If the change log has gaps or grows too long, or a category changes,
+the index is rebuilt from scratch.
+"""
+import re
+import threading
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.urls import reverse
+from django.utils.http import urlencode
+
+from .caching import bump_version, get_version
+
+CACHE_NAMESPACE = 'autocomplete'
+
+# Change-log entries older than this are gone; workers further behind rebuild
+CHANGE_LOG_TIMEOUT = 60 * 60
+MAX_INCREMENTAL_CHANGES = 200
+
+# Shown first among equally good matches
+TYPE_ORDER = {'category': 0, 'metal': 1, 'gemstone': 2, 'product': 3}
+
+# Matches looked at per lookup before ranking
+MAX_SCAN = 200
+
+# Loaded per product
+PRODUCT_FIELDS = ('id', 'name', 'slug', 'gemstone', 'metal', 'available')
+
+_WORD_RE = re.compile(r'\w+')
+
+_lock = threading.Lock()
+# (version, index), replaced as a whole so readers never see a mix
+_state = (None, None)
+
+
+def normalize(text):
+    return ' '.join(_WORD_RE.findall(text.casefold()))
+
+
+def _phrases(label):
+    words = normalize(label).split()
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+class PrefixIndex:
+    """Sorted (phrase, key) pairs; `key` identifies one suggestion."""
+
+    def __init__(self):
+        self._phrases = []
+        self._entries = {}        # key -> suggestion dict
+        self._entry_phrases = {}  # key -> phrases it was indexed under
+        self._refcounts = {}      # shared (gemstone/metal) key -> products using it
+        self._product_keys = {}   # product id -> shared keys it holds
+
+    def __len__(self):
+        return len(self._entries)
+
+    def copy(self):
+        clone = PrefixIndex()
+        clone._phrases = list(self._phrases)
+        clone._entries = dict(self._entries)
+        clone._entry_phrases = dict(self._entry_phrases)
+        clone._refcounts = dict(self._refcounts)
+        clone._product_keys = dict(self._product_keys)
+        return clone
+
+    def add(self, key, suggestion):
+        if key in self._entries:
+            self.remove(key)
+        phrases = _phrases(suggestion['label'])
+        for phrase in phrases:
+            insort(self._phrases, (phrase, key))
+        self._entries[key] = suggestion
+        self._entry_phrases[key] = phrases
+
+    def remove(self, key):
+        for phrase in self._entry_phrases.pop(key, ()):
+            i = bisect_left(self._phrases, (phrase, key))
+            if i < len(self._phrases) and self._phrases[i] == (phrase, key):
+                del self._phrases[i]
+        self._entries.pop(key, None)
+
+    def _acquire(self, key, suggestion):
+        count = self._refcounts.get(key, 0)
+        if not count:
+            self.add(key, suggestion)
+        self._refcounts[key] = count + 1
+
+    def _release(self, key):
+        count = self._refcounts.get(key, 0) - 1
+        if count > 0:
+            self._refcounts[key] = count
+        else:
+            self._refcounts.pop(key, None)
+            self.remove(key)
+
+    def remove_product(self, product_id):
+        self.remove(('product', product_id))
+        for key in self._product_keys.pop(product_id, ()):
+            self._release(key)
+
+    def add_product(self, product):
+        """(Re)index a product, or drop it if it's no longer for sale."""
+        self.remove_product(product.id)
+        if not product.available:
+            return
+        self.add(('product', product.id), {
+            'type': 'product',
+            'label': product.name,
+            'url': product.get_absolute_url(),
+        })
+        shared = []
+        if product.gemstone:
+            shared.append((('gemstone', product.gemstone.casefold()), {
+                'type': 'gemstone',
+                'label': product.gemstone,
+                'url': f"{reverse('store:search')}?{urlencode({'q': product.gemstone})}",
+            }))
+        if product.metal:
+            shared.append((('metal', product.metal), {
+                'type': 'metal',
+                'label': product.metal,
+                'url': f"{reverse('store:search')}?{urlencode({'metal': product.metal})}",
+            }))
+        for key, suggestion in shared:
+            self._acquire(key, suggestion)
+        self._product_keys[product.id] = [key for key, _ in shared]
+
+    def add_category(self, category):
+        self.add(('category', category.id), {
+            'type': 'category',
+            'label': category.name,
+            'url': category.get_absolute_url(),
+        })
+
+    def search(self, query, limit=8):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        matches = {}
+        i = bisect_left(self._phrases, (prefix,))
+        scanned = 0
+        while i < len(self._phrases) and scanned < MAX_SCAN:
+            phrase, key = self._phrases[i]
+            if not phrase.startswith(prefix):
+                break
+            label_start = phrase == self._entry_phrases[key][0]
+            matches[key] = matches.get(key, False) or label_start
+            i += 1
+            scanned += 1
+
+        # Whole-label matches before mid-label ones, then by type and label
+        ranked = sorted(
+            matches.items(),
+            key=lambda item: (not item[1], TYPE_ORDER[item[0][0]], self._entries[item[0]]['label'].casefold()),
+        )
+        return [self._entries[key] for key, _ in ranked[:limit]]
+
+
+def build_index():
+    from .models import Category, Product
+
+    index = PrefixIndex()
+    for category in Category.objects.all():
+        index.add_category(category)
+    for product in Product.objects.filter(available=True).only(*PRODUCT_FIELDS).iterator():
+        index.add_product(product)
+    return index
+
+
+def _change_key(version):
+    return f'store:autocomplete:change:{version}'
+
+
+def _apply_changes(index, since, version):
+    """
+    Apply the logged changes (since, version] to `index` in place. Returns
+    False if the log is incomplete and a full rebuild is needed.
+    """
+    from .models import Product
+
+    if not isinstance(since, int) or not 0 < version - since <= MAX_INCREMENTAL_CHANGES:
+        return False
+    keys = [_change_key(v) for v in range(since + 1, version + 1)]
+    logged = cache.get_many(keys)
+    if len(logged) != len(keys) or None in logged.values():
+        return False
+
+    product_ids = set(logged.values())
+    found = Product.objects.filter(id__in=product_ids).only(*PRODUCT_FIELDS)
+    for product in found:
+        index.add_product(product)
+        product_ids.discard(product.id)
+    for product_id in product_ids:  # deleted
+        index.remove_product(product_id)
+    return True
+
+
+def get_index():
+    global _state
+    version = get_version(CACHE_NAMESPACE)
+    loaded_version, index = _state
+    if loaded_version != version or index is None:
+        with _lock:
+            loaded_version, index = _state
+            if loaded_version != version or index is None:
+                # Other threads may be reading the current index: patch a copy
+                updated = index.copy() if index is not None else None
+                if updated is None or not _apply_changes(updated, loaded_version, version):
+                    updated = build_index()
+                index = updated
+                _state = (version, index)
+    return index
+
+
+def suggest(query, limit=8):
+    return get_index().search(query, limit)
+
+
+def product_changed(product_id):
+    version = bump_version(CACHE_NAMESPACE)
+    cache.set(_change_key(version), product_id, CHANGE_LOG_TIMEOUT)
+
+
+def invalidate():
+    """Force a full rebuild everywhere (e.g. a category was renamed)."""
+    version = bump_version(CACHE_NAMESPACE)
+    cache.set(_change_key(version), None, CHANGE_LOG_TIMEOUT)
@@ -0,0 +1,433 @@
+"""
+Streaming, batched product import for large CSV/Excel files.
+
+The admin's import_export import (ProductResource) is fine for a few
+hundred rows but looks up categories, sizes and colors and saves products
+one row at a time. This path reads the same columns:
+
+    id, name, slug, category, price, cost_price, discount_percentage,
+    discount_amount, stock, available, metal, gemstone, is_adjustable,
+    sizes, colors, description
+
+streaming the file BATCH_SIZE rows at a time. Categories (by slug, or by
+name when no two categories share it), sizes
+and colors (by code) come from the in-memory reference data (store.refdata),
+existing products are fetched once per batch, and products and their
+size/color through-rows are written with bulk operations, one transaction
+per batch. Only the columns present in the file are written, so a sheet of
+`id,price,stock` just reprices and restocks.
+
+A row matches an existing product by `id`, else by `slug`; anything else
+is created (name, category and price required). Bad rows are skipped and
+reported with their line number; they don't stop the import.
+
+Imports run as a ProductImportJob outside the web workers: the admin only
+queues the upload, and `import_products --pending` (from cron or a
+supervised worker) claims and runs queued jobs; `import_products <file>`
+runs one directly. Progress and a heartbeat are recorded on the job row
+after every batch, and a 'running' job whose heartbeat stops (its process
+died) is marked failed by `fail_stale_jobs()`, which the --pending runner
+calls before looking for work. Bulk writes skip Product.save()
+and its signals, so the search index and caches are updated here instead.
+"""
+import csv
+import io
+import logging
+import posixpath
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.text import slugify
+
+from . import autocomplete, facets, fuzzy, refdata, search
+from .caching import bump_version
+from .exports import unescape_formula
+from .models import METAL_CHOICES, Product, ProductImportJob
+from .page_cache import invalidate_tags, product_page_tags
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 500
+
+# A running job that hasn't recorded a batch for this long has lost its
+# process (a batch takes seconds)
+STALE_AFTER = timedelta(minutes=10)
+STALE_ERROR = 'The import stopped without finishing; rows up to the last completed batch were imported.'
+
+# Errors kept on the job (the count is always exact)
+MAX_ERRORS = 200
+
+SCALAR_COLUMNS = ('name', 'slug', 'category', 'price', 'cost_price', 'discount_percentage', 'discount_amount',
+                  'stock', 'available', 'metal', 'gemstone', 'is_adjustable', 'description')
+# Optional amounts: blank clears them
+DISCOUNT_COLUMNS = ('discount_percentage', 'discount_amount')
+M2M_COLUMNS = ('sizes', 'colors')
+
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f', ''}
+
+
+class ImportFileError(ValueError):
+    """The file as a whole can't be read."""
+
+
+class RowError(ValueError):
+    pass
+
+
+def _cell(value):
+    if value is None:
+        return ''
+    # Excel stores 5 as 5.0
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return unescape_formula(str(value).strip())
+
+
+def iter_rows(name, storage=default_storage):
+    """Yield each data row as {lower-cased column: stripped string}."""
+    ext = posixpath.splitext(name)[1].lower()
+    if ext == '.csv':
+        with storage.open(name, 'rb') as f:
+            reader = csv.reader(io.TextIOWrapper(f, encoding='utf-8-sig', newline=''))
+            header = [column.strip().lower() for column in next(reader, [])]
+            for values in reader:
+                if any(value.strip() for value in values):
+                    yield dict(zip(header, (unescape_formula(value.strip()) for value in values)))
+    elif ext in ('.xlsx', '.xlsm'):
+        try:
+            from openpyxl import load_workbook
+        except ImportError:
+            raise ImportFileError('Excel imports need the openpyxl package; upload a CSV instead.')
+        with storage.open(name, 'rb') as f:
+            workbook = load_workbook(f, read_only=True, data_only=True)
+            try:
+                rows = workbook.active.iter_rows(values_only=True)
+                header = [_cell(column).lower() for column in next(rows, ())]
+                for values in rows:
+                    cells = [_cell(value) for value in values]
+                    if any(cells):
+                        yield dict(zip(header, cells))
+            finally:
+                workbook.close()
+    else:
+        raise ImportFileError(f"Unsupported file type '{ext}'; use .csv or .xlsx.")
+
+
+def count_rows(name, storage=default_storage):
+    return sum(1 for _ in iter_rows(name, storage))
+
+
+class Lookups:
+    """Name/code -> object maps for everything a row refers to (no queries)."""
+
+    def __init__(self):
+        data = refdata.get_refdata()
+        self.categories_by_slug = data['categories_by_slug']
+        # Names aren't unique: name -> every category carrying it
+        self.categories_by_name = {}
+        for category in self.categories_by_slug.values():
+            self.categories_by_name.setdefault(category.name.lower(), []).append(category)
+        self.sizes = data['sizes']
+        self.colors = data['colors']
+
+    def category(self, value):
+        category = self.categories_by_slug.get(value.lower())
+        if category is not None:
+            return category
+        named = self.categories_by_name.get(value.lower(), [])
+        if len(named) > 1:
+            slugs = ', '.join(sorted(category.slug for category in named))
+            raise RowError(f"category '{value}' is ambiguous; use its slug ({slugs})")
+        if not named:
+            raise RowError(f"unknown category '{value}'")
+        return named[0]
+
+    def codes(self, column, value, known):
+        codes = [code.strip() for code in value.split(',') if code.strip()]
+        unknown = [code for code in codes if code not in known]
+        if unknown:
+            raise RowError(f"unknown {column}: {', '.join(unknown)}")
+        return [known[code].pk for code in codes]
+
+
+def _decimal(value, column):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise RowError(f"{column} '{value}' is not a number")
+
+
+def _amount(value, column):
+    amount = _decimal(value, column)
+    if amount < 0:
+        raise RowError(f"{column} cannot be negative")
+    return amount
+
+
+def _int(value, column):
+    try:
+        number = int(value)
+    except ValueError:
+        raise RowError(f"{column} '{value}' is not a whole number")
+    if number < 0:
+        raise RowError(f"{column} cannot be negative")
+    return number
+
+
+def _bool(value, column):
+    if value.lower() in TRUE_VALUES:
+        return True
+    if value.lower() in FALSE_VALUES:
+        return False
+    raise RowError(f"{column} '{value}' is not yes/no")
+
+
+def parse_row(row, lookups):
+    """(id or None, {field: value}, {'sizes'/'colors': [pk, ...]}) for one row."""
+    pk = _int(row['id'], 'id') if row.get('id') else None
+    fields = {}
+    for column in SCALAR_COLUMNS:
+        if column not in row:
+            continue
+        value = row[column]
+        if column == 'category':
+            if value:
+                fields['category'] = lookups.category(value)
+        elif column == 'price':
+            if value:
+                fields['price'] = _decimal(value, column)
+        elif column == 'cost_price':
+            fields['cost_price'] = _amount(value, column) if value else Decimal('0')
+        elif column in DISCOUNT_COLUMNS:
+            fields[column] = _amount(value, column) if value else None
+        elif column == 'stock':
+            fields['stock'] = _int(value, column) if value else 0
+        elif column in ('available', 'is_adjustable'):
+            fields[column] = _bool(value, column)
+        elif column == 'slug':
+            if value:
+                fields['slug'] = slugify(value)
+        else:
+            fields[column] = value
+    if (fields.get('discount_percentage') or 0) > 100:
+        raise RowError('discount_percentage cannot be over 100')
+    if fields.get('metal') and fields['metal'] not in dict(METAL_CHOICES):
+        raise RowError(f"unknown metal '{fields['metal']}'")
+
+    m2m = {}
+    if 'sizes' in row:
+        m2m['sizes'] = lookups.codes('sizes', row['sizes'], lookups.sizes)
+    if 'colors' in row:
+        m2m['colors'] = lookups.codes('colors', row['colors'], lookups.colors)
+    return pk, fields, m2m
+
+
+class ImportResult:
+    def __init__(self):
+        self.processed = 0
+        self.created = 0
+        self.updated = 0
+        self.error_count = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({'row': line, 'error': message})
+
+
+def _set_m2m(field_name, assignments):
+    """Replace the through-rows of every product in `assignments` ({pk: [related pks]})."""
+    if not assignments:
+        return
+    field = Product._meta.get_field(field_name)
+    through = field.remote_field.through
+    target = field.m2m_reverse_field_name()
+    through.objects.filter(product_id__in=list(assignments)).delete()
+    through.objects.bulk_create(
+        [through(**{'product_id': pk, f'{target}_id': related}) for pk, related_pks in assignments.items()
+         for related in dict.fromkeys(related_pks)],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def import_batch(rows, lookups, result, now=None):
+    """
+    Import a list of (line number, row) pairs. Returns the products written
+    and the categories the updated ones were in before.
+    """
+    now = now or timezone.now()
+    parsed = []
+    for line, row in rows:
+        try:
+            pk, fields, relations = parse_row(row, lookups)
+        except RowError as e:
+            result.add_error(line, str(e))
+            continue
+        slug = fields.get('slug') or (slugify(fields['name']) if fields.get('name') else None)
+        parsed.append((line, pk, slug, fields, relations))
+
+    # Everything the batch might match, in two queries
+    products = Product.objects.select_related('category')
+    by_id = products.in_bulk([pk for _, pk, _, _, _ in parsed if pk is not None])
+    by_slug = products.in_bulk([slug for _, _, slug, _, _ in parsed if slug], field_name='slug')
+
+    to_create, to_update, old_category_ids = [], {}, set()
+    new_products = {}  # so a product repeated in the batch is created once
+    update_fields = set()
+    m2m = {column: [] for column in M2M_COLUMNS}
+    for line, pk, slug, fields, relations in parsed:
+        key = ('id', pk) if pk is not None else ('slug', slug)
+        product = by_id.get(pk) if pk is not None else by_slug.get(slug)
+        product = product or new_products.get(key)
+
+        if product is None:
+            missing = [column for column in ('name', 'category', 'price') if not fields.get(column)]
+            if missing:
+                result.add_error(line, f"new products need {', '.join(missing)}")
+                continue
+            if slug in by_slug or ('slug', slug) in new_products:
+                result.add_error(line, f"slug '{slug}' is already used by another product")
+                continue
+            product = Product(id=pk, **{**fields, 'slug': slug})
+            to_create.append(product)
+            new_products[key] = new_products[('slug', slug)] = product
+        else:
+            if 'slug' in fields and fields['slug'] != product.slug and (
+                    fields['slug'] in by_slug or ('slug', fields['slug']) in new_products):
+                result.add_error(line, f"slug '{fields['slug']}' is already used by another product")
+                continue
+            if product.pk is not None and product.pk not in to_update:
+                old_category_ids.add(product.category_id)
+                to_update[product.pk] = product
+            for field, value in fields.items():
+                setattr(product, field, value)
+            update_fields.update(fields)
+
+        for column, related in relations.items():
+            m2m[column].append((product, related))
+
+    with transaction.atomic():
+        created = Product.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+        if to_update:
+            for product in to_update.values():
+                product.updated = now
+            Product.objects.bulk_update(
+                list(to_update.values()), [*sorted(update_fields), 'updated'], batch_size=BATCH_SIZE,
+            )
+        # Now that new products have ids
+        for column, assignments in m2m.items():
+            _set_m2m(column, {product.pk: related for product, related in assignments})
+
+    result.processed += len(rows)
+    result.created += len(created)
+    result.updated += len(to_update)
+    return [*created, *to_update.values()], old_category_ids
+
+
+def _after_batch(products, old_category_ids):
+    """What Product's save signals would have done for these products."""
+    for product in products:
+        search.index_product(product)
+    invalidate_tags(*product_page_tags(
+        [product.pk for product in products],
+        {product.category_id for product in products} | old_category_ids,
+    ))
+
+
+def _batches(rows, size):
+    batch = []
+    # Line 1 is the header
+    for line, row in enumerate(rows, start=2):
+        batch.append((line, row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def run(job, batch_size=BATCH_SIZE, storage=None):
+    """Run an import job to completion, recording progress on the job row."""
+    jobs = ProductImportJob.objects.filter(pk=job.pk)
+    storage = storage or job.file.storage
+    result = ImportResult()
+    job.status, job.started_at = 'running', timezone.now()
+    jobs.update(status=job.status, started_at=job.started_at, heartbeat_at=job.started_at)
+
+    try:
+        job.total_rows = count_rows(job.file.name, storage)
+        jobs.update(total_rows=job.total_rows)
+        lookups = Lookups()
+        touched = False
+        for batch in _batches(iter_rows(job.file.name, storage), batch_size):
+            products, old_category_ids = import_batch(batch, lookups, result)
+            if products:
+                touched = True
+                _after_batch(products, old_category_ids)
+            jobs.update(
+                processed_rows=result.processed, created_count=result.created,
+                updated_count=result.updated, error_count=result.error_count, errors=result.errors,
+                heartbeat_at=timezone.now(),
+            )
+        job.status = 'done'
+    except ImportFileError as e:
+        result.add_error(None, str(e))
+        job.status = 'failed'
+    except Exception:
+        logger.exception('Product import #%s failed', job.pk)
+        result.add_error(None, 'Unexpected error; rows up to the last completed batch were imported.')
+        job.status = 'failed'
+    else:
+        if touched:
+            autocomplete.invalidate()
+            fuzzy.invalidate()
+            bump_version(facets.CACHE_NAMESPACE)
+
+    job.processed_rows, job.created_count, job.updated_count = result.processed, result.created, result.updated
+    job.error_count, job.errors, job.finished_at = result.error_count, result.errors, timezone.now()
+    jobs.update(
+        status=job.status, processed_rows=job.processed_rows, created_count=job.created_count,
+        updated_count=job.updated_count, error_count=job.error_count, errors=job.errors,
+        finished_at=job.finished_at,
+    )
+    return job
+
+
+def claim(job):
+    """Mark a pending job running; False if another runner got it first."""
+    now = timezone.now()
+    return bool(ProductImportJob.objects.filter(pk=job.pk, status='pending').update(
+        status='running', started_at=now, heartbeat_at=now,
+    ))
+
+
+def run_pending(batch_size=BATCH_SIZE):
+    """Run queued jobs, oldest first, until none are left; yields each finished job."""
+    while True:
+        job = ProductImportJob.objects.filter(status='pending').order_by('created', 'pk').first()
+        if job is None:
+            return
+        if claim(job):
+            yield run(job, batch_size=batch_size)
+
+
+def fail_stale_jobs(now=None):
+    """Mark running jobs whose heartbeat stopped as failed; returns how many."""
+    now = now or timezone.now()
+    cutoff = now - STALE_AFTER
+    stale = ProductImportJob.objects.filter(status='running').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    failed = 0
+    for job in stale:
+        failed += ProductImportJob.objects.filter(pk=job.pk, status='running').update(
+            status='failed', finished_at=now, error_count=job.error_count + 1,
+            errors=[*job.errors, {'row': None, 'error': STALE_ERROR}],
+        )
+    return failed
@@ -0,0 +1,58 @@
+"""
+Small helpers for versioned cache namespaces.
+
+Each namespace has a version number stored in the shared cache. Keys built
+with `versioned_key()` embed the current version, so bumping it invalidates
+every key in the namespace at once, across all workers, without having to
+know which keys exist.
+
+"Across all workers" assumes the default cache is shared between processes
+(settings.CACHES); the store.E001 system check rejects LocMemCache.
+"""
+import time
+
+from django.core.cache import cache
+
+
+def _version_key(namespace):
+    return f'store:version:{namespace}'
+
+
+def _initial_version():
+    # Time-based rather than 1, so a version key that was evicted or flushed
+    # never comes back with a value that old entries were stored under.
+    return int(time.time() * 1000)
+
+
+def get_version(namespace):
+    version = cache.get(_version_key(namespace))
+    if version is None:
+        cache.add(_version_key(namespace), _initial_version(), None)
+        version = cache.get(_version_key(namespace), _initial_version())
+    return version
+
+
+def get_versions(namespaces):
+    """Fetch the versions of several namespaces in one cache round-trip."""
+    keys = {_version_key(namespace): namespace for namespace in namespaces}
+    found = cache.get_many(list(keys))
+    for key in keys:
+        if key not in found:
+            cache.add(key, _initial_version(), None)
+            found[key] = cache.get(key, _initial_version())
+    return {keys[key]: version for key, version in found.items()}
+
+
+def bump_version(namespace):
+    try:
+        return cache.incr(_version_key(namespace))
+    except ValueError:
+        # Key missing (evicted or never set): start a fresh version
+        version = _initial_version()
+        cache.set(_version_key(namespace), version, None)
+        return version
+
+
+def versioned_key(namespace, *parts):
+    suffix = ':'.join(str(part) for part in parts)
+    return f'store:{namespace}:{get_version(namespace)}:{suffix}'
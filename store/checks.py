@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+
+# Backends whose contents aren't seen by other processes
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Cache versions (store.caching) must be shared by all processes, or a
+    save in one worker or command never invalidates the others' pages and
+    in-memory reference data.
+    """
+    backend = settings.CACHES.get('default', {}).get('BACKEND', PROCESS_LOCAL_BACKENDS[0])
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return [Error(
+            f"The default cache ({backend}) is local to each process.",
+            hint='Use a shared backend (Redis, memcached, database or file-based); '
+                 'see CACHES in settings.py.',
+            id='store.E001',
+        )]
+    return []
@@ -0,0 +1,68 @@
+"""
+Conditional GET (ETag / Last-Modified) for catalog pages.
+
+Validators come from the page cache (store.page_cache): when a page is
+built, the versions of the tags it depends on, plus the current flash-sale
+segment, are its fingerprint. While the cached copy is fresh, a browser or
+crawler revalidating it gets a 304 before the view runs, from cached
+version keys alone (no database query). Once the copy has gone stale the
+page is rebuilt, and a request whose validator still matches the new copy
+gets a 304 instead of the body.
+
+Only requests the page cache would serve get validators: pages for
+logged-in users and pages carrying flash messages are personal. The
+per-visitor bits of a shared page (cart count, CSRF cookie) go into the
+ETag, so a visitor whose cart changed gets the page again.
+"""
+import hashlib
+from calendar import timegm
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from .page_cache import is_cacheable_request, get_cached_entry
+
+
+def _visitor_state(request):
+    # Read the session directly: a count needs no products resolved
+    cart = request.session.get(settings.CART_SESSION_ID) or {}
+    count = sum(item['quantity'] for item in cart.values())
+    return f"{count}:{request.COOKIES.get(settings.CSRF_COOKIE_NAME, '')}"
+
+
+def _validators(request, page):
+    """(etag, last_modified timestamp) for this visitor from a page's (fingerprint, built)."""
+    fingerprint, built = page
+    etag = hashlib.sha1(f'{fingerprint}:{_visitor_state(request)}'.encode()).hexdigest()
+    return quote_etag(etag), timegm(built.utctimetuple())
+
+
+def conditional_page(view_func):
+    """
+    Decorator (outside cache_anonymous_page): answer If-None-Match /
+    If-Modified-Since with a 304 when the page hasn't changed.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return view_func(request, *args, **kwargs)
+
+        entry = get_cached_entry(request)
+        if entry is not None and entry.get('validators'):
+            etag, last_modified = _validators(request, entry['validators'])
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is not None:
+                return response
+
+        response = view_func(request, *args, **kwargs)
+        # Set by cache_anonymous_page, from a fresh entry or the page just built
+        page = getattr(request, '_page_validators', None)
+        if page is None or response.status_code != 200:
+            return response
+        etag, last_modified = _validators(request, page)
+        response.headers.setdefault('ETag', etag)
+        response.headers.setdefault('Last-Modified', http_date(last_modified))
+        return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+    return wrapper
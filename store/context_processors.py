@@ -1,15 +1,16 @@
-from .models import Category, Theme, HeroSection
+from . import refdata
 
 def categories(request):
+    # Top-level categories with their children attached (process-local cache)
     return {
-        'categories': Category.objects.filter(parent=None)
+        'categories': refdata.get_category_tree()
     }
 
 def active_theme(request):
-    theme = Theme.objects.filter(is_active=True).first()
+    theme = refdata.get_active_theme()
     return {'active_theme': theme}
 
 def active_hero(request):
     """Provides the active hero section configuration to all templates."""
-    hero = HeroSection.objects.filter(is_active=True).first()
+    hero = refdata.get_active_hero()
     return {'active_hero': hero}
@@ -2,6 +2,7 @@ from django.shortcuts import render
 from django.contrib.admin.views.decorators import staff_member_required
 from django.db.models import Sum, F, Count
 from django.utils import timezone
+from cart.cart import avoided_session_writes
 from orders.models import Order, OrderItem
 from .models import Product, Visitor
 
@@ -40,6 +41,9 @@ def admin_dashboard(request):
     
     # Recent Visits
     recent_visits = Visitor.objects.order_by('-created')[:10]
+
+    # Anonymous page views that no longer store an empty cart in a session
+    session_writes_avoided = avoided_session_writes()
     
     context = {
         'total_orders': total_orders,
@@ -51,6 +55,7 @@ def admin_dashboard(request):
         'visitors_today': visitors_today,
         'top_sources': top_sources,
         'recent_visits': recent_visits,
+        'session_writes_avoided': session_writes_avoided,
     }
     
     return render(request, 'store/dashboard.html', context)
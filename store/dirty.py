@@ -0,0 +1,124 @@
+"""
+Dirty-field tracking for models.
+
+Instances loaded from the database remember the values they were loaded
+with (`from_db`), so code can ask what changed without re-reading the row:
+
+    product = Product.objects.get(pk=1)
+    product.stock -= 1
+    product.get_dirty_fields()   # {'stock': 5}
+    product.save()               # UPDATE ... SET stock, updated
+
+`save()` without `update_fields` writes only the changed columns (plus
+`auto_now` ones), or every column when none changed, so an explicit
+re-save still writes and sends post_save. Post-save signal receivers
+still see the pre-save snapshot, so they can skip work when nothing they
+care about changed; the snapshot is refreshed once `save()` returns.
+
+Instances that weren't loaded from the database (new ones, or built with
+an explicit pk) aren't tracked: every field counts as changed and saves
+write every column, as usual.
+"""
+import copy
+
+from django.db.models.fields.files import FieldFile
+
+
+def _snapshot_value(value):
+    # JSON fields hand out mutable dicts/lists that get edited in place, and
+    # a FieldFile's name can be reassigned (it compares equal to its name)
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    if isinstance(value, FieldFile):
+        return value.name
+    return value
+
+
+class DirtyFieldsMixin:
+    _loaded_values = None
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # field_names are attnames, in the order of `values`
+        instance._loaded_values = {
+            attname: _snapshot_value(value) for attname, value in zip(field_names, values)
+        }
+        return instance
+
+    @classmethod
+    def _tracked_attnames(cls):
+        return [field.attname for field in cls._meta.concrete_fields]
+
+    @property
+    def is_tracked(self):
+        """True if the instance knows the values it was loaded with."""
+        return self._loaded_values is not None and not self._state.adding
+
+    def _snapshot(self):
+        self._loaded_values = {
+            attname: _snapshot_value(self.__dict__[attname])
+            for attname in self._tracked_attnames()
+            if attname in self.__dict__
+        }
+
+    def get_dirty_fields(self):
+        """{attname: loaded value} for every loaded field that changed."""
+        if not self.is_tracked:
+            return {attname: None for attname in self._tracked_attnames() if attname in self.__dict__}
+        missing = object()
+        dirty = {}
+        for attname in self._tracked_attnames():
+            if attname not in self.__dict__:
+                continue  # deferred and never touched
+            original = self._loaded_values.get(attname, missing)
+            if original is missing or original != self.__dict__[attname]:
+                dirty[attname] = None if original is missing else original
+        return dirty
+
+    def has_changed(self, *field_names):
+        """True if any of the named fields (name or attname) changed."""
+        if not self.is_tracked:
+            return True
+        dirty = self.get_dirty_fields()
+        return any(self._meta.get_field(name).attname in dirty for name in field_names)
+
+    def get_original(self, field_name, default=None):
+        """The value a field was loaded with (`default` if not tracked)."""
+        if not self.is_tracked:
+            return default
+        return self._loaded_values.get(self._meta.get_field(field_name).attname, default)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        if self._loaded_values is None:
+            return
+        if fields is None:
+            attnames = self._tracked_attnames()
+        else:
+            attnames = [self._meta.get_field(name).attname for name in fields if not name.startswith('_')]
+        for attname in attnames:
+            if attname in self.__dict__:
+                self._loaded_values[attname] = _snapshot_value(self.__dict__[attname])
+
+    def save(self, *args, **kwargs):
+        if not args and kwargs.get('update_fields') is None and self._can_update_dirty_fields(kwargs):
+            dirty = self.get_dirty_fields()
+            update_fields = {
+                field.name for field in self._meta.concrete_fields
+                if field.attname in dirty or getattr(field, 'auto_now', False)
+            }
+            # An empty update_fields makes Django skip the save and its
+            # signals; an explicit re-save should still send post_save
+            if update_fields:
+                kwargs['update_fields'] = update_fields
+        super().save(*args, **kwargs)
+        self._snapshot()
+
+    def _can_update_dirty_fields(self, kwargs):
+        if not self.is_tracked or self.pk is None:
+            return False
+        if kwargs.get('force_insert') or kwargs.get('using') not in (None, self._state.db):
+            return False
+        # A changed primary key means a different row
+        return self._meta.pk.attname not in self.get_dirty_fields()
@@ -0,0 +1,346 @@
+"""
+Streaming CSV/XLSX exports.
+
+The import_export "Export" button builds the whole dataset (model
+instances, then a tablib Dataset, then the file) in memory before sending
+a byte. These exports read `values()` rows with `iterator(chunk_size=...)`
+and write them out as they arrive, so memory stays flat however many rows
+there are:
+
+    class OrderExport(Export):
+        name, label = 'orders', 'Orders'
+        model = Order
+        fields = ('id', 'created', 'first_name')
+        columns = (('Order', 'id'), ('Date', 'created'), ('Name', 'first_name'))
+
+    OrderExport().response(queryset, 'csv', start=date(2025, 1, 1))
+
+A column is (header, values() key) or (header, callable(row dict)).
+`add_to_chunk()` can decorate each chunk of rows with one extra query
+(e.g. many-to-many codes) instead of one per row.
+
+CSV is streamed row by row. XLSX is not: the file is a zip archive that
+can't be written front to back, so the whole workbook is built (rows go
+through openpyxl's write-only mode, which spools them to a temporary file,
+so memory still stays flat) before the first byte is sent, and only then
+streamed from disk. A very large XLSX export can therefore outlast a proxy
+timeout where the CSV one wouldn't. openpyxl is optional; without it only
+CSV is offered.
+
+Text cells that a spreadsheet would run as a formula (starting with =, +,
+-, @, tab or CR) are prefixed with an apostrophe; store.bulk_import drops
+it again, so exported sheets still round-trip.
+
+ExportAdminMixin adds the export (with a date range, on top of the current
+changelist filters) to a ModelAdmin.
+"""
+import csv
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django import forms
+from django.core.exceptions import PermissionDenied
+from django.http import StreamingHttpResponse
+from django.template.response import TemplateResponse
+from django.urls import path
+from django.utils import timezone
+
+from .models import Product
+
+CHUNK_SIZE = 2000
+
+# Rows written to the CSV writer per yielded piece of the response
+ROWS_PER_PIECE = 100
+
+# In-memory size of a spooled XLSX file before it moves to disk
+XLSX_SPOOL_SIZE = 1024 * 1024
+XLSX_READ_SIZE = 64 * 1024
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def xlsx_available():
+    try:
+        import openpyxl  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def available_formats():
+    return ['csv', 'xlsx'] if xlsx_available() else ['csv']
+
+
+def date_range(start=None, end=None):
+    """Aware datetimes [from, to) for the inclusive local dates start..end."""
+    tz = timezone.get_current_timezone()
+    since = timezone.make_aware(datetime.combine(start, time.min), tz) if start else None
+    until = timezone.make_aware(datetime.combine(end + timedelta(days=1), time.min), tz) if end else None
+    return since, until
+
+
+# Leading characters that make a spreadsheet treat text as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def escape_formula(value):
+    """Text as a spreadsheet will show it, never as a formula to run."""
+    return "'" + value if value.startswith(FORMULA_PREFIXES) else value
+
+
+def unescape_formula(value):
+    """Undo escape_formula() (for re-imported exports)."""
+    return value[1:] if value.startswith("'") and value[1:].startswith(FORMULA_PREFIXES) else value
+
+
+def _cell(value):
+    if isinstance(value, str):
+        return escape_formula(value)
+    # openpyxl rejects aware datetimes, and spreadsheets have no time zones
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            value = timezone.localtime(value)
+        return value.replace(tzinfo=None, microsecond=0)
+    return value
+
+
+def _csv_cell(value):
+    value = _cell(value)
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+class _Echo:
+    """csv.writer target that hands each line back instead of storing it."""
+
+    def write(self, value):
+        return value
+
+
+class Export:
+    name = ''
+    label = ''
+    model = None
+    # values() keys read from the database
+    fields = ()
+    # (header, values() key or callable(row)) in output order
+    columns = ()
+    # Field the date range applies to
+    date_field = 'created'
+    # Lookup that limits this export to a queryset of another model (used
+    # by ExportAdminMixin when the admin's model differs, e.g. order lines
+    # of the filtered orders)
+    related_filter = None
+    ordering = ('pk',)
+    chunk_size = CHUNK_SIZE
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def filter(self, queryset, start=None, end=None):
+        since, until = date_range(start, end)
+        if since:
+            queryset = queryset.filter(**{f'{self.date_field}__gte': since})
+        if until:
+            queryset = queryset.filter(**{f'{self.date_field}__lt': until})
+        return queryset
+
+    def add_to_chunk(self, rows):
+        """Hook: add keys to a list of row dicts (one query per chunk)."""
+
+    def headers(self):
+        return [header for header, _ in self.columns]
+
+    def _chunks(self, queryset):
+        chunk = []
+        values = queryset.order_by(*self.ordering).values(*self.fields)
+        for row in values.iterator(chunk_size=self.chunk_size):
+            chunk.append(row)
+            if len(chunk) >= self.chunk_size:
+                self.add_to_chunk(chunk)
+                yield chunk
+                chunk = []
+        if chunk:
+            self.add_to_chunk(chunk)
+            yield chunk
+
+    def rows(self, queryset):
+        """Output rows (lists, in column order), one at a time."""
+        getters = [
+            source if callable(source) else (lambda row, key=source: row[key])
+            for _, source in self.columns
+        ]
+        for chunk in self._chunks(queryset):
+            for row in chunk:
+                yield [getter(row) for getter in getters]
+
+    def iter_csv(self, queryset):
+        writer = csv.writer(_Echo())
+        # The BOM makes Excel read the file as UTF-8
+        yield '\ufeff' + writer.writerow(self.headers())
+        piece = []
+        for row in self.rows(queryset):
+            piece.append(writer.writerow([_csv_cell(value) for value in row]))
+            if len(piece) >= ROWS_PER_PIECE:
+                yield ''.join(piece)
+                piece = []
+        if piece:
+            yield ''.join(piece)
+
+    def iter_xlsx(self, queryset):
+        """The finished workbook in pieces; the first only once every row is written."""
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet(title=(self.label or self.name)[:31])
+        sheet.append(self.headers())
+        for row in self.rows(queryset):
+            sheet.append([_cell(value) for value in row])
+        with tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_SIZE) as f:
+            workbook.save(f)
+            f.seek(0)
+            while True:
+                data = f.read(XLSX_READ_SIZE)
+                if not data:
+                    return
+                yield data
+
+    def filename(self, file_format, start=None, end=None):
+        parts = [self.name]
+        if start or end:
+            parts.append(f"{start or 'start'}_{end or timezone.localdate()}")
+        else:
+            parts.append(str(timezone.localdate()))
+        return f"{'-'.join(parts)}.{file_format}"
+
+    def response(self, queryset=None, file_format='csv', start=None, end=None):
+        if file_format not in available_formats():
+            raise ValueError(f'Unsupported export format {file_format!r}')
+        queryset = self.filter(self.get_queryset() if queryset is None else queryset, start, end)
+        content = self.iter_xlsx(queryset) if file_format == 'xlsx' else self.iter_csv(queryset)
+        response = StreamingHttpResponse(content, content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="{self.filename(file_format, start, end)}"'
+        return response
+
+
+class ProductExport(Export):
+    """
+    The columns bulk_import reads, plus dates, so sheets round-trip. The
+    category is written as its slug: names aren't unique.
+    """
+    name = 'products'
+    label = 'Products'
+    fields = (
+        'id', 'name', 'slug', 'category__slug', 'price', 'cost_price', 'discount_percentage',
+        'discount_amount', 'stock', 'available', 'metal', 'gemstone', 'is_adjustable',
+        'description', 'created', 'updated',
+    )
+    columns = (
+        ('id', 'id'), ('name', 'name'), ('slug', 'slug'), ('category', 'category__slug'),
+        ('price', 'price'), ('cost_price', 'cost_price'), ('discount_percentage', 'discount_percentage'),
+        ('discount_amount', 'discount_amount'), ('stock', 'stock'), ('available', 'available'),
+        ('metal', 'metal'), ('gemstone', 'gemstone'), ('is_adjustable', 'is_adjustable'),
+        ('sizes', 'sizes'), ('colors', 'colors'), ('description', 'description'),
+        ('created', 'created'), ('updated', 'updated'),
+    )
+
+    model = Product
+
+    def add_to_chunk(self, rows):
+        ids = [row['id'] for row in rows]
+        codes = {}
+        for field, code in (('sizes', 'size__code'), ('colors', 'color__code')):
+            through = self.model._meta.get_field(field).remote_field.through
+            found = {}
+            pairs = through.objects.filter(product_id__in=ids).order_by('pk').values_list('product_id', code)
+            for product_id, value in pairs:
+                found.setdefault(product_id, []).append(value)
+            codes[field] = found
+        for row in rows:
+            row['sizes'] = ','.join(codes['sizes'].get(row['id'], ()))
+            row['colors'] = ','.join(codes['colors'].get(row['id'], ()))
+
+
+class ExportForm(forms.Form):
+    start = forms.DateField(required=False, label='From', widget=forms.DateInput(attrs={'type': 'date'}))
+    end = forms.DateField(required=False, label='To', widget=forms.DateInput(attrs={'type': 'date'}))
+    file_format = forms.ChoiceField(label='Format')
+
+    def __init__(self, *args, exports=(), **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['file_format'].choices = [(fmt, fmt.upper()) for fmt in available_formats()]
+        if len(exports) > 1:
+            self.fields['dataset'] = forms.ChoiceField(
+                choices=[(export.name, export.label) for export in exports], label='Export',
+            )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        start, end = cleaned_data.get('start'), cleaned_data.get('end')
+        if start and end and start > end:
+            raise forms.ValidationError('The start date must not be after the end date.')
+        return cleaned_data
+
+
+class ExportAdminMixin:
+    """
+    A streaming "export/" view for a ModelAdmin. The changelist's filters
+    and search carry over (the Export link keeps its query string), and the
+    form adds a date range and the format.
+
+    On an ImportExportModelAdmin this replaces import_export's in-memory
+    export behind the same button; elsewhere use the changelist template
+    admin/store/change_list_export.html for the button.
+    """
+    exports = ()
+
+    def get_urls(self):
+        info = self.opts.app_label, self.opts.model_name
+        return [
+            path('export/', self.admin_site.admin_view(self.export_action), name='%s_%s_export' % info),
+            *super().get_urls(),
+        ]
+
+    def has_export_permission(self, request):
+        return self.has_view_permission(request)
+
+    def changelist_view(self, request, extra_context=None):
+        extra_context = {'has_export_permission': self.has_export_permission(request), **(extra_context or {})}
+        return super().changelist_view(request, extra_context)
+
+    def get_export_queryset(self, request):
+        try:
+            return self.get_changelist_instance(request).get_queryset(request)
+        except Exception:
+            # Stale or hand-edited filter parameters: export everything
+            return self.get_queryset(request)
+
+    def export_action(self, request):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        exports = [export() for export in self.exports]
+        form = ExportForm(request.POST or None, exports=exports)
+        if form.is_valid():
+            name = form.cleaned_data.get('dataset', exports[0].name)
+            export = next(export for export in exports if export.name == name)
+            queryset = self.get_export_queryset(request)
+            if export.model is not self.model:
+                queryset = export.get_queryset().filter(**{export.related_filter: queryset})
+            return export.response(
+                queryset, form.cleaned_data['file_format'],
+                start=form.cleaned_data['start'], end=form.cleaned_data['end'],
+            )
+        return TemplateResponse(request, 'admin/store/export.html', {
+            **self.admin_site.each_context(request),
+            'title': f'Export {self.opts.verbose_name_plural}',
+            'opts': self.opts,
+            'form': form,
+            'xlsx_available': xlsx_available(),
+        })
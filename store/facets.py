@@ -0,0 +1,216 @@
+"""
+Facet counts for the search sidebar.
+
+A facet index (per-value sets of available product ids) is built with four
+queries and cached until the catalog changes. Counts for any filter set are
+then computed with set intersections in Python, and the finished result is
+cached per normalized filter signature, so a sidebar render costs one cache
+lookup in the common case.
+
+Counts are disjunctive: each facet is counted against the results of every
+*other* active filter, so selecting "Gold" still shows how many "Silver"
+products the rest of the filters would return.
+"""
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+
+from .caching import versioned_key
+
+CACHE_NAMESPACE = 'facets'
+CACHE_TIMEOUT = 60 * 60
+
+# Product fields the index is built from (saves touching none skip the rebuild)
+PRODUCT_FIELDS = ('price', 'metal', 'category', 'available')
+
+# (min_price, max_price) pairs, inclusive like the min_price/max_price
+# filters they link to; None means unbounded.
+PRICE_BUCKETS = [
+    (None, 500),
+    (500, 1000),
+    (1000, 2000),
+    (2000, 5000),
+    (5000, None),
+]
+
+FACETS = ('category', 'metal', 'size', 'color')
+
+
+def _to_decimal(value):
+    if value in (None, ''):
+        return None
+    try:
+        value = Decimal(str(value))
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() else None
+
+
+def normalize_filters(query=None, category=None, metals=(), sizes=(), colors=(), min_price=None, max_price=None):
+    """Canonical filter dict; equal filter sets produce equal signatures."""
+    return {
+        'q': (query or '').strip().lower(),
+        'category': sorted({category}) if category else [],
+        'metal': sorted(set(filter(None, metals))),
+        'size': sorted(set(filter(None, sizes))),
+        'color': sorted(set(filter(None, colors))),
+        'min_price': str(_to_decimal(min_price)) if _to_decimal(min_price) is not None else None,
+        'max_price': str(_to_decimal(max_price)) if _to_decimal(max_price) is not None else None,
+    }
+
+
+def filter_signature(filters):
+    raw = json.dumps(filters, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def price_bucket_label(low, high):
+    if low is None:
+        return f'Under TK.{high}'
+    if high is None:
+        return f'TK.{low} and above'
+    return f'TK.{low} - TK.{high}'
+
+
+def build_facet_index():
+    """Build per-facet-value id sets for all available products."""
+    from .models import Category, Product
+
+    index = {
+        'all': set(),
+        'prices': {},
+        'labels': {facet: {} for facet in FACETS},
+    }
+    for facet in FACETS:
+        index[facet] = {}
+
+    categories = {pk: (slug, name) for pk, slug, name in Category.objects.values_list('id', 'slug', 'name')}
+
+    rows = Product.objects.filter(available=True).values_list(
+        'id', 'price', 'metal', 'category__path'
+    )
+    for product_id, price, metal, cat_path in rows:
+        index['all'].add(product_id)
+        index['prices'][product_id] = price
+        # A product counts towards its category and every ancestor
+        for cat_id in cat_path.split('/'):
+            if cat_id and int(cat_id) in categories:
+                cat_slug, cat_name = categories[int(cat_id)]
+                index['category'].setdefault(cat_slug, set()).add(product_id)
+                index['labels']['category'][cat_slug] = cat_name
+        if metal:
+            index['metal'].setdefault(metal, set()).add(product_id)
+            index['labels']['metal'][metal] = metal
+
+    for facet, through, column in (
+        ('size', Product.sizes.through, 'size'),
+        ('color', Product.colors.through, 'color'),
+    ):
+        rows = through.objects.filter(product__available=True).values_list(
+            'product_id', f'{column}__code', f'{column}__name'
+        )
+        for product_id, code, name in rows:
+            index[facet].setdefault(code, set()).add(product_id)
+            index['labels'][facet][code] = name
+
+    return index
+
+
+def get_facet_index():
+    key = versioned_key(CACHE_NAMESPACE, 'index')
+    index = cache.get(key)
+    if index is None:
+        index = build_facet_index()
+        cache.set(key, index, CACHE_TIMEOUT)
+    return index
+
+
+def _price_ids(index, ids, low, high):
+    prices = index['prices']
+    return {
+        pid for pid in ids
+        if (low is None or prices[pid] >= low) and (high is None or prices[pid] <= high)
+    }
+
+
+def compute_facets(filters, query_ids=None, index=None):
+    """
+    Compute facet counts for normalized `filters`.
+    `query_ids` is the set of product ids matching the text query, if any.
+    """
+    index = index or get_facet_index()
+    base = set(index['all'])
+    if query_ids is not None:
+        base &= query_ids
+
+    # Ids allowed by each facet's own selection (OR within a facet)
+    selected = {}
+    for facet in FACETS:
+        if filters[facet]:
+            allowed = set()
+            for value in filters[facet]:
+                allowed |= index[facet].get(value, set())
+            selected[facet] = allowed
+
+    low = _to_decimal(filters['min_price'])
+    high = _to_decimal(filters['max_price'])
+    with_price = _price_ids(index, base, low, high) if (low is not None or high is not None) else base
+
+    def restrict(ids, skip):
+        for facet, allowed in selected.items():
+            if facet != skip:
+                ids = ids & allowed
+        return ids
+
+    result = {}
+    for facet in FACETS:
+        candidates = restrict(with_price, facet)
+        values = []
+        for value, ids in index[facet].items():
+            count = len(candidates & ids)
+            is_selected = value in filters[facet]
+            if count or is_selected:
+                values.append({
+                    'value': value,
+                    'label': index['labels'][facet].get(value, value),
+                    'count': count,
+                    'selected': is_selected,
+                })
+        values.sort(key=lambda v: v['label'].lower())
+        result[facet] = values
+
+    # Price buckets are counted against everything except the price range
+    candidates = restrict(base, None)
+    result['price'] = [
+        {
+            'min_price': b_low,
+            'max_price': b_high,
+            'label': price_bucket_label(b_low, b_high),
+            'count': len(_price_ids(index, candidates, b_low, b_high)),
+            'selected': (
+                filters['min_price'] == (str(Decimal(b_low)) if b_low is not None else None) and
+                filters['max_price'] == (str(Decimal(b_high)) if b_high is not None else None)
+            ),
+        }
+        for b_low, b_high in PRICE_BUCKETS
+    ]
+    result['total'] = len(restrict(with_price, None))
+    return result
+
+
+def get_facets(filters, query_ids_func=None):
+    """
+    Cached facet counts for `filters`. `query_ids_func` is only called on a
+    cache miss when a text query is active, so cache hits cost no SQL.
+    """
+    key = versioned_key(CACHE_NAMESPACE, 'counts', filter_signature(filters))
+    facets = cache.get(key)
+    if facets is None:
+        query_ids = None
+        if filters['q'] and query_ids_func is not None:
+            query_ids = set(query_ids_func())
+        facets = compute_facets(filters, query_ids=query_ids)
+        cache.set(key, facets, CACHE_TIMEOUT)
+    return facets
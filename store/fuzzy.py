@@ -0,0 +1,227 @@
+"""
+Typo and transliteration tolerance for product search.
+
+Customers type "neklace", "churi", "kaner dul" or Bangla script. The exact
+full-text index (store.search) finds nothing for these, so only then the
+query is rewritten:
+
+1. Known Bangla/Banglish words and phrases are replaced with the English
+   catalog term (SYNONYMS).
+2. Remaining unknown words are corrected to the closest word in the catalog
+   vocabulary (product names, gemstones, metals, category names, plus the
+   synonym keys themselves) by trigram similarity.
+
+The rewritten query goes back through the exact index. Resolutions are
+cached per query, and the vocabulary's trigram index lives in process memory
+and is rebuilt when products or categories change (see store.signals), so
+the common path costs one cache lookup.
+"""
+import hashlib
+import re
+import threading
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+
+from .caching import bump_version, get_version, versioned_key
+from .search import search_products
+
+CACHE_NAMESPACE = 'fuzzy'
+
+# Product fields the vocabulary is built from
+PRODUCT_FIELDS = ('name', 'gemstone', 'metal', 'available')
+
+# Same threshold as PostgreSQL's pg_trgm
+SIMILARITY_THRESHOLD = 0.3
+
+# Words shorter than this are never corrected (too many near misses)
+MIN_WORD_LENGTH = 3
+
+RESOLUTION_TIMEOUT = 60 * 60 * 24
+
+# Cached resolution of a query that needs no rewriting. Keys are
+# case-insensitive, so the caller's own spelling is returned, never the
+# first caller's.
+UNCHANGED = ''
+
+# Bangla script and common romanizations -> catalog terms
+SYNONYMS = {
+    # Bangles
+    'churi': 'bangle', 'chudi': 'bangle', 'chori': 'bangle', 'bala': 'bangle',
+    'চুড়ি': 'bangle', 'চুরি': 'bangle', 'বালা': 'bangle',
+    # Earrings
+    'kaner dul': 'earring', 'kaner': 'earring', 'dul': 'earring', 'jhumka': 'earring', 'jhumki': 'earring',
+    'কানের দুল': 'earring', 'দুল': 'earring', 'ঝুমকা': 'earring',
+    # Nose pins
+    'nakful': 'nose pin', 'nak ful': 'nose pin', 'nolok': 'nose ring',
+    'নাকফুল': 'nose pin', 'নোলক': 'nose ring',
+    # Rings
+    'angti': 'ring', 'angthi': 'ring', 'আংটি': 'ring',
+    # Necklaces
+    'mala': 'necklace', 'har': 'necklace', 'haar': 'necklace', 'gola': 'necklace',
+    'মালা': 'necklace', 'হার': 'necklace', 'গলার হার': 'necklace',
+    # Anklets
+    'nupur': 'anklet', 'payel': 'anklet', 'payal': 'anklet', 'নূপুর': 'anklet', 'পায়েল': 'anklet',
+    # Maang tikka
+    'tikli': 'tikka', 'tikla': 'tikka', 'টিকলি': 'tikka',
+    # Bracelets
+    'bracelate': 'bracelet', 'braclet': 'bracelet',
+    # Metals and stones
+    'sona': 'gold', 'shona': 'gold', 'সোনা': 'gold',
+    'rupa': 'silver', 'rupo': 'silver', 'রুপা': 'silver', 'রূপা': 'silver',
+    'hira': 'diamond', 'heera': 'diamond', 'হীরা': 'diamond', 'হিরা': 'diamond',
+    'mukta': 'pearl', 'মুক্তা': 'pearl',
+    'pathor': 'stone', 'পাথর': 'stone',
+}
+_MAX_SYNONYM_WORDS = max(len(key.split()) for key in SYNONYMS)
+
+# \w misses Bangla vowel signs (combining marks), so include the whole block
+_WORD_RE = re.compile(r'[\w\u0980-\u09FF]+')
+
+_lock = threading.Lock()
+# (version, index), replaced as a whole so readers never see a mix
+_state = (None, None)
+
+
+def tokenize(text):
+    return _WORD_RE.findall((text or '').casefold())
+
+
+def apply_synonyms(words):
+    """Replace known phrases (longest first) with their catalog term."""
+    result = []
+    i = 0
+    while i < len(words):
+        for size in range(min(_MAX_SYNONYM_WORDS, len(words) - i), 0, -1):
+            phrase = ' '.join(words[i:i + size])
+            if phrase in SYNONYMS:
+                result.extend(SYNONYMS[phrase].split())
+                i += size
+                break
+        else:
+            result.append(words[i])
+            i += 1
+    return result
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Inverted index from trigram to vocabulary words."""
+
+    def __init__(self, replacements):
+        # word -> what to search for instead (itself, or a synonym's target)
+        self.replacements = replacements
+        self._trigrams = {}
+        self._postings = defaultdict(list)
+        for word in replacements:
+            grams = trigrams(word)
+            self._trigrams[word] = len(grams)
+            for gram in grams:
+                self._postings[gram].append(word)
+
+    def closest(self, word, threshold=SIMILARITY_THRESHOLD):
+        """Most similar vocabulary word (Jaccard over trigrams), or None."""
+        grams = trigrams(word)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        best, best_score = None, threshold
+        for candidate, overlap in shared.items():
+            score = overlap / (len(grams) + self._trigrams[candidate] - overlap)
+            # Ties go to the shorter, then alphabetically first word
+            if score > best_score or (score == best_score and best and (len(candidate), candidate) < (len(best), best)):
+                best, best_score = candidate, score
+        return best
+
+    def correct(self, words):
+        """Replace unknown words; drops words with no close match at all."""
+        corrected = []
+        for word in words:
+            if word in self.replacements or len(word) < MIN_WORD_LENGTH:
+                corrected.append(word)
+                continue
+            match = self.closest(word)
+            if match:
+                corrected.extend(self.replacements[match].split())
+        return corrected
+
+
+def build_index():
+    from .models import Category, Product
+
+    replacements = {}
+    rows = Product.objects.filter(available=True).values_list('name', 'gemstone', 'metal')
+    for row in rows.iterator():
+        for text in row:
+            for word in tokenize(text):
+                replacements[word] = word
+    for name in Category.objects.values_list('name', flat=True):
+        for word in tokenize(name):
+            replacements[word] = word
+    for key, target in SYNONYMS.items():
+        if ' ' not in key:
+            replacements.setdefault(key, target)
+    return TrigramIndex(replacements)
+
+
+def get_index():
+    global _state
+    version = get_version(CACHE_NAMESPACE)
+    loaded_version, index = _state
+    if loaded_version != version or index is None:
+        with _lock:
+            loaded_version, index = _state
+            if loaded_version != version or index is None:
+                index = build_index()
+                _state = (version, index)
+    return index
+
+
+def invalidate():
+    bump_version(CACHE_NAMESPACE)
+
+
+def _has_results(query):
+    from .models import Product
+
+    return search_products(Product.objects.filter(available=True), query).exists()
+
+
+def _resolve(query):
+    if _has_results(query):
+        return query
+
+    words = tokenize(query)
+    candidates = []
+    translated = apply_synonyms(words)
+    if translated != words:
+        candidates.append(translated)
+    corrected = get_index().correct(translated)
+    if corrected and corrected != translated:
+        candidates.append(corrected)
+
+    for candidate in candidates:
+        rewritten = ' '.join(candidate)
+        if _has_results(rewritten):
+            return rewritten
+    return query
+
+
+def resolve_query(query):
+    """
+    The query to actually search for: `query` itself whenever the exact
+    index has results for it, otherwise its translated/corrected form (if
+    that finds anything).
+    """
+    if not query or not query.strip():
+        return query
+    key = versioned_key(CACHE_NAMESPACE, 'query', hashlib.sha1(query.strip().casefold().encode()).hexdigest())
+    resolved = cache.get(key)
+    if resolved is None:
+        resolved = _resolve(query)
+        cache.set(key, UNCHANGED if resolved == query else resolved, RESOLUTION_TIMEOUT)
+    return resolved or query
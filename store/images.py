@@ -0,0 +1,169 @@
+"""
+Responsive image derivatives.
+
+Every uploaded product, gallery and hero image gets resized copies at
+several widths, in WebP and JPEG, stored next to the media as
+
+    derivatives/<original path without extension>/<width>w.<webp|jpg>
+
+The results are recorded in the model's `<field>_meta` JSON field:
+
+    {'name': <source file name>, 'width': ..., 'height': ...,
+     'widths': [320, 640, ...], 'placeholder': 'data:image/webp;base64,...'}
+
+`name` tells us whether the derivatives are still for the current upload.
+Derivatives are generated right after a new upload is saved (see
+store.signals); existing media without them are backfilled with the
+generate_image_derivatives command, never on an unrelated save. Templates use the tags in
+store.templatetags.image_tags.
+"""
+import base64
+import logging
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+logger = logging.getLogger(__name__)
+
+WIDTHS = (320, 640, 960, 1280, 1920)
+
+# (extension, Pillow format, MIME type), in <source> preference order
+FORMATS = (
+    ('webp', 'WEBP', 'image/webp'),
+    ('jpg', 'JPEG', 'image/jpeg'),
+)
+QUALITY = {'WEBP': 80, 'JPEG': 82}
+
+PLACEHOLDER_WIDTH = 16
+
+# Image fields that get derivatives, per model label
+IMAGE_FIELDS = {
+    'store.Product': ('image',),
+    'store.ProductImage': ('image',),
+    'store.HeroSection': ('background_image', 'mobile_background_image'),
+}
+
+
+def meta_field_name(field_name):
+    return f'{field_name}_meta'
+
+
+def derivative_name(name, width, ext):
+    root, _ = posixpath.splitext(name)
+    return f'derivatives/{root}/{width}w.{ext}'
+
+
+def target_widths(width):
+    """Standard widths below the original, plus the original (capped)."""
+    largest = min(width, WIDTHS[-1])
+    return [w for w in WIDTHS if w < largest] + [largest]
+
+
+def _placeholder(image):
+    """
+    A tiny blurred image as a data URI, shown while the real one loads.
+    WebP, because JPEG's headers alone would be ~600 bytes per card.
+    """
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.Resampling.BILINEAR)
+    tiny = tiny.filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    tiny.save(buffer, 'WEBP', quality=40)
+    return 'data:image/webp;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def generate(name, storage=default_storage):
+    """
+    Write every derivative of the stored file `name` and return its meta
+    dict. Runs without touching the database, so it can run in a worker
+    process (see the generate_image_derivatives command).
+    """
+    with storage.open(name, 'rb') as source:
+        image = Image.open(source)
+        image = ImageOps.exif_transpose(image)
+        # JPEG has no alpha; flatten transparent PNGs onto white
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        else:
+            image = image.convert('RGB')
+
+    widths = target_widths(image.width)
+    for width in widths:
+        height = max(1, round(image.height * width / image.width))
+        resized = image if width == image.width else image.resize((width, height), Image.Resampling.LANCZOS)
+        for ext, pil_format, _ in FORMATS:
+            buffer = BytesIO()
+            resized.save(buffer, pil_format, quality=QUALITY[pil_format], optimize=True)
+            path = derivative_name(name, width, ext)
+            storage.delete(path)
+            storage.save(path, ContentFile(buffer.getvalue()))
+
+    return {
+        'name': name,
+        'width': image.width,
+        'height': image.height,
+        'widths': widths,
+        'placeholder': _placeholder(image),
+    }
+
+
+def delete_derivatives(meta, storage=default_storage):
+    for width in meta.get('widths', ()):
+        for ext, _, _ in FORMATS:
+            storage.delete(derivative_name(meta['name'], width, ext))
+
+
+def needs_update(instance, field_name):
+    fieldfile = getattr(instance, field_name)
+    meta = getattr(instance, meta_field_name(field_name)) or {}
+    return (fieldfile.name or '') != meta.get('name', '')
+
+
+def update_instance(instance, field_name):
+    """
+    Regenerate one field's derivatives if its upload changed. Saves just
+    the meta column (no signals). Returns True if anything changed.
+    """
+    if not needs_update(instance, field_name):
+        return False
+
+    fieldfile = getattr(instance, field_name)
+    old_meta = getattr(instance, meta_field_name(field_name)) or {}
+    meta = {}
+    if fieldfile:
+        try:
+            meta = generate(fieldfile.name, fieldfile.storage)
+        except Exception:
+            # A broken upload keeps working as a plain <img src>
+            logger.exception('Could not generate derivatives for %s', fieldfile.name)
+            meta = {'name': fieldfile.name}
+    if old_meta.get('name'):
+        delete_derivatives(old_meta, fieldfile.storage)
+
+    setattr(instance, meta_field_name(field_name), meta)
+    type(instance)._default_manager.filter(pk=instance.pk).update(**{meta_field_name(field_name): meta})
+    return True
+
+
+def srcset(fieldfile, meta, ext):
+    storage = fieldfile.storage
+    return ', '.join(
+        f"{storage.url(derivative_name(meta['name'], width, ext))} {width}w"
+        for width in meta['widths']
+    )
+
+
+def get_meta(fieldfile):
+    """The fieldfile's derivative meta, or None if it has none (yet)."""
+    if not fieldfile:
+        return None
+    meta = getattr(fieldfile.instance, meta_field_name(fieldfile.field.name), None) or {}
+    if meta.get('name') != fieldfile.name or not meta.get('widths'):
+        return None
+    return meta
@@ -0,0 +1,37 @@
+"""
+Django management command to rebuild "frequently bought together" recommendations
+Usage: python manage.py build_recommendations
+Meant to run nightly (cron); the storefront only reads the stored table.
+"""
+
+from django.core.management.base import BaseCommand
+
+from store import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild product recommendations from order history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-n',
+            type=int,
+            default=recommendations.TOP_N,
+            help='Neighbours stored per product',
+        )
+        parser.add_argument(
+            '--max-basket-size',
+            type=int,
+            default=recommendations.MAX_BASKET_SIZE,
+            help='Orders with more distinct products are ignored for pairing',
+        )
+
+    def handle(self, *args, **options):
+        products, copurchase, fallback = recommendations.rebuild_recommendations(
+            top_n=options['top_n'],
+            max_basket_size=options['max_basket_size'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored recommendations for {products} products '
+            f'({copurchase} bought together, {fallback} category fallback)'
+        ))
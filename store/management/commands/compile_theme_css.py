@@ -0,0 +1,28 @@
+"""
+Django management command to compile every theme into its hashed stylesheet
+Usage: python manage.py compile_theme_css
+Run after deploying to a fresh THEME_CSS_ROOT (files are not in git).
+"""
+
+from django.core.management.base import BaseCommand
+
+from store import theme_css
+from store.models import Theme
+
+
+class Command(BaseCommand):
+    help = 'Compile theme stylesheets and delete unreferenced ones'
+
+    def handle(self, *args, **options):
+        hashes = set()
+        for theme in Theme.objects.all():
+            css_hash = theme_css.compile_theme(theme)
+            if css_hash != theme.stylesheet_hash:
+                # update() skips save() so nothing is recompiled or retired twice
+                Theme.objects.filter(pk=theme.pk).update(stylesheet_hash=css_hash)
+            hashes.add(css_hash)
+
+        removed = theme_css.collect_garbage(hashes)
+        self.stdout.write(self.style.SUCCESS(
+            f'Compiled {len(hashes)} stylesheets, removed {removed} stale files'
+        ))
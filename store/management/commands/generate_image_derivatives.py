@@ -0,0 +1,97 @@
+"""
+Django management command to backfill responsive image derivatives
+Usage: python manage.py generate_image_derivatives [--workers 4] [--force]
+Resizing runs in a process pool; only the main process touches the database.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+
+from store import images, refdata
+from store.page_cache import invalidate_tags, product_page_tags
+
+
+def _generate(name):
+    return images.generate(name)
+
+
+class Command(BaseCommand):
+    help = 'Generate WebP/JPEG derivatives for product, gallery and hero images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='Number of worker processes',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Regenerate images that already have derivatives',
+        )
+
+    def pending(self, force):
+        """(model, pk, field name, file name) for every image needing work."""
+        for label, field_names in images.IMAGE_FIELDS.items():
+            model = apps.get_model(label)
+            for field_name in field_names:
+                meta_field = images.meta_field_name(field_name)
+                rows = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True})
+                for pk, name, meta in rows.values_list('pk', field_name, meta_field).iterator():
+                    if force or (meta or {}).get('name') != name:
+                        yield model, pk, field_name, name
+
+    def page_tags(self, jobs):
+        """
+        Page cache tags of every page showing one of the jobs' images: the
+        same tags a product save invalidates, plus 'hero'.
+        """
+        Product = apps.get_model('store.Product')
+        ProductImage = apps.get_model('store.ProductImage')
+        product_ids = {pk for model, pk, _, _ in jobs if model is Product}
+        gallery_pks = [pk for model, pk, _, _ in jobs if model is ProductImage]
+        if gallery_pks:
+            product_ids.update(
+                ProductImage.objects.filter(pk__in=gallery_pks).values_list('product_id', flat=True)
+            )
+        tags = set()
+        if product_ids:
+            category_ids = Product.objects.filter(pk__in=product_ids).values_list('category_id', flat=True)
+            tags.update(product_page_tags(product_ids, set(category_ids)))
+        if any(model._meta.label == 'store.HeroSection' for model, _, _, _ in jobs):
+            tags.add('hero')
+        return tags
+
+    def handle(self, *args, **options):
+        jobs = list(self.pending(options['force']))
+        if not jobs:
+            self.stdout.write(self.style.SUCCESS('All images already have derivatives'))
+            return
+
+        done = failed = 0
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            futures = {
+                pool.submit(_generate, name): (model, pk, field_name)
+                for model, pk, field_name, name in jobs
+            }
+            for future in as_completed(futures):
+                model, pk, field_name = futures[future]
+                try:
+                    meta = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'{model.__name__} #{pk} {field_name}: {e}')
+                    continue
+                model.objects.filter(pk=pk).update(**{images.meta_field_name(field_name): meta})
+                done += 1
+
+        # update() sends no signals: refresh cached pages and reference data
+        invalidate_tags(*self.page_tags(jobs))
+        if any(model._meta.label == 'store.HeroSection' for model, _, _, _ in jobs):
+            refdata.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(f'Generated derivatives for {done} images ({failed} failed)'))
@@ -0,0 +1,74 @@
+"""
+Django management command to import a large product CSV/Excel sheet in batches
+Usage: python manage.py import_products products.csv [--batch-size 500]
+       python manage.py import_products --job 7
+       python manage.py import_products --pending
+Same columns and rules as the admin's Product Imports (store.bulk_import).
+--pending runs every upload queued in the admin; schedule it (e.g. cron
+every minute) wherever the admin is used.
+"""
+
+from pathlib import Path
+
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+
+from store import bulk_import
+from store.models import ProductImportJob
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or Excel file using batched bulk writes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='CSV or .xlsx file to import')
+        parser.add_argument('--job', type=int, help='Run an already uploaded import job instead')
+        parser.add_argument('--pending', action='store_true', help='Run all import jobs queued in the admin')
+        parser.add_argument('--batch-size', type=int, default=bulk_import.BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            # Jobs whose runner died would otherwise show as running forever
+            stale = bulk_import.fail_stale_jobs()
+            if stale:
+                self.stderr.write(f'Marked {stale} stalled import(s) as failed')
+            failed = False
+            for job in bulk_import.run_pending(batch_size=options['batch_size']):
+                failed = not self.report(job) or failed
+            if failed:
+                raise CommandError('Some imports failed')
+            return
+
+        if options['job']:
+            job = ProductImportJob.objects.filter(pk=options['job']).first()
+            if job is None:
+                raise CommandError(f"No import job #{options['job']}")
+            if job.status != 'pending' or not bulk_import.claim(job):
+                raise CommandError(f'{job} has already been run')
+        elif options['path']:
+            path = Path(options['path'])
+            if not path.is_file():
+                raise CommandError(f'{path} does not exist')
+            job = ProductImportJob()
+            with path.open('rb') as f:
+                job.file.save(path.name, File(f))
+        else:
+            raise CommandError('Give a file to import or --job')
+
+        job = bulk_import.run(job, batch_size=options['batch_size'])
+        if not self.report(job):
+            raise CommandError(f'{job} failed')
+
+    def report(self, job):
+        """Print the job's summary and errors; True if it succeeded."""
+        summary = (
+            f'{job}: {job.processed_rows} rows, {job.created_count} created, '
+            f'{job.updated_count} updated, {job.error_count} errors'
+        )
+        for error in job.errors:
+            self.stderr.write(f"Row {error['row']}: {error['error']}" if error['row'] else error['error'])
+        if job.status == 'done':
+            self.stdout.write(self.style.SUCCESS(summary))
+            return True
+        self.stderr.write(summary)
+        return False
@@ -0,0 +1,36 @@
+"""
+Django management command to rebuild the product full-text search index
+Usage: python manage.py rebuild_search_index
+"""
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from store import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of products inserted per batch',
+        )
+
+    def handle(self, *args, **options):
+        if not search.fts_supported(connection):
+            self.stdout.write(self.style.WARNING(
+                'Database has no FTS5 support; search uses the icontains fallback.'
+            ))
+            return
+
+        with transaction.atomic():
+            # Recreate the table in case it was never created or got corrupted
+            search.drop_index(connection)
+            search.create_index(connection)
+            count = search.rebuild_index(batch_size=options['batch_size'])
+
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} products'))
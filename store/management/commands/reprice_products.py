@@ -0,0 +1,93 @@
+"""
+Django management command to reprice products in bulk (discount campaigns)
+Usage: python manage.py reprice_products --category rings --discount-percentage 15 [--dry-run]
+       python manage.py reprice_products --price-change 5 --round-to 10 --rounding up
+       python manage.py reprice_products --rollback 12
+Runs in one transaction; every run is recorded so it can be rolled back.
+"""
+
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store import refdata, repricing
+from store.models import Product, RepricingBatch
+
+
+def decimal(value):
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        raise ValueError(value)
+
+
+class Command(BaseCommand):
+    help = 'Apply a price change or discount to many products at once, or roll a run back'
+
+    def add_arguments(self, parser):
+        selection = parser.add_argument_group('products (all when omitted)')
+        selection.add_argument('--category', help='Category slug (includes subcategories)')
+        selection.add_argument('--metal', help='Only products of this metal')
+        selection.add_argument('--ids', help='Comma-separated product ids')
+        selection.add_argument('--include-unavailable', action='store_true', help='Also reprice hidden products')
+
+        rule = parser.add_argument_group('rule')
+        rule.add_argument('--price-change', type=decimal, help='Percent change of the price, e.g. 5 or -10')
+        rule.add_argument('--round-to', type=decimal, help='Round prices to a multiple of this, e.g. 10')
+        rule.add_argument('--rounding', choices=sorted(repricing.ROUND_MODES), default='nearest')
+        rule.add_argument('--discount-percentage', type=decimal)
+        rule.add_argument('--discount-amount', type=decimal, help='Fixed discount in TK')
+        rule.add_argument('--clear-discount', action='store_true')
+
+        parser.add_argument('--description', default='', help='Shown in the admin batch list')
+        parser.add_argument('--batch-size', type=int, default=repricing.BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Count the products that would change')
+        parser.add_argument('--rollback', type=int, metavar='BATCH_ID', help='Undo an earlier run')
+
+    def get_queryset(self, options):
+        products = Product.objects.all()
+        if not options['include_unavailable']:
+            products = products.filter(available=True)
+        if options['category']:
+            category = refdata.get_category(options['category'])
+            if category is None:
+                raise CommandError(f"Unknown category '{options['category']}'")
+            products = products.filter(category__path__startswith=category.path)
+        if options['metal']:
+            products = products.filter(metal=options['metal'])
+        if options['ids']:
+            products = products.filter(pk__in=[int(pk) for pk in options['ids'].split(',') if pk.strip()])
+        return products
+
+    def handle(self, *args, **options):
+        try:
+            if options['rollback']:
+                batch = RepricingBatch.objects.filter(pk=options['rollback']).first()
+                if batch is None:
+                    raise CommandError(f"No repricing batch #{options['rollback']}")
+                restored = repricing.rollback(batch, batch_size=options['batch_size'])
+                self.stdout.write(self.style.SUCCESS(f'Rolled back {batch}: restored {restored} products'))
+                return
+
+            batch = repricing.reprice(
+                self.get_queryset(options),
+                price_change=options['price_change'],
+                discount_percentage=options['discount_percentage'],
+                discount_amount=options['discount_amount'],
+                clear_discount=options['clear_discount'],
+                rounding_step=options['round_to'],
+                rounding=options['rounding'],
+                description=options['description'],
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+            )
+        except repricing.RepricingError as e:
+            raise CommandError(str(e))
+
+        if options['dry_run']:
+            self.stdout.write(f'Would reprice {batch.product_count} products (nothing written)')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Repriced {batch.product_count} products (batch #{batch.pk}; '
+                f'undo with --rollback {batch.pk})'
+            ))
@@ -0,0 +1,58 @@
+"""
+Django management command to transcode hero videos with ffmpeg
+Usage: python manage.py transcode_hero_videos [--pending] [--force]
+Saving a hero only marks a new video pending; schedule this with --pending
+(e.g. cron every minute) to transcode them. Without it, every video that
+isn't ready is done too: existing videos, retries after failures.
+"""
+
+from django.core.management.base import BaseCommand
+
+from store import refdata, video
+from store.models import HeroSection
+from store.page_cache import invalidate_tags
+
+
+class Command(BaseCommand):
+    help = 'Transcode hero background videos into low/high renditions with poster frames'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--pending',
+            action='store_true',
+            help='Only transcode videos uploaded since the last run',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-transcode videos that are already done',
+        )
+
+    def handle(self, *args, **options):
+        if video.get_ffmpeg() is None:
+            self.stderr.write(self.style.ERROR('ffmpeg not found (set FFMPEG_BINARY or install it)'))
+            return
+
+        done = failed = 0
+        for hero in HeroSection.objects.all():
+            for field_name in video.VIDEO_FIELDS:
+                if not getattr(hero, field_name):
+                    continue
+                meta = getattr(hero, video.meta_field_name(field_name)) or {}
+                if options['pending']:
+                    if not video.is_pending(hero, field_name):
+                        continue
+                elif not options['force'] and not video.needs_transcode(hero, field_name) and meta.get('status') == video.READY:
+                    continue
+                self.stdout.write(f'{hero} {field_name}...')
+                meta = video.transcode_instance(hero, field_name)
+                if meta and meta['status'] == video.READY:
+                    done += 1
+                else:
+                    failed += 1
+
+        if done or failed:
+            # update() sends no signals
+            invalidate_tags('hero')
+            refdata.invalidate()
+        self.stdout.write(self.style.SUCCESS(f'Transcoded {done} videos ({failed} failed)'))
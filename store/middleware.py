@@ -1,4 +1,15 @@
+from whitenoise.middleware import WhiteNoiseMiddleware
+
 from .models import Visitor
+from .theme_css import is_immutable_file
+
+
+class StoreWhiteNoiseMiddleware(WhiteNoiseMiddleware):
+    """WhiteNoise that also treats compiled theme-<hash>.css files as immutable."""
+
+    def immutable_file_test(self, path, url):
+        return is_immutable_file(path, url) or super().immutable_file_test(path, url)
+
 
 class VisitorTrackingMiddleware:
     def __init__(self, get_response):
@@ -12,9 +23,9 @@ class VisitorTrackingMiddleware:
         return response
 
     def track_visitor(self, request):
-        # Ignore admin, static, media, favicon
+        # Ignore admin, static, media, favicon, autocomplete keystrokes, API calls
         path = request.path
-        if any(x in path for x in ['/admin/', '/static/', '/media/', 'favicon.ico', '/admin-tools/']):
+        if any(x in path for x in ['/admin/', '/static/', '/media/', 'favicon.ico', '/admin-tools/', '/theme-', '/search/autocomplete/', '/api/']):
             return
 
         # Get IP
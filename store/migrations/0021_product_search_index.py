@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    from store.search import FTS_TABLE, create_index, fts_supported
+
+    conn = schema_editor.connection
+    if not fts_supported(conn):
+        # Other backends use the icontains fallback in store.search
+        return
+    create_index(conn)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, gemstone, metal, category) "
+            "SELECT p.id, p.name, p.description, p.gemstone, p.metal, c.name "
+            "FROM store_product p JOIN store_category c ON c.id = p.category_id"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    from store.search import drop_index
+
+    if schema_editor.connection.vendor == 'sqlite':
+        drop_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_visitor'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
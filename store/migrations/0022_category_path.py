@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:50
+
+from django.db import migrations, models
+
+
+def build_paths(apps, schema_editor):
+    Category = apps.get_model('store', 'Category')
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+
+    def path_for(pk, seen=()):
+        parent_id = parents.get(pk)
+        if parent_id is None or parent_id in seen:
+            return f'{pk}/'
+        return f'{path_for(parent_id, seen + (pk,))}{pk}/'
+
+    for pk in parents:
+        Category.objects.filter(pk=pk).update(path=path_for(pk))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0022_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theme',
+            name='stylesheet_hash',
+            field=models.CharField(blank=True, editable=False, max_length=12),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0025_image_derivative_meta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='herosection',
+            name='background_video_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='herosection',
+            name='mobile_background_video_meta',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='herosection',
+            name='background_video',
+            field=models.FileField(blank=True, help_text='Upload a video (MP4, WEBM). It is transcoded automatically into low/high quality versions and a poster frame', null=True, upload_to='hero/videos/'),
+        ),
+        migrations.AlterField(
+            model_name='herosection',
+            name='mobile_background_video',
+            field=models.FileField(blank=True, help_text='Upload a vertical video for mobile. Transcoded automatically like the desktop video.', null=True, upload_to='hero/mobile/videos/'),
+        ),
+    ]
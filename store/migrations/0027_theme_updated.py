@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 13:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0026_hero_video_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='theme',
+            name='updated',
+            field=models.DateTimeField(auto_now=True),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0027_theme_updated'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RepricingBatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('description', models.CharField(blank=True, max_length=200)),
+                ('rule', models.JSONField(blank=True, default=dict)),
+                ('product_count', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('rolled_back_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'Repricing Batch',
+                'verbose_name_plural': 'Repricing Batches',
+                'ordering': ['-created'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RepricingChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('old_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('old_discount_percentage', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('old_discount_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('new_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('new_discount_percentage', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('new_discount_amount', models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True)),
+                ('batch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='changes', to='store.repricingbatch')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='repricing_changes', to='store.product')),
+            ],
+            options={
+                'ordering': ['batch', 'product'],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:14
+
+import django.core.validators
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0028_repricing'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SaleRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('discount_percentage', models.DecimalField(decimal_places=2, help_text='Percentage off (0-100) while the sale runs', max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField(db_index=True)),
+                ('is_active', models.BooleanField(default=True, help_text='Untick to pause the sale without deleting it')),
+                ('metal', models.CharField(blank=True, choices=[('Gold', 'Gold'), ('Silver', 'Silver'), ('Platinum', 'Platinum'), ('Rose Gold', 'Rose Gold'), ('Brass', 'Brass')], max_length=100)),
+                ('category', models.ForeignKey(blank=True, help_text='Includes subcategories', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sale_rules', to='store.category')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='sale_rules', to='store.product')),
+            ],
+            options={
+                'verbose_name': 'Flash Sale',
+                'verbose_name_plural': 'Flash Sales',
+                'ordering': ['-starts_at'],
+            },
+        ),
+    ]
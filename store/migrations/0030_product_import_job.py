@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0029_flash_sales'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(help_text='CSV or Excel (.xlsx) with the product export columns', upload_to='imports/%Y/%m/%d')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', editable=False, max_length=10)),
+                ('total_rows', models.PositiveIntegerField(default=0, editable=False)),
+                ('processed_rows', models.PositiveIntegerField(default=0, editable=False)),
+                ('created_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('updated_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('error_count', models.PositiveIntegerField(default=0, editable=False)),
+                ('errors', models.JSONField(blank=True, default=list, editable=False)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, editable=False, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, editable=False, null=True)),
+            ],
+            options={
+                'verbose_name': 'Product Import',
+                'verbose_name_plural': 'Product Imports',
+                'ordering': ['-created'],
+            },
+        ),
+    ]
@@ -1,11 +1,19 @@
+from decimal import Decimal
+
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.db import models
 from django.urls import reverse
 from django.contrib.auth.models import User
 
-class Category(models.Model):
+from .dirty import DirtyFieldsMixin
+
+class Category(DirtyFieldsMixin, models.Model):
     name = models.CharField(max_length=200, db_index=True)
     slug = models.SlugField(max_length=200, unique=True)
     parent = models.ForeignKey('self', related_name='children', on_delete=models.CASCADE, null=True, blank=True)
+    # Materialized path of ancestor ids, e.g. "3/12/" (maintained on save).
+    # "Category and all descendants" is a single indexed path__startswith query.
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
 
     class Meta:
         ordering = ('name',)
@@ -18,6 +26,61 @@ class Category(models.Model):
     def get_absolute_url(self):
         return reverse('store:product_list_by_category', args=[self.slug])
 
+    def _build_path(self):
+        parent_path = self.parent.path if self.parent_id else ''
+        return f'{parent_path}{self.pk}/'
+
+    def get_ancestor_ids(self):
+        """Ids from the root down to (and including) this category."""
+        return [int(pk) for pk in self.path.split('/') if pk]
+
+    def get_descendants(self, include_self=True):
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    @classmethod
+    def get_tree(cls, categories=None):
+        """
+        Top-level categories with `nav_children` populated, built from a
+        single query (children keep the model's name ordering).
+        """
+        if categories is None:
+            categories = list(cls.objects.all())
+        by_parent = {}
+        for category in categories:
+            category.nav_children = []
+            by_parent.setdefault(category.parent_id, []).append(category)
+        for category in categories:
+            category.nav_children = by_parent.get(category.pk, [])
+        return by_parent.get(None, [])
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if self.pk and self.parent_id and str(self.pk) in self.parent.path.split('/'):
+            raise ValidationError({'parent': 'A category cannot be moved under itself or one of its subcategories.'})
+
+    def save(self, *args, **kwargs):
+        if self.pk is None:
+            # The path needs our own id: save first, then store the path
+            # (as a save, so post_save listeners see the final row)
+            super().save(*args, **kwargs)
+            self.path = self._build_path()
+            super().save(update_fields=['path'])
+            return
+
+        old_path = self.path
+        self.path = self._build_path()
+        super().save(*args, **kwargs)
+        if old_path and old_path != self.path:
+            # Moved: rewrite the path prefix of the whole subtree in one UPDATE
+            from django.db.models import Value
+            from django.db.models.functions import Concat, Substr
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(self.path), Substr('path', len(old_path) + 1))
+            )
+
 
 class Size(models.Model):
     name = models.CharField(max_length=20) # e.g. "US 7", "Small"
@@ -39,23 +102,47 @@ class Color(models.Model):
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+METAL_CHOICES = [
+    ('Gold', 'Gold'),
+    ('Silver', 'Silver'),
+    ('Platinum', 'Platinum'),
+    ('Rose Gold', 'Rose Gold'),
+    ('Brass', 'Brass')
+]
+
+
+def resolve_discount(price, discount_percentage, discount_amount, sale_percentage=None):
+    """
+    (discounted price, percentage off for badges) from a product's own
+    discount and its running flash sale, whichever is lower. Works on plain
+    values so values() rows can be priced without building Products.
+    """
+    if discount_percentage:
+        own = round(price - price * (discount_percentage / Decimal('100')), 2)
+    elif discount_amount:
+        own = max(price - discount_amount, Decimal('0'))
+    else:
+        own = price
+    if sale_percentage:
+        sale = round(price - price * (sale_percentage / Decimal('100')), 2)
+        if sale < own:
+            return sale, sale_percentage
+    return own, discount_percentage
+
+
+class Product(DirtyFieldsMixin, models.Model):
     category = models.ForeignKey(Category, related_name='products', on_delete=models.CASCADE)
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     image = models.ImageField(upload_to='products/%Y/%m/%d', blank=True)
+    # Responsive derivatives of `image` (see store.images)
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
     description = models.TextField(blank=True)
     price = models.DecimalField(max_digits=10, decimal_places=2)
     cost_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00, help_text="Cost to buy/manufacture this product")
     
     # Jewelry Specifics
-    metal = models.CharField(max_length=100, choices=[
-        ('Gold', 'Gold'),
-        ('Silver', 'Silver'),
-        ('Platinum', 'Platinum'),
-        ('Rose Gold', 'Rose Gold'),
-        ('Brass', 'Brass')
-    ], blank=True)
+    metal = models.CharField(max_length=100, choices=METAL_CHOICES, blank=True)
     
     gemstone = models.CharField(max_length=100, blank=True) # e.g. Diamond, Ruby, Sapphire
     
@@ -119,33 +206,41 @@ class Product(models.Model):
     def get_absolute_url(self):
         return reverse('store:product_detail', args=[self.id, self.slug])
 
+    @property
+    def sale_percentage(self):
+        """Percentage off from the best running flash sale, or None (see store.sales)."""
+        if '_sale_percentage' not in self.__dict__:
+            from . import sales
+            sales.resolve([self])
+        return self._sale_percentage
+
     @property
     def has_discount(self):
         """Check if product has any active discount."""
-        return bool(self.discount_percentage or self.discount_amount)
+        return bool(self.discount_percentage or self.discount_amount or self.sale_percentage)
 
     @property
     def discounted_price(self):
-        """Calculate price after applying discount."""
-        from decimal import Decimal
-        if self.discount_percentage:
-            discount = self.price * (self.discount_percentage / Decimal('100'))
-            return round(self.price - discount, 2)
-        elif self.discount_amount:
-            return max(self.price - self.discount_amount, Decimal('0'))
-        return self.price
+        """Calculate price after applying discount (the product's own or a flash sale, whichever is lower)."""
+        return resolve_discount(self.price, self.discount_percentage, self.discount_amount, self.sale_percentage)[0]
+
+    @property
+    def current_discount_percentage(self):
+        """The percentage off behind discounted_price, for badges."""
+        return resolve_discount(self.price, self.discount_percentage, self.discount_amount, self.sale_percentage)[1]
 
     def save(self, *args, **kwargs):
-        from decimal import Decimal
         # Auto-calculate discount_percentage if discount_amount changes
         if self.price and self.price > 0:
             should_calculate = False
             if not self.pk: # New object
                 if self.discount_amount is not None:
                     should_calculate = True
-            else: # Existing object
+            elif self.is_tracked: # Existing object, loaded values known
+                should_calculate = self.has_changed('discount_amount')
+            else: # Existing object built by hand
                 try:
-                    old_obj = Product.objects.get(pk=self.pk)
+                    old_obj = Product.objects.only('discount_amount').get(pk=self.pk)
                     # Compare as Decimals to avoid float issues if any, though fields are DecimalFields
                     if self.discount_amount != old_obj.discount_amount:
                         should_calculate = True
@@ -153,15 +248,23 @@ class Product(models.Model):
                     pass
             
             if should_calculate:
-                if self.discount_amount:
-                    # Calculate percentage: (amount / price) * 100
-                    self.discount_percentage = (self.discount_amount / self.price) * Decimal('100')
-                else:
-                    # If amount is removed/cleared, clear percentage too
-                    self.discount_percentage = None
+                self.apply_discount_amount()
         
         super().save(*args, **kwargs)
 
+    def apply_discount_amount(self):
+        """
+        Derive discount_percentage from a changed discount_amount (save()
+        does this; bulk updates that bypass save() call it themselves).
+        """
+        from decimal import Decimal
+        if self.discount_amount:
+            # Calculate percentage: (amount / price) * 100
+            self.discount_percentage = (self.discount_amount / self.price) * Decimal('100')
+        else:
+            # If amount is removed/cleared, clear percentage too
+            self.discount_percentage = None
+
 
 class Wishlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='wishlist')
@@ -197,21 +300,54 @@ class Theme(models.Model):
     buy_now_hover_bg_color = models.CharField(max_length=7, default='#000000', help_text="Buy Now hover background color")
     buy_now_hover_text_color = models.CharField(max_length=7, default='#ffffff', help_text="Buy Now hover text color")
 
+    # Content hash of the compiled stylesheet (theme-<hash>.css)
+    stylesheet_hash = models.CharField(max_length=12, blank=True, editable=False)
+    updated = models.DateTimeField(auto_now=True)
+
     class Meta:
         verbose_name = 'Theme'
         verbose_name_plural = 'Themes'
 
+    def css_variables(self):
+        """The theme as CSS custom property declarations."""
+        return (
+            f"--primary-color: {self.primary_color}; "
+            f"--text-color: {self.text_color}; "
+            f"--bg-color: {self.bg_color}; "
+            f"--accent-color: {self.accent_color}; "
+            f"--promo-bg: {self.promo_bg}; "
+            f"--btn-bg: {self.button_bg_color}; "
+            f"--btn-text: {self.button_text_color}; "
+            f"--btn-hover-bg: {self.button_hover_bg_color}; "
+            f"--buy-now-bg: {self.buy_now_bg_color}; "
+            f"--buy-now-text: {self.buy_now_text_color}; "
+            f"--buy-now-hover-bg: {self.buy_now_hover_bg_color}; "
+            f"--buy-now-hover-text: {self.buy_now_hover_text_color};"
+        )
+
     def save(self, *args, **kwargs):
+        from . import theme_css
+
         # Ensure only one theme is active at a time
         if self.is_active:
             Theme.objects.filter(is_active=True).exclude(pk=self.pk).update(is_active=False)
+
+        # Compile the colors into a cacheable stylesheet
+        old_hash = self.stylesheet_hash
+        self.stylesheet_hash = theme_css.compile_theme(self)
+        if 'update_fields' in kwargs and kwargs['update_fields'] is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'stylesheet_hash'}
         super().save(*args, **kwargs)
 
+        if old_hash and old_hash != self.stylesheet_hash:
+            theme_css.retire(old_hash)
+            theme_css.collect_garbage(set(Theme.objects.values_list('stylesheet_hash', flat=True)))
+
     def __str__(self):
         return self.name
 
 
-class HeroSection(models.Model):
+class HeroSection(DirtyFieldsMixin, models.Model):
     """
     Admin-manageable hero section for the homepage.
     Supports image or video backgrounds with customizable text and logo.
@@ -238,12 +374,14 @@ class HeroSection(models.Model):
         null=True,
         help_text="Upload an image (PNG, JPG, GIF). Recommended: 1920x1080 or higher"
     )
+    background_image_meta = models.JSONField(default=dict, blank=True, editable=False)
     background_video = models.FileField(
         upload_to='hero/videos/', 
         blank=True, 
         null=True,
-        help_text="Upload a video (MP4, WEBM). Keep under 10MB for best performance"
+        help_text="Upload a video (MP4, WEBM). It is transcoded automatically into low/high quality versions and a poster frame"
     )
+    background_video_meta = models.JSONField(default=dict, blank=True, editable=False)
 
     # Mobile Background
     mobile_background_type = models.CharField(
@@ -258,12 +396,14 @@ class HeroSection(models.Model):
         null=True,
         help_text="Upload a vertical image for mobile (e.g., 1080x1920)."
     )
+    mobile_background_image_meta = models.JSONField(default=dict, blank=True, editable=False)
     mobile_background_video = models.FileField(
         upload_to='hero/mobile/videos/', 
         blank=True, 
         null=True,
-        help_text="Upload a vertical video for mobile."
+        help_text="Upload a vertical video for mobile. Transcoded automatically like the desktop video."
     )
+    mobile_background_video_meta = models.JSONField(default=dict, blank=True, editable=False)
     
     # Logo
     logo = models.FileField(
@@ -316,9 +456,10 @@ class HeroSection(models.Model):
         return f"{self.name} ({status})"
 
 
-class ProductImage(models.Model):
+class ProductImage(DirtyFieldsMixin, models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/gallery/%Y/%m/%d')
+    image_meta = models.JSONField(default=dict, blank=True, editable=False)
     created = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -352,6 +493,147 @@ class ProductVariant(models.Model):
         return variant_name
 
 
+class ProductRecommendation(models.Model):
+    """
+    Precomputed "frequently bought together" neighbours of a product,
+    rebuilt offline by the build_recommendations command.
+    """
+    SOURCE_CHOICES = [
+        ('copurchase', 'Bought together'),
+        ('category', 'Same category'),
+    ]
+
+    product = models.ForeignKey(Product, related_name='recommendations', on_delete=models.CASCADE)
+    recommended = models.ForeignKey(Product, related_name='recommended_for', on_delete=models.CASCADE)
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField(default=0)
+    source = models.CharField(max_length=10, choices=SOURCE_CHOICES, default='copurchase')
+
+    class Meta:
+        ordering = ['product', 'rank']
+        unique_together = ('product', 'rank')
+        verbose_name = "Product Recommendation"
+        verbose_name_plural = "Product Recommendations"
+
+    def __str__(self):
+        return f"{self.product_id} -> {self.recommended_id} (#{self.rank})"
+
+
+class SaleRule(models.Model):
+    """
+    A flash sale: a percentage off one product, a category (and its
+    subcategories) or a metal, between two moments. Overlapping rules don't
+    stack; the biggest applies. See store.sales.
+    """
+    name = models.CharField(max_length=100)
+    discount_percentage = models.DecimalField(
+        max_digits=5, decimal_places=2,
+        validators=[MinValueValidator(0), MaxValueValidator(100)],
+        help_text="Percentage off (0-100) while the sale runs",
+    )
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField(db_index=True)
+    is_active = models.BooleanField(default=True, help_text="Untick to pause the sale without deleting it")
+
+    # Scope: exactly one of these
+    product = models.ForeignKey(Product, related_name='sale_rules', on_delete=models.CASCADE, null=True, blank=True)
+    category = models.ForeignKey(Category, related_name='sale_rules', on_delete=models.CASCADE, null=True, blank=True,
+                                 help_text="Includes subcategories")
+    metal = models.CharField(max_length=100, choices=METAL_CHOICES, blank=True)
+
+    class Meta:
+        ordering = ['-starts_at']
+        verbose_name = "Flash Sale"
+        verbose_name_plural = "Flash Sales"
+
+    def __str__(self):
+        return f"{self.name} ({self.discount_percentage}% off)"
+
+    def clean(self):
+        from django.core.exceptions import ValidationError
+        if self.starts_at and self.ends_at and self.ends_at <= self.starts_at:
+            raise ValidationError({'ends_at': 'The sale must end after it starts.'})
+        scopes = [self.product_id is not None, self.category_id is not None, bool(self.metal)]
+        if sum(scopes) != 1:
+            raise ValidationError('Choose exactly one of a product, a category or a metal.')
+
+
+class RepricingBatch(models.Model):
+    """One bulk repricing run (see store.repricing); its changes can be rolled back."""
+    description = models.CharField(max_length=200, blank=True)
+    # The rule that was applied, as passed to repricing.reprice()
+    rule = models.JSONField(default=dict, blank=True)
+    product_count = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+    rolled_back_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = "Repricing Batch"
+        verbose_name_plural = "Repricing Batches"
+
+    def __str__(self):
+        return self.description or f"Repricing #{self.pk}"
+
+
+class RepricingChange(models.Model):
+    """A product's pricing before and after a repricing batch."""
+    batch = models.ForeignKey(RepricingBatch, related_name='changes', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='repricing_changes', on_delete=models.CASCADE)
+    old_price = models.DecimalField(max_digits=10, decimal_places=2)
+    old_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    old_discount_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+    new_price = models.DecimalField(max_digits=10, decimal_places=2)
+    new_discount_percentage = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    new_discount_amount = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True)
+
+    class Meta:
+        ordering = ['batch', 'product']
+
+    def __str__(self):
+        return f"{self.product_id}: {self.old_price} -> {self.new_price}"
+
+
+class ProductImportJob(models.Model):
+    """A CSV/Excel product import, queued by the admin and run by import_products (see store.bulk_import)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+
+    file = models.FileField(upload_to='imports/%Y/%m/%d', help_text="CSV or Excel (.xlsx) with the product export columns")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending', editable=False)
+    total_rows = models.PositiveIntegerField(default=0, editable=False)
+    processed_rows = models.PositiveIntegerField(default=0, editable=False)
+    created_count = models.PositiveIntegerField(default=0, editable=False)
+    updated_count = models.PositiveIntegerField(default=0, editable=False)
+    error_count = models.PositiveIntegerField(default=0, editable=False)
+    # [{'row': n, 'error': '...'}, ...], the first few hundred
+    errors = models.JSONField(default=list, blank=True, editable=False)
+    created = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True, editable=False)
+    finished_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # Updated after every batch; a running job without one for a while has died
+    heartbeat_at = models.DateTimeField(null=True, blank=True, editable=False)
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = "Product Import"
+        verbose_name_plural = "Product Imports"
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.get_status_display()})"
+
+    @property
+    def progress(self):
+        """Percentage of rows processed."""
+        if not self.total_rows:
+            return 100 if self.status == 'done' else 0
+        return min(100, round(self.processed_rows * 100 / self.total_rows))
+
+
 class Visitor(models.Model):
     ip_address = models.GenericIPAddressField(null=True, blank=True)
     user_agent = models.TextField(null=True, blank=True)
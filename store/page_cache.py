@@ -0,0 +1,184 @@
+"""
+Full-page cache for anonymous storefront GETs.
+
+Each cached page remembers the versions of the tags it depends on (e.g.
+`product:12`, `category:3`, `theme`). Model signals bump those versions, so a
+page is served from cache only while every tag it was built from is
+unchanged; one get plus one get_many per hit. Tag versions are bumped by
+admin saves in any worker and by management commands (reprice_products,
+import_products, build_recommendations, generate_image_derivatives,
+transcode_hero_videos), so they live in the default cache, which must be
+shared between processes (settings.CACHES, the store.E001 check).
+
+Per-visitor bits are "hole-punched" on the way out: the cart badge is
+wrapped in <!--cart-count--> markers and CSRF tokens are swapped for the
+current visitor's, so the cached HTML can be shared by everyone.
+"""
+import hashlib
+import re
+from functools import wraps
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+from django.utils import timezone
+
+from . import sales
+from .caching import bump_version, get_versions
+
+# Every storefront page renders the theme and the category nav, and any
+# price on it may be under a flash sale
+BASE_TAGS = ('theme', 'categories', 'sales')
+
+# Query parameters that don't change the page (ad tracking)
+IGNORED_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'fbclid', 'gclid')
+
+CART_COUNT_RE = re.compile(r'<!--cart-count-->\d*<!--/cart-count-->')
+CSRF_INPUT_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def tag_namespace(tag):
+    """The versioned-cache namespace (store.caching) behind a page tag."""
+    return f'page:{tag}'
+
+
+def invalidate_tags(*tags):
+    for tag in tags:
+        bump_version(tag_namespace(tag))
+
+
+def tag_versions(*tags):
+    """{tag: current version}, in one cache round-trip."""
+    versions = get_versions(tag_namespace(tag) for tag in tags)
+    return {tag: versions[tag_namespace(tag)] for tag in tags}
+
+
+def product_page_tags(product_ids, category_ids):
+    """
+    Tags of every page showing these products: their own pages, listings
+    and the pages of their categories and all ancestors (category pages
+    list products from subcategories too).
+    """
+    from .models import Category
+
+    tags = {'listing', *(f'product:{pk}' for pk in product_ids)}
+    category_ids = set(category_ids) - {None}
+    for path in Category.objects.filter(pk__in=category_ids).values_list('path', flat=True):
+        tags.update(f'category:{pk}' for pk in path.split('/') if pk)
+    tags.update(f'category:{pk}' for pk in category_ids)
+    return tags
+
+
+def add_page_cache_tags(request, *tags):
+    """Called by views to declare what a page depends on."""
+    if hasattr(request, '_page_cache_tags'):
+        request._page_cache_tags.update(tags)
+
+
+def _cache_key(request):
+    params = request.GET.copy()
+    for param in IGNORED_PARAMS:
+        params.pop(param, None)
+    # Pages embed absolute URLs (og:url), so the origin is part of the key
+    url = f"{request.scheme}://{request.get_host()}{request.path}?{params.urlencode()}"
+    return 'store:page:' + hashlib.sha1(url.encode()).hexdigest()
+
+
+def _strip_ignored_params(request):
+    """
+    Drop the tracking parameters from the request before a page is built
+    from it: they aren't part of the cache key, so anything the page
+    echoes (og:url, hidden form inputs) would reach every later visitor.
+    """
+    if not any(param in request.GET for param in IGNORED_PARAMS):
+        return
+    params = request.GET.copy()
+    for param in IGNORED_PARAMS:
+        params.pop(param, None)
+    params._mutable = False
+    request.GET = params
+    request.META['QUERY_STRING'] = params.urlencode()
+
+
+def is_cacheable_request(request):
+    """Whether the page cache serves this request (anonymous GETs, no flash messages)."""
+    if request.method != 'GET':
+        return False
+    if request.user.is_authenticated:
+        return False
+    # Pages carrying flash messages are one-off
+    if len(get_messages(request)):
+        return False
+    return True
+
+
+def _punch_holes(request, content):
+    from cart.cart import Cart
+
+    content = CART_COUNT_RE.sub(f'<!--cart-count-->{len(Cart(request))}<!--/cart-count-->', content)
+    if 'csrfmiddlewaretoken' in content:
+        content = CSRF_INPUT_RE.sub(lambda m: f'{m.group(1)}{get_token(request)}{m.group(2)}', content)
+    return content
+
+
+def get_cached_entry(request):
+    """The request's page cache entry if it is still fresh, else None."""
+    if not hasattr(request, '_page_cache_entry'):
+        entry = cache.get(_cache_key(request))
+        if entry is not None and get_versions(entry['tags']) != entry['tags']:
+            entry = None
+        # A flash sale started or ended since the page was built
+        if entry is not None and entry.get('expires_at') and timezone.now() >= entry['expires_at']:
+            entry = None
+        request._page_cache_entry = entry
+    return request._page_cache_entry
+
+
+def _page_validators(tags):
+    """(fingerprint, built) of a page built from these tag versions."""
+    # Prices also change when a flash sale starts or ends
+    segment = sales.segment_start()
+    fingerprint = ':'.join([
+        *(f'{name}={version}' for name, version in sorted(tags.items())),
+        segment.isoformat() if segment else '',
+    ])
+    return fingerprint, timezone.now()
+
+
+def cache_anonymous_page(view_func):
+    """Serve anonymous GETs from the full-page cache, keyed on path + query."""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable_request(request):
+            return view_func(request, *args, **kwargs)
+
+        entry = get_cached_entry(request)
+        if entry is not None:
+            request._page_validators = entry.get('validators')
+            response = HttpResponse(
+                _punch_holes(request, entry['content']),
+                content_type=entry['content_type'],
+            )
+            response['X-Page-Cache'] = 'HIT'
+            return response
+
+        _strip_ignored_params(request)
+        request._page_cache_tags = set(BASE_TAGS)
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            tags = get_versions(tag_namespace(tag) for tag in sorted(request._page_cache_tags))
+            # For store.conditional's ETag/Last-Modified
+            request._page_validators = _page_validators(tags)
+            if not response.cookies:
+                cache.set(_cache_key(request), {
+                    'tags': tags,
+                    'content': response.content.decode(response.charset),
+                    'content_type': response['Content-Type'],
+                    'validators': request._page_validators,
+                    'expires_at': sales.next_boundary(),
+                }, getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 10))
+                response['X-Page-Cache'] = 'MISS'
+        return response
+    return wrapper
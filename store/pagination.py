@@ -0,0 +1,126 @@
+import base64
+import binascii
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# Sort option -> (field, descending). `id` is always the tiebreaker and
+# follows the direction of the main field so the ordering is total.
+SORT_KEYS = {
+    'newest': ('created', True),
+    'price_asc': ('price', False),
+    'price_desc': ('price', True),
+    # Aliases used by the search page
+    'price_low': ('price', False),
+    'price_high': ('price', True),
+    # Only valid on querysets annotated by store.search.search_products
+    'relevance': ('search_rank', False),
+}
+DEFAULT_SORT = 'newest'
+
+
+def get_page_size():
+    return getattr(settings, 'STORE_PAGE_SIZE', 24)
+
+
+def get_ordering(sort_by):
+    """Return the order_by() arguments for a sort option."""
+    field, descending = SORT_KEYS.get(sort_by, SORT_KEYS[DEFAULT_SORT])
+    prefix = '-' if descending else ''
+    return (f'{prefix}{field}', f'{prefix}id')
+
+
+def _serialize(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def _deserialize(field, value):
+    if field == 'created':
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError('Invalid datetime in cursor')
+        return parsed
+    if field == 'price':
+        try:
+            return Decimal(value)
+        except InvalidOperation:
+            raise ValueError('Invalid price in cursor')
+    if field == 'search_rank':
+        return float(value)
+    return value
+
+
+def encode_cursor(product, sort_by):
+    """Build an opaque cursor pointing just after `product` (a model or values() dict)."""
+    field, _ = SORT_KEYS.get(sort_by, SORT_KEYS[DEFAULT_SORT])
+    if isinstance(product, dict):  # a values() row
+        value, pk = product[field], product['id']
+    else:
+        value, pk = getattr(product, field), product.id
+    payload = {'s': sort_by, 'v': _serialize(value), 'id': pk}
+    raw = json.dumps(payload, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, sort_by):
+    """
+    Decode a cursor into (value, id) for the given sort option.
+    Returns None for missing, malformed or mismatched cursors so the
+    caller simply starts from the first page.
+    """
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if payload['s'] != sort_by:
+            return None
+        field, _ = SORT_KEYS.get(sort_by, SORT_KEYS[DEFAULT_SORT])
+        return _deserialize(field, payload['v']), int(payload['id'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+def paginate(queryset, sort_by, cursor=None, per_page=None):
+    """
+    Keyset-paginate `queryset` by the given sort option.
+
+    Instead of OFFSET, each page filters on the (field, id) of the last row
+    of the previous page, so cursors stay valid when products are inserted
+    between requests and the cost of a page doesn't grow with its depth.
+
+    Returns (items, next_cursor); next_cursor is None on the last page.
+    """
+    if sort_by not in SORT_KEYS:
+        sort_by = DEFAULT_SORT
+    if sort_by == 'relevance' and 'search_rank' not in queryset.query.annotations:
+        sort_by = DEFAULT_SORT
+    per_page = per_page or get_page_size()
+    field, descending = SORT_KEYS[sort_by]
+
+    queryset = queryset.order_by(*get_ordering(sort_by))
+
+    position = decode_cursor(cursor, sort_by)
+    if position is not None:
+        value, last_id = position
+        op = 'lt' if descending else 'gt'
+        queryset = queryset.filter(
+            Q(**{f'{field}__{op}': value}) |
+            Q(**{field: value, f'id__{op}': last_id})
+        )
+
+    # Fetch one extra row to know whether another page exists
+    items = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1], sort_by)
+    return items, next_cursor
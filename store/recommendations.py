@@ -0,0 +1,146 @@
+"""
+"Frequently bought together" recommendations.
+
+An offline job (the build_recommendations command) streams every order line
+once, ordered by order, and accumulates a sparse product x product
+co-occurrence matrix (only pairs that were actually bought together are
+stored). Pairs are scored by cosine similarity, so best sellers don't end up
+recommended next to everything, and the top-N neighbours of each product are
+written to ProductRecommendation. Products without enough co-purchases are
+topped up with the newest items from their own category.
+
+product_detail then reads its neighbours with a single indexed query.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import combinations, groupby
+from operator import itemgetter
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Q, Subquery
+
+from .models import Product, ProductRecommendation
+from .page_cache import invalidate_tags
+
+# Neighbours stored per product; more than the page shows, so a few going
+# out of stock still leaves a full row.
+TOP_N = 8
+
+# Baskets bigger than this (bulk/wholesale orders) add noise and cost
+# O(n^2) pairs, so they only count towards item frequencies.
+MAX_BASKET_SIZE = 50
+
+# Orders that never turned into a purchase
+EXCLUDED_STATUSES = ('Cancelled',)
+
+
+def iter_baskets(order_lines):
+    """Group (order_id, product_id) rows, sorted by order, into product sets."""
+    for _, rows in groupby(order_lines, key=itemgetter(0)):
+        yield {product_id for _, product_id in rows}
+
+
+def build_cooccurrence(baskets, max_basket_size=MAX_BASKET_SIZE):
+    """
+    Returns (pair_counts, item_counts): pair_counts[a][b] is the number of
+    orders containing both a and b, item_counts[a] the orders containing a.
+    """
+    pair_counts = defaultdict(Counter)
+    item_counts = Counter()
+    for basket in baskets:
+        item_counts.update(basket)
+        if len(basket) < 2 or len(basket) > max_basket_size:
+            continue
+        for a, b in combinations(basket, 2):
+            pair_counts[a][b] += 1
+            pair_counts[b][a] += 1
+    return pair_counts, item_counts
+
+
+def top_neighbours(pair_counts, item_counts, top_n=TOP_N, candidates=None):
+    """{product_id: [(neighbour_id, score), ...]} best first."""
+    neighbours = {}
+    for product_id, counts in pair_counts.items():
+        scored = (
+            (neighbour_id, count / math.sqrt(item_counts[product_id] * item_counts[neighbour_id]))
+            for neighbour_id, count in counts.items()
+            if candidates is None or neighbour_id in candidates
+        )
+        # Ties go to the lower id so rebuilds are deterministic
+        neighbours[product_id] = heapq.nlargest(top_n, scored, key=lambda item: (item[1], -item[0]))
+    return neighbours
+
+
+def _order_lines():
+    from orders.models import OrderItem
+
+    return (
+        OrderItem.objects
+        .exclude(order__status__in=EXCLUDED_STATUSES)
+        .order_by('order_id')
+        .values_list('order_id', 'product_id')
+        .iterator(chunk_size=5000)
+    )
+
+
+def rebuild_recommendations(top_n=TOP_N, max_basket_size=MAX_BASKET_SIZE, batch_size=1000):
+    """Recompute the whole table. Returns (products, co-purchase rows, category rows)."""
+    # Newest first, so category top-ups favour fresh items
+    catalog = list(Product.objects.filter(available=True).values_list('id', 'category_id'))
+    available = {product_id for product_id, _ in catalog}
+    by_category = defaultdict(list)
+    for product_id, category_id in catalog:
+        if len(by_category[category_id]) <= top_n:
+            by_category[category_id].append(product_id)
+
+    pair_counts, item_counts = build_cooccurrence(iter_baskets(_order_lines()), max_basket_size)
+    neighbours = top_neighbours(pair_counts, item_counts, top_n, candidates=available)
+
+    rows = []
+    copurchase = fallback = 0
+    for product_id, category_id in catalog:
+        picked = neighbours.get(product_id, [])
+        seen = {product_id, *(neighbour_id for neighbour_id, _ in picked)}
+        for rank, (neighbour_id, score) in enumerate(picked):
+            rows.append(ProductRecommendation(
+                product_id=product_id, recommended_id=neighbour_id, rank=rank, score=score,
+            ))
+        copurchase += len(picked)
+
+        # Cold start: not (or rarely) ordered yet
+        rank = len(picked)
+        for neighbour_id in by_category[category_id]:
+            if rank >= top_n:
+                break
+            if neighbour_id in seen:
+                continue
+            rows.append(ProductRecommendation(
+                product_id=product_id, recommended_id=neighbour_id, rank=rank, source='category',
+            ))
+            rank += 1
+            fallback += 1
+
+    with transaction.atomic():
+        ProductRecommendation.objects.all().delete()
+        ProductRecommendation.objects.bulk_create(rows, batch_size=batch_size)
+        transaction.on_commit(lambda: invalidate_tags('recommendations'))
+
+    return len(catalog), copurchase, fallback
+
+
+def get_related_products(product, limit=4):
+    """
+    Stored neighbours in rank order, in one query. Same-category products
+    fill any gap, e.g. for products added since the last rebuild.
+    """
+    stored = ProductRecommendation.objects.filter(product_id=product.id)
+    rank = stored.filter(recommended_id=OuterRef('pk')).values('rank')[:1]
+    return list(
+        Product.objects
+        .filter(available=True)
+        .filter(Q(id__in=stored.values('recommended_id')) | Q(category_id=product.category_id))
+        .exclude(id=product.id)
+        .annotate(recommendation_rank=Subquery(rank))
+        .order_by(F('recommendation_rank').asc(nulls_last=True), '-created')[:limit]
+    )
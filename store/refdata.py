@@ -0,0 +1,94 @@
+"""
+Process-local cache of reference data: categories, sizes, colors and the
+active theme/hero section.
+
+These tables change a few times a month but are read on every request (nav,
+theme, hero, cart size/color names). Each worker keeps them in memory and
+only checks a shared version number in the cache; saving or deleting any of
+these models bumps the version (see store.signals) and every worker reloads
+on its next request.
+
+That only works when the cache is shared by every process (settings.CACHES,
+enforced by the store.E001 check): with a process-local cache a save in
+one worker or in a management command would never reach the others.
+There is no TTL on the in-memory copy; the version check, one cache read
+per request, is what keeps it fresh.
+
+Because the full set of category slugs is held in memory, unknown slugs
+hitting the `<slug:category_slug>/` catch-all route are answered "not
+found" without touching the database.
+"""
+import threading
+
+from .caching import bump_version, get_version
+
+CACHE_NAMESPACE = 'refdata'
+
+_lock = threading.Lock()
+# (version, data), replaced as a whole so readers never see a mix
+_state = (None, None)
+
+
+def _load():
+    from .models import Category, Color, HeroSection, Size, Theme
+
+    categories = list(Category.objects.all())
+    tree = Category.get_tree(categories)
+
+    return {
+        'category_tree': tree,
+        'categories_by_slug': {c.slug: c for c in categories},
+        'categories_by_id': {c.pk: c for c in categories},
+        'sizes': {s.code: s for s in Size.objects.all()},
+        'colors': {c.code: c for c in Color.objects.all()},
+        'theme': Theme.objects.filter(is_active=True).first(),
+        'hero': HeroSection.objects.filter(is_active=True).first(),
+    }
+
+
+def get_refdata():
+    global _state
+    # Read the version before loading, so a save that lands mid-load leaves
+    # us with an old version number and triggers another reload next time.
+    version = get_version(CACHE_NAMESPACE)
+    loaded_version, data = _state
+    if loaded_version != version or data is None:
+        with _lock:
+            loaded_version, data = _state
+            if loaded_version != version or data is None:
+                data = _load()
+                _state = (version, data)
+    return data
+
+
+def invalidate():
+    bump_version(CACHE_NAMESPACE)
+
+
+def get_category_tree():
+    return get_refdata()['category_tree']
+
+
+def get_category(slug):
+    """The category with this slug, or None (never queries for unknown slugs)."""
+    return get_refdata()['categories_by_slug'].get(slug)
+
+
+def get_category_by_id(pk):
+    return get_refdata()['categories_by_id'].get(pk)
+
+
+def get_sizes():
+    return get_refdata()['sizes']
+
+
+def get_colors():
+    return get_refdata()['colors']
+
+
+def get_active_theme():
+    return get_refdata()['theme']
+
+
+def get_active_hero():
+    return get_refdata()['hero']
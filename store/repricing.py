@@ -0,0 +1,216 @@
+"""
+Bulk repricing and discount campaigns.
+
+`reprice()` applies one rule to every product in a queryset:
+
+    reprice(Product.objects.filter(category__path__startswith='3/'),
+            price_change=Decimal('5'),            # +5% (negative lowers)
+            rounding_step=Decimal('10'), rounding='up',
+            discount_percentage=Decimal('15'),    # or discount_amount=...
+            description='Eid campaign')
+
+Products are read and written in chunks (`bulk_update`), inside one
+transaction, so a failure leaves every price as it was. Each run is stored
+as a RepricingBatch with the before/after values of every product, and
+`rollback(batch)` puts the old values back.
+
+bulk_update() skips Product.save(), so the rules it applies are reproduced
+here: a changed `discount_amount` re-derives `discount_percentage`
+(Product.apply_discount_amount), `updated` is bumped, and the caches that
+save signals would have invalidated are invalidated once at the end.
+"""
+from decimal import ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_UP, Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from . import facets
+from .caching import bump_version
+from .models import Product, RepricingBatch, RepricingChange
+from .page_cache import invalidate_tags, product_page_tags
+
+BATCH_SIZE = 500
+
+ROUND_MODES = {
+    'nearest': ROUND_HALF_UP,
+    'up': ROUND_CEILING,
+    'down': ROUND_FLOOR,
+}
+
+CENTS = Decimal('0.01')
+
+PRICING_FIELDS = ('price', 'discount_percentage', 'discount_amount')
+
+
+class RepricingError(ValueError):
+    pass
+
+
+def round_price(price, step, rounding='nearest'):
+    """Round to a multiple of `step` (e.g. 10 -> 1234.50 becomes 1230)."""
+    if not step:
+        return price.quantize(CENTS, rounding=ROUND_HALF_UP)
+    rounded = (price / step).quantize(Decimal('1'), rounding=ROUND_MODES[rounding]) * step
+    # Never round a price away to nothing
+    return max(rounded, step).quantize(CENTS)
+
+
+def _validate(price_change, discount_percentage, discount_amount, clear_discount, rounding_step, rounding):
+    discounts = [discount_percentage is not None, discount_amount is not None, bool(clear_discount)]
+    if sum(discounts) > 1:
+        raise RepricingError('Give at most one of a discount percentage, a discount amount or clearing discounts.')
+    if price_change is None and not rounding_step and not any(discounts):
+        raise RepricingError('Nothing to change.')
+    if price_change is not None and price_change <= -100:
+        raise RepricingError('A price change must stay above -100%.')
+    if discount_percentage is not None and not (0 <= discount_percentage <= 100):
+        raise RepricingError('A discount percentage must be between 0 and 100.')
+    if discount_amount is not None and discount_amount < 0:
+        raise RepricingError('A discount amount cannot be negative.')
+    if rounding_step is not None and rounding_step < 0:
+        raise RepricingError('The rounding step cannot be negative.')
+    if rounding not in ROUND_MODES:
+        raise RepricingError(f'Unknown rounding mode {rounding!r}.')
+
+
+def apply_rule(product, price_change=None, discount_percentage=None, discount_amount=None,
+               clear_discount=False, rounding_step=None, rounding='nearest'):
+    """
+    Change one (unsaved) product's pricing the way Product.save() would
+    have if an admin had typed the new values in.
+    """
+    old_amount = product.discount_amount
+    if price_change is not None or rounding_step:
+        price = product.price
+        if price_change is not None:
+            price = price * (Decimal('100') + price_change) / Decimal('100')
+        product.price = round_price(price, rounding_step, rounding)
+
+    if clear_discount:
+        product.discount_amount = None
+        product.discount_percentage = None
+    elif discount_percentage is not None:
+        # Percentage takes priority; a stale fixed amount would confuse admins
+        product.discount_amount = None
+        product.discount_percentage = discount_percentage
+    elif discount_amount is not None:
+        product.discount_amount = discount_amount
+
+    # Product.save(): a changed amount re-derives the percentage
+    if discount_percentage is None and product.discount_amount != old_amount and product.price and product.price > 0:
+        product.apply_discount_amount()
+    if product.discount_percentage is not None:
+        product.discount_percentage = product.discount_percentage.quantize(CENTS)
+
+
+def _invalidate(product_ids, category_ids):
+    # What the Product post_save receivers would have done; search,
+    # autocomplete and the fuzzy vocabulary don't index prices.
+    invalidate_tags(*product_page_tags(product_ids, category_ids))
+    bump_version(facets.CACHE_NAMESPACE)
+
+
+def _chunks(queryset, batch_size):
+    """
+    Lists of up to batch_size rows in pk order, one keyset query each (safe
+    to write to the table in between, unlike a server-side cursor).
+    """
+    last_pk = 0
+    while True:
+        chunk = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not chunk:
+            return
+        yield chunk
+        last_pk = chunk[-1].pk
+
+
+def _write(products, now, batch_size):
+    for product in products:
+        product.updated = now
+    Product.objects.bulk_update(products, [*PRICING_FIELDS, 'updated'], batch_size=batch_size)
+
+
+def reprice(queryset, *, price_change=None, discount_percentage=None, discount_amount=None,
+            clear_discount=False, rounding_step=None, rounding='nearest', description='',
+            batch_size=BATCH_SIZE, dry_run=False):
+    """
+    Apply a rule to every product in `queryset`; returns the saved
+    RepricingBatch (unsaved with dry_run, where nothing is written).
+    """
+    _validate(price_change, discount_percentage, discount_amount, clear_discount, rounding_step, rounding)
+    rule = {
+        'price_change': price_change, 'discount_percentage': discount_percentage,
+        'discount_amount': discount_amount, 'clear_discount': clear_discount,
+        'rounding_step': rounding_step, 'rounding': rounding,
+    }
+
+    batch = RepricingBatch(
+        description=description,
+        rule={key: str(value) for key, value in rule.items() if value not in (None, False)},
+    )
+    now = timezone.now()
+    product_ids, category_ids = [], set()
+    products = queryset.only('id', 'category', 'updated', *PRICING_FIELDS)
+
+    with transaction.atomic():
+        if not dry_run:
+            batch.save()
+        for chunk in _chunks(products, batch_size):
+            changed, changes = [], []
+            for product in chunk:
+                old = [getattr(product, field) for field in PRICING_FIELDS]
+                apply_rule(product, **rule)
+                new = [getattr(product, field) for field in PRICING_FIELDS]
+                if new == old:
+                    continue
+                changed.append(product)
+                changes.append(RepricingChange(
+                    batch=batch, product_id=product.pk,
+                    old_price=old[0], old_discount_percentage=old[1], old_discount_amount=old[2],
+                    new_price=new[0], new_discount_percentage=new[1], new_discount_amount=new[2],
+                ))
+                product_ids.append(product.pk)
+                category_ids.add(product.category_id)
+            if changed and not dry_run:
+                _write(changed, now, batch_size)
+                RepricingChange.objects.bulk_create(changes, batch_size=batch_size)
+
+        batch.product_count = len(product_ids)
+        if not dry_run:
+            batch.save(update_fields=['product_count'])
+            transaction.on_commit(lambda: _invalidate(product_ids, category_ids))
+    return batch
+
+
+def rollback(batch, batch_size=BATCH_SIZE):
+    """
+    Restore the pricing a batch replaced (overwriting any pricing edits
+    made since). Returns the number of products restored.
+    """
+    if batch.rolled_back_at:
+        raise RepricingError(f'{batch} was already rolled back.')
+
+    now = timezone.now()
+    product_ids, category_ids = [], set()
+    changes = batch.changes.select_related('product').only(
+        'product', 'old_price', 'old_discount_percentage', 'old_discount_amount',
+        *(f'product__{field}' for field in ('id', 'category', 'updated', *PRICING_FIELDS)),
+    )
+
+    with transaction.atomic():
+        for chunk in _chunks(changes, batch_size):
+            products = []
+            for change in chunk:
+                product = change.product
+                product.price = change.old_price
+                product.discount_percentage = change.old_discount_percentage
+                product.discount_amount = change.old_discount_amount
+                products.append(product)
+                product_ids.append(product.pk)
+                category_ids.add(product.category_id)
+            _write(products, now, batch_size)
+
+        batch.rolled_back_at = now
+        batch.save(update_fields=['rolled_back_at'])
+        transaction.on_commit(lambda: _invalidate(product_ids, category_ids))
+    return len(product_ids)
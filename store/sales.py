@@ -0,0 +1,161 @@
+"""
+Scheduled flash sales (SaleRule), resolved from an in-memory interval index.
+
+Every rule start and end is a boundary on the time line; between two
+consecutive boundaries the set of running rules can't change. The index
+precomputes, for each of those segments, the best percentage per scope key
+(('product', id), ('category', id) or ('metal', name)), so finding a
+product's sale is a bisect on the boundaries plus a few dict lookups (its
+id, its category and each ancestor, its metal) however many rules exist.
+
+Rules are [starts_at, ends_at): a sale is on at exactly its start and off
+at exactly its end. Lookups always use the current time, so crossing a
+boundary needs no reload; the index is only rebuilt (per worker, like
+store.refdata) when a rule is saved or deleted.
+
+Cached pages and cards embed prices, so the page cache also expires
+entries at the next boundary (see `next_boundary()`) and the card cache key
+carries the sale percentage.
+"""
+import threading
+from bisect import bisect_right
+
+from django.utils import timezone
+
+from . import refdata
+from .caching import bump_version, get_version
+
+CACHE_NAMESPACE = 'sales'
+
+_lock = threading.Lock()
+# (version, SaleIndex)
+_state = (None, None)
+
+
+class SaleIndex:
+    def __init__(self, rules):
+        """`rules`: (starts_at, ends_at, key, percentage) tuples."""
+        self.boundaries = sorted({moment for start, end, _, _ in rules for moment in (start, end)})
+        starting, ending = {}, {}
+        for rule in rules:
+            starting.setdefault(rule[0], []).append(rule)
+            ending.setdefault(rule[1], []).append(rule)
+
+        # segments[i] covers [boundaries[i - 1], boundaries[i]); segments[0]
+        # is everything before the first boundary.
+        self.segments = [{}]
+        running = set()
+        for moment in self.boundaries:
+            running.difference_update(ending.get(moment, ()))
+            running.update(starting.get(moment, ()))
+            best = {}
+            for _, _, key, percentage in running:
+                if percentage > best.get(key, 0):
+                    best[key] = percentage
+            self.segments.append(best)
+
+    def active(self, at):
+        """{scope key: percentage} of the rules running at `at`."""
+        return self.segments[bisect_right(self.boundaries, at)]
+
+    def next_boundary(self, at):
+        """When the running set next changes after `at`, or None."""
+        i = bisect_right(self.boundaries, at)
+        return self.boundaries[i] if i < len(self.boundaries) else None
+
+    def segment_start(self, at):
+        """When the running set last changed at or before `at`, or None."""
+        i = bisect_right(self.boundaries, at)
+        return self.boundaries[i - 1] if i else None
+
+
+def _rule_key(rule):
+    if rule['product_id'] is not None:
+        return ('product', rule['product_id'])
+    if rule['category_id'] is not None:
+        return ('category', rule['category_id'])
+    return ('metal', rule['metal'])
+
+
+def build_index(now=None):
+    from .models import SaleRule
+
+    # Finished sales can't come back (a change to a rule rebuilds the index)
+    rows = SaleRule.objects.filter(is_active=True, ends_at__gt=now or timezone.now()).values(
+        'starts_at', 'ends_at', 'product_id', 'category_id', 'metal', 'discount_percentage',
+    )
+    return SaleIndex([
+        (row['starts_at'], row['ends_at'], _rule_key(row), row['discount_percentage'])
+        for row in rows if row['starts_at'] < row['ends_at']
+    ])
+
+
+def get_index():
+    global _state
+    version = get_version(CACHE_NAMESPACE)
+    loaded_version, index = _state
+    if loaded_version != version or index is None:
+        with _lock:
+            loaded_version, index = _state
+            if loaded_version != version or index is None:
+                index = build_index()
+                _state = (version, index)
+    return index
+
+
+def invalidate():
+    from .page_cache import invalidate_tags
+
+    bump_version(CACHE_NAMESPACE)
+    invalidate_tags(CACHE_NAMESPACE)
+
+
+def _keys(pk, category_id, metal):
+    yield ('product', pk)
+    category = refdata.get_category_by_id(category_id)
+    if category is not None:
+        for ancestor_pk in category.get_ancestor_ids():
+            yield ('category', ancestor_pk)
+    if metal:
+        yield ('metal', metal)
+
+
+def _percentage(active, pk, category_id, metal):
+    if not active:
+        return None
+    return max((active[key] for key in _keys(pk, category_id, metal) if key in active), default=None)
+
+
+def resolve(products, at=None):
+    """
+    Find the running sale of every product in `products` with one index
+    lookup; returns {product id: percentage} for those on sale and leaves
+    each product's percentage (or None) on it for Product.sale_percentage.
+    """
+    active = get_index().active(at or timezone.now())
+    found = {}
+    for product in products:
+        percentage = _percentage(active, product.pk, product.category_id, product.metal)
+        product._sale_percentage = percentage
+        if percentage is not None:
+            found[product.pk] = percentage
+    return found
+
+
+def resolve_rows(rows, at=None):
+    """resolve() for values() dicts with 'id', 'category_id' and 'metal' keys."""
+    active = get_index().active(at or timezone.now())
+    found = {}
+    for row in rows:
+        percentage = _percentage(active, row['id'], row['category_id'], row['metal'])
+        if percentage is not None:
+            found[row['id']] = percentage
+    return found
+
+
+def next_boundary(at=None):
+    return get_index().next_boundary(at or timezone.now())
+
+
+def segment_start(at=None):
+    return get_index().segment_start(at or timezone.now())
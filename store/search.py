@@ -0,0 +1,197 @@
+"""
+Full-text product search.
+
+On SQLite (with FTS5 compiled in) products are mirrored into the
+`store_product_fts` virtual table and matched with BM25 ranking. Other
+backends fall back to icontains matching with a simple field-based rank,
+so callers can always rely on a `search_rank` annotation (lower is better).
+"""
+import re
+
+from django.db import connection
+from django.db.models import Case, FloatField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+FTS_TABLE = 'store_product_fts'
+
+# Column weights for bm25(), in table column order: name, description,
+# gemstone, metal, category
+BM25_WEIGHTS = (10.0, 1.0, 5.0, 5.0, 3.0)
+
+_fts_available = {}
+
+
+def fts_supported(conn=connection):
+    """Whether the backend can host the FTS5 virtual table at all."""
+    if conn.vendor != 'sqlite':
+        return False
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        return bool(cursor.fetchone()[0])
+
+
+def fts_available(conn=connection):
+    """Whether the FTS5 index exists on this database (cached per database)."""
+    key = conn.settings_dict['NAME']
+    if key not in _fts_available:
+        _fts_available[key] = (
+            conn.vendor == 'sqlite' and FTS_TABLE in conn.introspection.table_names()
+        )
+    return _fts_available[key]
+
+
+def create_index(conn=connection):
+    with conn.cursor() as cursor:
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, description, gemstone, metal, category, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+    _fts_available.pop(conn.settings_dict['NAME'], None)
+
+
+def drop_index(conn=connection):
+    with conn.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    _fts_available.pop(conn.settings_dict['NAME'], None)
+
+
+# Product fields the search document is built from
+PRODUCT_FIELDS = ('name', 'description', 'gemstone', 'metal', 'category')
+
+
+def _document(product):
+    return [
+        product.name or '',
+        product.description or '',
+        product.gemstone or '',
+        product.metal or '',
+        product.category.name if product.category_id else '',
+    ]
+
+
+def index_product(product):
+    """Insert or replace a single product's row in the index."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product.pk])
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, gemstone, metal, category) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [product.pk, *_document(product)],
+        )
+
+
+def reindex_category(category_id):
+    """Re-index every product of a category (e.g. after a rename) in one pass."""
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"DELETE FROM {FTS_TABLE} WHERE rowid IN "
+            "(SELECT id FROM store_product WHERE category_id = %s)",
+            [category_id],
+        )
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} (rowid, name, description, gemstone, metal, category) "
+            "SELECT p.id, COALESCE(p.name, ''), COALESCE(p.description, ''), "
+            "COALESCE(p.gemstone, ''), COALESCE(p.metal, ''), c.name "
+            "FROM store_product p JOIN store_category c ON c.id = p.category_id "
+            "WHERE p.category_id = %s",
+            [category_id],
+        )
+
+
+def remove_product(product_id):
+    if not fts_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [product_id])
+
+
+def rebuild_index(batch_size=500):
+    """Drop every row and re-index all products. Returns the number indexed."""
+    from .models import Product
+
+    if not fts_available():
+        return 0
+    count = 0
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {FTS_TABLE}")
+        rows = (
+            Product.objects.select_related('category')
+            .only('id', 'name', 'description', 'gemstone', 'metal', 'category__name')
+            .order_by('id')
+            .iterator(chunk_size=batch_size)
+        )
+        batch = []
+        for product in rows:
+            batch.append([product.pk, *_document(product)])
+            if len(batch) >= batch_size:
+                cursor.executemany(
+                    f"INSERT INTO {FTS_TABLE} (rowid, name, description, gemstone, metal, category) "
+                    "VALUES (%s, %s, %s, %s, %s, %s)",
+                    batch,
+                )
+                count += len(batch)
+                batch = []
+        if batch:
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, name, description, gemstone, metal, category) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                batch,
+            )
+            count += len(batch)
+        cursor.execute(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')")
+    return count
+
+
+def build_match_query(query):
+    """
+    Turn free text into a safe FTS5 MATCH expression: every word is quoted
+    (so operators and punctuation in user input are inert) and prefix-matched.
+    """
+    tokens = re.findall(r'\w+', query or '')
+    return ' '.join(f'"{token}"*' for token in tokens)
+
+
+def search_products(queryset, query):
+    """
+    Filter `queryset` to products matching `query` and annotate `search_rank`.
+    Returns the queryset unchanged for an empty query.
+    """
+    if not query or not query.strip():
+        return queryset
+
+    if fts_available():
+        match = build_match_query(query)
+        if not match:
+            return queryset.none()
+        weights = ', '.join(str(w) for w in BM25_WEIGHTS)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f"SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s", [match])
+        ).annotate(
+            search_rank=RawSQL(
+                f"SELECT bm25({FTS_TABLE}, {weights}) FROM {FTS_TABLE} "
+                f"WHERE {FTS_TABLE} MATCH %s AND rowid = {table}.id",
+                [match],
+                output_field=FloatField(),
+            )
+        )
+
+    # Portable fallback: substring matching, ranked by which field matched
+    return queryset.filter(
+        Q(name__icontains=query) |
+        Q(description__icontains=query) |
+        Q(gemstone__icontains=query) |
+        Q(metal__icontains=query)
+    ).annotate(
+        search_rank=Case(
+            When(name__icontains=query, then=Value(0.0)),
+            When(Q(gemstone__icontains=query) | Q(metal__icontains=query), then=Value(1.0)),
+            default=Value(2.0),
+            output_field=FloatField(),
+        )
+    )
@@ -0,0 +1,223 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import autocomplete, facets, fuzzy, images, refdata, sales, search, variants, video
+from .caching import bump_version
+from .models import Category, Color, HeroSection, Product, ProductImage, ProductVariant, SaleRule, Size, Theme
+from .page_cache import invalidate_tags, product_page_tags
+
+
+def _save_changed(instance, fields, kwargs):
+    """
+    False for a post_save of a tracked Product that left all of `fields`
+    alone (e.g. a stock decrement); True for creations and deletions.
+    """
+    if kwargs.get('signal') is not post_save or kwargs.get('created'):
+        return True
+    return instance.has_changed(*fields)
+
+
+# Registered first, so the cache invalidation below runs after the
+# derivative meta has been written.
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_save, sender=HeroSection)
+def generate_image_derivatives(sender, instance, created=False, raw=False, **kwargs):
+    # Only for a new upload: rows that merely lack derivatives (e.g. from
+    # before they existed) are left to the generate_image_derivatives
+    # command, so unrelated saves such as a stock decrement stay cheap.
+    if raw:
+        return
+    for field_name in images.IMAGE_FIELDS[sender._meta.label]:
+        if created or instance.has_changed(field_name):
+            images.update_instance(instance, field_name)
+
+
+@receiver(post_save, sender=HeroSection)
+def mark_hero_videos_pending(sender, instance, created=False, raw=False, **kwargs):
+    # The transcode itself runs in `transcode_hero_videos --pending`
+    if raw:
+        return
+    for field_name in video.VIDEO_FIELDS:
+        if (created or instance.has_changed(field_name)) and video.needs_transcode(instance, field_name):
+            video.mark_pending(instance, field_name)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    if raw or not _save_changed(instance, search.PRODUCT_FIELDS, kwargs):
+        return
+    search.index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    search.remove_product(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    # The category name is part of each product's search document. The
+    # path-only save that follows a create has no products to re-index.
+    if raw or created or not instance.has_changed('name', 'path'):
+        return
+    if not instance.get_original('path'):
+        return
+    search.reindex_category(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def update_autocomplete(sender, instance, raw=False, **kwargs):
+    if raw or not _save_changed(instance, autocomplete.PRODUCT_FIELDS, kwargs):
+        return
+    autocomplete.product_changed(instance.pk)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def rebuild_autocomplete(sender, raw=False, **kwargs):
+    if raw:
+        return
+    autocomplete.invalidate()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_fuzzy_vocabulary(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    if sender is Product and not _save_changed(instance, fuzzy.PRODUCT_FIELDS, kwargs):
+        return
+    fuzzy.invalidate()
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+@receiver(m2m_changed, sender=Product.sizes.through)
+@receiver(m2m_changed, sender=Product.colors.through)
+def invalidate_facets(sender, **kwargs):
+    if kwargs.get('raw') or kwargs.get('action', 'post_').startswith('pre_'):
+        return
+    if sender is Product and not _save_changed(kwargs['instance'], facets.PRODUCT_FIELDS, kwargs):
+        return
+    bump_version(facets.CACHE_NAMESPACE)
+
+
+# ==========================================
+# FULL-PAGE CACHE INVALIDATION
+# ==========================================
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_pages(sender, instance, **kwargs):
+    # The loaded category too, in case the product moved
+    category_ids = {instance.category_id, instance.get_original('category')}
+    invalidate_tags(*product_page_tags([instance.pk], category_ids))
+
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_product_children(sender, instance, **kwargs):
+    invalidate_tags(f'product:{instance.product_id}')
+    if sender is ProductImage:
+        # Gallery images are listed in the product sitemap
+        invalidate_tags('gallery')
+
+
+@receiver(m2m_changed, sender=Product.sizes.through)
+@receiver(m2m_changed, sender=Product.colors.through)
+def invalidate_product_options(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        # instance is a Size/Color; pk_set holds product ids
+        invalidate_tags(*(f'product:{pk}' for pk in pk_set or ()))
+    else:
+        invalidate_tags(f'product:{instance.pk}')
+
+
+@receiver(post_save, sender=Size)
+@receiver(pre_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(pre_delete, sender=Color)
+def invalidate_option_pages(sender, instance, **kwargs):
+    # pre_delete: the M2M rows are gone by post_delete
+    product_ids = instance.products.values_list('id', flat=True)
+    invalidate_tags(*(f'product:{pk}' for pk in product_ids))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_pages(sender, instance, **kwargs):
+    # Categories appear in the nav on every page
+    invalidate_tags('categories', 'listing', f'category:{instance.pk}')
+
+
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+def invalidate_theme_pages(sender, instance, **kwargs):
+    invalidate_tags('theme')
+
+
+@receiver(post_save, sender=HeroSection)
+@receiver(post_delete, sender=HeroSection)
+def invalidate_hero_pages(sender, instance, **kwargs):
+    invalidate_tags('hero')
+
+
+# ==========================================
+# REFERENCE DATA (process-local cache)
+# ==========================================
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+@receiver(post_save, sender=Theme)
+@receiver(post_delete, sender=Theme)
+@receiver(post_save, sender=HeroSection)
+@receiver(post_delete, sender=HeroSection)
+def invalidate_refdata(sender, instance, **kwargs):
+    refdata.invalidate()
+
+
+# ==========================================
+# VARIANT STOCK INDEX
+# ==========================================
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+def invalidate_variant_index(sender, instance, **kwargs):
+    variants.invalidate(instance.product_id)
+
+
+@receiver(post_save, sender=Size)
+@receiver(post_delete, sender=Size)
+@receiver(post_save, sender=Color)
+@receiver(post_delete, sender=Color)
+def invalidate_variant_indexes(sender, raw=False, **kwargs):
+    # Indexes are keyed by code, and a delete nulls its variants' size/color
+    if raw:
+        return
+    variants.invalidate_all()
+
+
+# ==========================================
+# FLASH SALES
+# ==========================================
+@receiver(post_save, sender=SaleRule)
+@receiver(post_delete, sender=SaleRule)
+def invalidate_sales(sender, raw=False, **kwargs):
+    if raw:
+        return
+    sales.invalidate()
@@ -1,6 +1,29 @@
+"""
+Sitemaps: an index at /sitemap.xml pointing at one (paginated) sitemap per
+section, /sitemap-<section>.xml.
+
+Sections read `values()` projections rather than model instances, and
+product pages carry image sitemap entries for the main and gallery images
+(one extra query per page). Rendered documents are cached under a version
+that changes whenever the section's data does (see `cache_version()`), so
+crawler hits normally cost a couple of cache gets and no queries.
+"""
+import hashlib
+
 from django.contrib.sitemaps import Sitemap
+from django.contrib.sitemaps import views as sitemap_views
+from django.core.cache import cache
+from django.db.models import Max
+from django.http import HttpResponse
 from django.shortcuts import reverse
-from .models import Product, Category
+
+from . import refdata
+from .caching import get_version
+from .models import Product, Category, ProductImage
+from .page_cache import tag_versions
+
+CACHE_TIMEOUT = 60 * 60 * 24
+
 
 class StaticViewSitemap(Sitemap):
     priority = 0.5
@@ -12,19 +35,110 @@ class StaticViewSitemap(Sitemap):
     def location(self, item):
         return reverse(item)
 
+    def cache_version(self):
+        return 'static'
+
+
 class ProductSitemap(Sitemap):
     priority = 0.9
     changefreq = 'daily'
+    # Image entries make each <url> bigger than the 50,000 default allows for
+    limit = 5000
 
     def items(self):
-        return Product.objects.filter(available=True)
+        return Product.objects.filter(available=True).order_by('id').values('id', 'slug', 'updated', 'image')
+
+    def location(self, item):
+        return reverse('store:product_detail', args=[item['id'], item['slug']])
+
+    def lastmod(self, item):
+        return item['updated']
+
+    def get_latest_lastmod(self):
+        return Product.objects.filter(available=True).aggregate(Max('updated'))['updated__max']
+
+    def cache_version(self):
+        # The page-cache tags bumped by the product signals: `listing` on
+        # any product save or delete (main image included), `gallery` on
+        # any gallery image save or delete, even one replaced in place
+        versions = tag_versions('listing', 'gallery')
+        return f"{versions['listing']}:{versions['gallery']}"
+
+    def get_urls(self, page=1, site=None, protocol=None):
+        urls = super().get_urls(page=page, site=site, protocol=protocol)
+        base = f'{self.get_protocol(protocol)}://{site.domain}'
+        storage = Product._meta.get_field('image').storage
+
+        gallery = {}
+        product_ids = [url['item']['id'] for url in urls]
+        for product_id, image in ProductImage.objects.filter(product_id__in=product_ids).values_list('product_id', 'image'):
+            gallery.setdefault(product_id, []).append(image)
+
+        for url in urls:
+            item = url['item']
+            names = ([item['image']] if item['image'] else []) + gallery.get(item['id'], [])
+            url['images'] = [f'{base}{storage.url(name)}' for name in names]
+        return urls
 
-    def lastmod(self, obj):
-        return obj.updated
 
 class CategorySitemap(Sitemap):
     priority = 0.7
     changefreq = 'weekly'
 
     def items(self):
-        return Category.objects.all()
+        return Category.objects.order_by('id').values('id', 'slug')
+
+    def location(self, item):
+        return reverse('store:product_list_by_category', args=[item['slug']])
+
+    def cache_version(self):
+        # Bumped on every category save/delete
+        return get_version(refdata.CACHE_NAMESPACE)
+
+
+sitemaps = {
+    'static': StaticViewSitemap,
+    'products': ProductSitemap,
+    'categories': CategorySitemap,
+}
+
+
+def _cached(request, key, render):
+    # URLs in the document are absolute, so the host is part of the key
+    key = f'{request.scheme}://{request.get_host()}:{key}'
+    key = 'store:sitemap:' + hashlib.sha1(key.encode()).hexdigest()
+    cached = cache.get(key)
+    if cached is None:
+        response = render()
+        if response.status_code != 200:
+            return response
+        response.render()
+        cached = (response.content, response.get('Last-Modified'))
+        cache.set(key, cached, CACHE_TIMEOUT)
+
+    content, last_modified = cached
+    response = HttpResponse(content, content_type='application/xml')
+    if last_modified:
+        response['Last-Modified'] = last_modified
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive'
+    return response
+
+
+def index(request):
+    versions = ':'.join(str(sitemap().cache_version()) for sitemap in sitemaps.values())
+    return _cached(
+        request,
+        f'index:{versions}',
+        lambda: sitemap_views.index(request, sitemaps, sitemap_url_name='sitemap_section'),
+    )
+
+
+def section(request, section):
+    if section not in sitemaps:
+        return sitemap_views.sitemap(request, sitemaps, section=section)
+    page = request.GET.get('p', '1')
+    return _cached(
+        request,
+        f'{section}:{page}:{sitemaps[section]().cache_version()}',
+        lambda: sitemap_views.sitemap(request, sitemaps, section=section, template_name='store/sitemap.xml'),
+    )
@@ -0,0 +1,72 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from store import images
+
+register = template.Library()
+
+# Product grids: 2 columns on phones, 3 on tablets, 4 on desktop
+GRID_SIZES = '(max-width: 600px) 50vw, (max-width: 1024px) 33vw, 25vw'
+
+
+@register.simple_tag
+def responsive_image(fieldfile, sizes=GRID_SIZES, fit=None, position=None, **attrs):
+    """
+    <picture> with WebP and JPEG srcsets, intrinsic width/height and a blur
+    placeholder for an image with derivatives (see store.images); a plain
+    <img> otherwise. `fit`/`position` set object-fit/object-position, other
+    keyword arguments become <img> attributes. `src` stays the original
+    upload so scripts reading img.src (zoom, lightbox) get full resolution.
+    """
+    if fit or position:
+        style = attrs.get('style', '')
+        if fit:
+            style += f' object-fit: {fit} !important;'
+        if position:
+            style += f' object-position: {position} !important;'
+        attrs['style'] = style.strip()
+    attrs.setdefault('loading', 'lazy')
+    attrs.setdefault('decoding', 'async')
+    meta = images.get_meta(fieldfile)
+    if meta is None:
+        return format_html('<img src="{}"{}>', fieldfile.url, flatatt(attrs))
+
+    attrs.setdefault('width', meta['width'])
+    attrs.setdefault('height', meta['height'])
+    if meta.get('placeholder'):
+        style = attrs.get('style', '').strip()
+        if style and not style.endswith(';'):
+            style += ';'
+        attrs['style'] = f"{style} background: url({meta['placeholder']}) center / cover no-repeat;".strip()
+        attrs['onload'] = "this.style.background='none'"
+
+    sources = format_html(
+        '<source type="image/webp" srcset="{}" sizes="{}">',
+        images.srcset(fieldfile, meta, 'webp'), sizes,
+    )
+    return format_html(
+        '<picture>{}<img src="{}" srcset="{}" sizes="{}"{}></picture>',
+        sources, fieldfile.url, images.srcset(fieldfile, meta, 'jpg'), sizes, flatatt(attrs),
+    )
+
+
+@register.simple_tag
+def responsive_background(fieldfile, max_width=1920):
+    """
+    CSS for a background image: the largest derivative up to `max_width`,
+    WebP where image-set() is supported. Falls back to the original.
+    """
+    meta = images.get_meta(fieldfile)
+    if meta is None:
+        return format_html("background-image: url('{}');", fieldfile.url)
+
+    width = max([w for w in meta['widths'] if w <= max_width] or [meta['widths'][0]])
+    storage = fieldfile.storage
+    webp = storage.url(images.derivative_name(meta['name'], width, 'webp'))
+    jpg = storage.url(images.derivative_name(meta['name'], width, 'jpg'))
+    return format_html(
+        "background-image: url('{}'); "
+        "background-image: image-set(url('{}') type('image/webp'), url('{}') type('image/jpeg'));",
+        jpg, webp, jpg,
+    )
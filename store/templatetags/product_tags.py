@@ -0,0 +1,49 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from store import sales
+
+register = template.Library()
+
+
+def card_cache_key(product, template_name):
+    # `updated` changes on every save, so edited products get a fresh key and
+    # stale cards simply expire. Derivatives are written without a save
+    # (backfill), so whether the card has them is part of the key too.
+    # Flash sales start and end without a save, so the sale is part of it too.
+    derivatives = 'r' if product.image_meta.get('widths') else 'o'
+    return (
+        f'store:card:{template_name}:{product.id}:{product.updated.timestamp()}:{derivatives}'
+        f':{product.sale_percentage or 0}'
+    )
+
+
+@register.simple_tag
+def product_cards(products, template_name):
+    """
+    Render a grid of product cards, caching each card's HTML.
+    The whole grid is fetched with one get_many; only misses are rendered.
+    """
+    products = list(products)
+    if not products:
+        return ''
+    sales.resolve(products)
+
+    keys = [card_cache_key(product, template_name) for product in products]
+    cached = cache.get_many(keys)
+
+    missing = {}
+    cards = []
+    for key, product in zip(keys, products):
+        html = cached.get(key)
+        if html is None:
+            html = render_to_string(template_name, {'product': product})
+            missing[key] = html
+        cards.append(html)
+
+    if missing:
+        cache.set_many(missing, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 60 * 60 * 24))
+    return mark_safe('\n'.join(cards))
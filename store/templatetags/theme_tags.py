@@ -1,4 +1,6 @@
 from django import template
+from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.safestring import mark_safe
 
 register = template.Library()
@@ -7,20 +9,18 @@ register = template.Library()
 def theme_styles(theme):
     if not theme:
         return ""
-    # Create the CSS variable string
-    css_vars = (
-        f"--primary-color: {theme.primary_color}; "
-        f"--text-color: {theme.text_color}; "
-        f"--bg-color: {theme.bg_color}; "
-        f"--accent-color: {theme.accent_color}; "
-        f"--promo-bg: {theme.promo_bg}; "
-        f"--btn-bg: {theme.button_bg_color}; "
-        f"--btn-text: {theme.button_text_color}; "
-        f"--btn-hover-bg: {theme.button_hover_bg_color}; "
-        f"--buy-now-bg: {theme.buy_now_bg_color}; "
-        f"--buy-now-text: {theme.buy_now_text_color}; "
-        f"--buy-now-hover-bg: {theme.buy_now_hover_bg_color}; "
-        f"--buy-now-hover-text: {theme.buy_now_hover_text_color};"
+    # Return the CSS variables as a safe string to be rendered in the style attribute
+    return mark_safe(f'style="{theme.css_variables()}"')
+
+@register.simple_tag
+def theme_stylesheet(theme):
+    """<link> to the theme's compiled, immutable stylesheet."""
+    if not theme:
+        return ""
+    if not theme.stylesheet_hash:
+        # Not compiled yet (see the compile_theme_css command): inline fallback
+        return mark_safe(f'<style>body {{ {theme.css_variables()} }}</style>')
+    return format_html(
+        '<link href="{}" rel="stylesheet">',
+        reverse('theme_stylesheet', args=[theme.stylesheet_hash]),
     )
-    # Return it as a safe string to be rendered in the style attribute
-    return mark_safe(f'style="{css_vars}"')
@@ -0,0 +1,15 @@
+from django import template
+
+from store import video
+
+register = template.Library()
+
+
+@register.inclusion_tag('store/includes/hero_video.html')
+def hero_video(fieldfile, style=''):
+    """
+    A muted, looping hero <video> that loads nothing up front: a script
+    picks the low or high rendition for the device and starts it once the
+    page has loaded and the video is on screen.
+    """
+    return {'sources': video.get_sources(fieldfile), 'style': style}
@@ -1,3 +1,1562 @@
-from django.test import TestCase
+import json
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .facets import get_facets, normalize_filters
+from .models import Category, Color, Product, Size, Theme
+from .pagination import paginate
+
+
+def make_product(category, name, price='100.00', **kwargs):
+    slug = kwargs.pop('slug', name.lower().replace(' ', '-'))
+    return Product.objects.create(category=category, name=name, slug=slug, price=Decimal(price), **kwargs)
+
+
+def stub_image_derivatives(test):
+    """Skip derivative generation for fixtures whose image files don't exist."""
+    patcher = mock.patch('store.images.generate', side_effect=lambda name, storage=None: {'name': name})
+    patcher.start()
+    test.addCleanup(patcher.stop)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Rings', slug='rings')
+        # Duplicate prices exercise the id tiebreaker
+        self.products = [
+            make_product(self.category, f'Ring {i}', price=str(100 + (i // 2) * 10))
+            for i in range(7)
+        ]
+
+    def collect(self, sort_by, per_page=3):
+        seen, cursor = [], None
+        while True:
+            page, cursor = paginate(Product.objects.all(), sort_by, cursor=cursor, per_page=per_page)
+            seen.extend(p.id for p in page)
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_product_once_in_order(self):
+        for sort_by, ordering in [('newest', ('-created', '-id')), ('price_asc', ('price', 'id')), ('price_desc', ('-price', '-id'))]:
+            expected = list(Product.objects.order_by(*ordering).values_list('id', flat=True))
+            self.assertEqual(self.collect(sort_by), expected, sort_by)
+
+    def test_cursor_is_stable_across_inserts(self):
+        page, cursor = paginate(Product.objects.all(), 'price_asc', per_page=3)
+        # A cheaper product inserted "before" the cursor must not shift the next page
+        make_product(self.category, 'Cheap Ring', price='1.00')
+        next_page, _ = paginate(Product.objects.all(), 'price_asc', cursor=cursor, per_page=3)
+        self.assertEqual([p.id for p in next_page], [p.id for p in self.products[3:6]])
+
+    def test_invalid_or_mismatched_cursor_restarts(self):
+        _, cursor = paginate(Product.objects.all(), 'newest', per_page=3)
+        first_page, _ = paginate(Product.objects.all(), 'price_asc', per_page=3)
+        for bad in ['not-a-cursor', cursor]:
+            page, _ = paginate(Product.objects.all(), 'price_asc', cursor=bad, per_page=3)
+            self.assertEqual(page, first_page)
+
+    @override_settings(STORE_PAGE_SIZE=4)
+    def test_json_fragment_endpoint(self):
+        response = self.client.get(reverse('store:product_list'), {'format': 'json'})
+        data = response.json()
+        self.assertTrue(data['has_next'])
+        self.assertEqual(data['html'].count('class="product-card"'), 4)
+
+        response = self.client.get(reverse('store:search'), {'format': 'json', 'cursor': data['next_cursor']})
+        data = response.json()
+        self.assertFalse(data['has_next'])
+        self.assertEqual(data['html'].count('class="product-card"'), 3)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.ruby_ring = make_product(self.rings, 'Ruby Ring', gemstone='Ruby')
+        self.plain_ring = make_product(self.rings, 'Plain Band', description='Goes well with a ruby pendant')
+        self.necklace = make_product(self.rings, 'Pearl Necklace', gemstone='Pearl')
+
+    def search(self, query, sort=None):
+        params = {'q': query, 'format': 'json'}
+        if sort:
+            params['sort'] = sort
+        return self.client.get(reverse('store:search'), params).json()['html']
+
+    def test_relevance_ranks_name_matches_first(self):
+        html = self.search('ruby')
+        self.assertIn('Ruby Ring', html)
+        self.assertIn('Plain Band', html)
+        self.assertNotIn('Pearl Necklace', html)
+        self.assertLess(html.index('Ruby Ring'), html.index('Plain Band'))
+
+    def test_prefix_and_operator_characters(self):
+        self.assertIn('Pearl Necklace', self.search('neckl'))
+        self.assertIn('Ruby Ring', self.search('"ruby" (ring*'))
+
+    def test_index_follows_saves_and_deletes(self):
+        self.necklace.name = 'Emerald Necklace'
+        self.necklace.save()
+        self.assertIn('Emerald Necklace', self.search('emerald'))
+        self.necklace.delete()
+        self.assertNotIn('Emerald Necklace', self.search('emerald'))
+
+    def test_category_rename_is_searchable(self):
+        self.rings.name = 'Bands'
+        self.rings.save()
+        self.assertIn('Pearl Necklace', self.search('bands'))
+
+    def test_category_save_reindexes_only_on_rename(self):
+        def fts_writes(queries):
+            return [q for q in queries if 'store_product_fts' in q['sql']]
+
+        with CaptureQueriesContext(connection) as queries:
+            Category.objects.create(name='Brooches', slug='brooches')
+            self.rings.save()
+        self.assertEqual(fts_writes(queries), [])
+
+        self.rings.name = 'Bands'
+        with CaptureQueriesContext(connection) as queries:
+            self.rings.save()
+        # One DELETE and one INSERT ... SELECT, however many products
+        self.assertEqual(len(fts_writes(queries)), 2)
+        self.assertIn('Ruby Ring', self.search('bands'))
+
+
+class FacetCountTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        rings = Category.objects.create(name='Rings', slug='rings')
+        earrings = Category.objects.create(name='Earrings', slug='earrings')
+        small = Size.objects.create(name='Small', code='s')
+        red = Color.objects.create(name='Red', code='red')
+        gold_ring = make_product(rings, 'Gold Ring', price='800', metal='Gold')
+        gold_ring.sizes.add(small)
+        make_product(rings, 'Silver Ring', price='300', metal='Silver')
+        studs = make_product(earrings, 'Gold Studs', price='2500', metal='Gold')
+        studs.colors.add(red)
+        make_product(earrings, 'Hidden Studs', price='100', metal='Gold', available=False)
+
+    def counts(self, facets, facet):
+        return {v['value']: v['count'] for v in facets[facet]}
+
+    def test_counts_are_disjunctive(self):
+        facets = get_facets(normalize_filters(metals=['Gold']))
+        self.assertEqual(facets['total'], 2)
+        # Metal counts ignore the metal selection itself
+        self.assertEqual(self.counts(facets, 'metal'), {'Gold': 2, 'Silver': 1})
+        self.assertEqual(self.counts(facets, 'category'), {'rings': 1, 'earrings': 1})
+        self.assertEqual(self.counts(facets, 'size'), {'s': 1})
+        self.assertEqual(self.counts(facets, 'color'), {'red': 1})
+        self.assertEqual([b['count'] for b in facets['price']], [0, 1, 0, 1, 0])
+
+    def test_cached_per_signature_and_invalidated_on_save(self):
+        filters = normalize_filters(category='rings')
+        get_facets(filters)
+        with self.assertNumQueries(0):
+            facets = get_facets(normalize_filters(category='rings', metals=[]))
+        self.assertEqual(facets['total'], 2)
+
+        make_product(Category.objects.get(slug='rings'), 'New Ring', price='900', metal='Gold')
+        self.assertEqual(get_facets(filters)['total'], 3)
+
+    def test_search_page_total_matches_results(self):
+        response = self.client.get(reverse('store:search'), {'q': 'gold', 'metal': 'Gold'})
+        self.assertEqual(response.context['total_count'], 2)
+        self.assertEqual(len(response.context['products']), 2)
+
+
+class AnonymousPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Rings', slug='rings')
+        self.product = make_product(self.category, 'Ruby Ring', stock=5)
+        self.other = make_product(Category.objects.create(name='Chains', slug='chains'), 'Gold Chain')
+        self.url = self.product.get_absolute_url()
+
+    def test_second_anonymous_get_is_a_hit(self):
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'MISS')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertFalse([q for q in queries if 'store_product' in q['sql']])
+        self.assertContains(response, 'Ruby Ring')
+
+    def test_cart_badge_and_csrf_are_hole_punched(self):
+        self.client.get(self.url)
+        visitor = self.client_class(enforce_csrf_checks=True)
+        visitor.get(self.url)  # sets the CSRF cookie
+        response = visitor.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, 'Bag (<!--cart-count-->0<!--/cart-count-->)')
+
+        token = response.content.decode().split('name="csrfmiddlewaretoken" value="')[1].split('"')[0]
+        visitor.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1, 'csrfmiddlewaretoken': token})
+        response = visitor.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertContains(response, 'Bag (<!--cart-count-->1<!--/cart-count-->)', count=2)
+
+    def test_invalidation_is_scoped_to_affected_pages(self):
+        other_url = self.other.get_absolute_url()
+        for url in (self.url, other_url, reverse('store:about')):
+            self.client.get(url)
+
+        self.product.name = 'Ruby Band'
+        self.product.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'Ruby Band')
+        self.assertEqual(self.client.get(other_url)['X-Page-Cache'], 'HIT')
+        self.assertEqual(self.client.get(reverse('store:about'))['X-Page-Cache'], 'HIT')
+
+        Theme.objects.create(name='Dark', is_active=True)
+        self.assertEqual(self.client.get(reverse('store:about'))['X-Page-Cache'], 'MISS')
+
+    def test_tracking_params_and_host_never_leak_into_shared_pages(self):
+        response = self.client.get(self.url, {'fbclid': 'SECRET123', 'utm_source': 'mail'})
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertNotContains(response, 'SECRET123')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Page-Cache'], 'HIT')
+        self.assertNotContains(response, 'SECRET123')
+        self.assertNotContains(response, 'utm_source')
+
+        search = self.client.get(reverse('store:search'), {'q': 'ruby', 'gclid': 'SECRET456'})
+        self.assertNotContains(search, 'SECRET456')
+
+        response = self.client.get(self.url, HTTP_HOST='other.example')
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, 'content="http://other.example/')
+        self.assertNotContains(self.client.get(self.url), 'other.example')
+
+    def test_invalidation_from_another_process_is_seen(self):
+        # A separate backend instance stands in for a management command or
+        # another worker: only a shared cache carries its version bump over
+        from django.core.cache import caches
+        from .page_cache import invalidate_tags
+        self.client.get(self.url)
+        with mock.patch('store.caching.cache', caches.create_connection('default')):
+            invalidate_tags(f'product:{self.product.pk}')
+        self.assertEqual(self.client.get(self.url)['X-Page-Cache'], 'MISS')
+
+    def test_logged_in_users_bypass_cache(self):
+        from django.contrib.auth.models import User
+        User.objects.create_user('buyer', password='secret123')
+        self.client.get(self.url)
+        self.client.login(username='buyer', password='secret123')
+        self.assertFalse(self.client.get(self.url).has_header('X-Page-Cache'))
+
+
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name='Rings', slug='rings')
+        self.products = [make_product(category, f'Ring {i}') for i in range(3)]
+
+    def render_grid(self):
+        from django.template import Context, Template
+        template = Template("{% load product_tags %}{% product_cards products 'store/includes/product_card.html' %}")
+        return template.render(Context({'products': Product.objects.order_by('id')}))
+
+    def test_only_changed_cards_are_rendered(self):
+        from unittest import mock
+        from .templatetags import product_tags
+
+        first = self.render_grid()
+        with mock.patch.object(product_tags, 'render_to_string', wraps=product_tags.render_to_string) as render:
+            self.assertEqual(self.render_grid(), first)
+            self.assertEqual(render.call_count, 0)
+
+            self.products[1].name = 'Renamed Ring'
+            self.products[1].save()
+            html = self.render_grid()
+            self.assertEqual(render.call_count, 1)
+        self.assertIn('Renamed Ring', html)
+        self.assertEqual(html.count('class="product-card"'), 3)
+
+
+class ProductDetailQueryBudgetTests(TestCase):
+    # Product row + images + colors + sizes + variants + related products
+    # (conditional GET validators come from cached tag versions: no query)
+    CATALOG_QUERY_BUDGET = 6
+    # Everything, including cold per-worker caches (refdata, sale index)
+    PAGE_QUERY_CEILING = 16
+
+    def setUp(self):
+        cache.clear()
+        stub_image_derivatives(self)
+        category = Category.objects.create(name='Rings', slug='rings')
+        Category.objects.create(name='Adjustable', slug='adjustable', parent=category)
+        self.product = make_product(category, 'Ruby Ring', stock=10)
+
+    def add_catalog_data(self, n):
+        from .models import ProductImage, ProductVariant
+        category = self.product.category
+        for i in range(n):
+            size = Size.objects.create(name=f'US {i}', code=f'us-{i}-{n}')
+            color = Color.objects.create(name=f'Color {i}', code=f'c-{i}-{n}')
+            self.product.sizes.add(size)
+            self.product.colors.add(color)
+            ProductVariant.objects.create(product=self.product, size=size, color=color, stock=i)
+            ProductImage.objects.create(product=self.product, image=f'products/gallery/{n}-{i}.jpg')
+            make_product(category, f'Related {n}-{i}')
+
+    def get_queries(self):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries]
+
+    def catalog_queries(self, queries):
+        return [sql for sql in queries if '"store_product' in sql and not sql.startswith('INSERT')]
+
+    def test_query_count_is_bounded_and_flat(self):
+        self.add_catalog_data(1)
+        small = self.get_queries()
+        self.add_catalog_data(5)
+        large = self.get_queries()
+
+        self.assertLessEqual(len(self.catalog_queries(large)), self.CATALOG_QUERY_BUDGET)
+        self.assertLessEqual(len(large), self.PAGE_QUERY_CEILING)
+        self.assertEqual(len(large), len(small))
+
+    def test_variants_json_matches_variants(self):
+        self.add_catalog_data(2)
+        response = self.client.get(self.product.get_absolute_url())
+        variants = json.loads(response.context['variants_json'])
+        self.assertEqual(len(variants), 2)
+        self.assertEqual({v['stock'] for v in variants}, {0, 1})
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.jewelry = Category.objects.create(name='Jewelry', slug='jewelry')
+        self.rings = Category.objects.create(name='Rings', slug='rings', parent=self.jewelry)
+        self.bands = Category.objects.create(name='Bands', slug='bands', parent=self.rings)
+        self.watches = Category.objects.create(name='Watches', slug='watches')
+
+    def test_paths_are_maintained_on_move(self):
+        self.assertEqual(self.bands.path, f'{self.jewelry.pk}/{self.rings.pk}/{self.bands.pk}/')
+        self.rings.parent = self.watches
+        self.rings.save()
+        self.bands.refresh_from_db()
+        self.assertEqual(self.bands.path, f'{self.watches.pk}/{self.rings.pk}/{self.bands.pk}/')
+        self.assertEqual(set(self.watches.get_descendants()), {self.watches, self.rings, self.bands})
+
+    def test_cannot_move_under_own_descendant(self):
+        from django.core.exceptions import ValidationError
+        self.jewelry.parent = self.bands
+        with self.assertRaises(ValidationError):
+            self.jewelry.full_clean()
+
+    def test_parent_listing_includes_descendant_products(self):
+        make_product(self.bands, 'Gold Band')
+        make_product(self.watches, 'Steel Watch')
+        response = self.client.get(self.jewelry.get_absolute_url(), {'format': 'json'})
+        self.assertIn('Gold Band', response.json()['html'])
+        self.assertNotIn('Steel Watch', response.json()['html'])
+
+    def test_nav_tree_is_one_query(self):
+        with self.assertNumQueries(1):
+            roots = Category.get_tree()
+        self.assertEqual([c.slug for c in roots], ['jewelry', 'watches'])
+        self.assertEqual([c.slug for c in roots[0].nav_children], ['rings'])
+        self.assertEqual([c.slug for c in roots[0].nav_children[0].nav_children], ['bands'])
+
+
+class ReferenceDataCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        Size.objects.create(name='Small', code='s')
+
+    def test_warm_reads_do_not_query(self):
+        from . import refdata
+        refdata.get_refdata()
+        with self.assertNumQueries(0):
+            self.assertEqual(refdata.get_category('rings'), self.rings)
+            self.assertIsNone(refdata.get_category('no-such-slug'))
+            self.assertEqual(refdata.get_sizes()['s'].name, 'Small')
+            refdata.get_active_theme()
+
+    def test_saves_bump_the_shared_version(self):
+        from . import refdata
+        refdata.get_refdata()
+        Theme.objects.create(name='Gold', is_active=True)
+        self.assertEqual(refdata.get_active_theme().name, 'Gold')
+        self.rings.name = 'Bands'
+        self.rings.save()
+        self.assertEqual(refdata.get_category('rings').name, 'Bands')
+
+    def test_unknown_category_slug_is_a_404_without_category_query(self):
+        from . import refdata
+        refdata.get_refdata()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/no-such-slug/')
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse([q for q in queries if 'store_category' in q['sql']])
+
+    def test_suite_never_touches_the_sites_cache_or_theme_css(self):
+        from django.conf import settings
+        from pathlib import Path
+        base = Path(settings.BASE_DIR)
+        self.assertFalse(Path(settings.CACHES['default']['LOCATION']).is_relative_to(base))
+        self.assertFalse(Path(settings.THEME_CSS_ROOT).is_relative_to(base))
+
+    def test_process_local_cache_fails_the_system_check(self):
+        from .checks import check_shared_cache
+        self.assertEqual(check_shared_cache(None), [])
+        local = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with self.settings(CACHES=local):
+            self.assertEqual([e.id for e in check_shared_cache(None)], ['store.E001'])
+
+
+class ThemeStylesheetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(THEME_CSS_ROOT=Path(self.tmpdir.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_save_compiles_a_hashed_stylesheet(self):
+        theme = Theme.objects.create(name='Gold', is_active=True, primary_color='#aa0000')
+        path = Path(self.tmpdir.name) / f'theme-{theme.stylesheet_hash}.css'
+        self.assertIn('--primary-color: #aa0000;', path.read_text())
+
+        response = self.client.get('/about/')
+        self.assertContains(response, f'/theme-{theme.stylesheet_hash}.css')
+        self.assertNotContains(response, 'style="--primary-color')
+
+    def test_stylesheet_view_is_immutable(self):
+        theme = Theme.objects.create(name='Gold', is_active=True)
+        response = self.client.get(reverse('theme_stylesheet', args=[theme.stylesheet_hash]))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/css'))
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(self.client.get('/theme-000000000000.css').status_code, 404)
+
+    def test_retired_stylesheets_are_collected_after_grace(self):
+        from . import theme_css
+        theme = Theme.objects.create(name='Gold', is_active=True)
+        old_hash = theme.stylesheet_hash
+        theme.primary_color = '#123456'
+        theme.save()
+        self.assertNotEqual(theme.stylesheet_hash, old_hash)
+        # Still inside the grace period
+        self.assertIsNotNone(theme_css.read_stylesheet(old_hash))
+
+        self.assertEqual(theme_css.collect_garbage({theme.stylesheet_hash}, grace_seconds=-1), 1)
+        self.assertIsNone(theme_css.read_stylesheet(old_hash))
+        self.assertIsNotNone(theme_css.read_stylesheet(theme.stylesheet_hash))
+
+
+class RecommendationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.necklaces = Category.objects.create(name='Necklaces', slug='necklaces')
+        self.ring = make_product(self.rings, 'Ruby Ring')
+        self.band = make_product(self.rings, 'Plain Band')
+        self.chain = make_product(self.necklaces, 'Gold Chain')
+        self.pendant = make_product(self.necklaces, 'Ruby Pendant')
+
+    def order(self, *products, status='Pending'):
+        from orders.models import Order, OrderItem
+        order = Order.objects.create(first_name='A', address='x', postal_code='1', city='Dhaka', status=status)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, price=product.price)
+
+    def test_cooccurrence_is_sparse_and_cosine_scored(self):
+        from .recommendations import build_cooccurrence, top_neighbours
+        pairs, items = build_cooccurrence([{1, 2}, {1, 2}, {1, 3}, {4}])
+        self.assertEqual(pairs[1], {2: 2, 3: 1})
+        self.assertNotIn(4, pairs)
+        neighbours = top_neighbours(pairs, items, top_n=1)
+        self.assertEqual([n for n, _ in neighbours[1]], [2])
+
+    def test_rebuild_prefers_copurchases_and_falls_back_to_category(self):
+        from .models import ProductRecommendation
+        from .recommendations import rebuild_recommendations
+        self.order(self.ring, self.pendant)
+        self.order(self.ring, self.pendant)
+        self.order(self.ring, self.chain, status='Cancelled')
+        rebuild_recommendations(top_n=2)
+
+        ring_recs = ProductRecommendation.objects.filter(product=self.ring)
+        self.assertEqual(
+            [(r.recommended_id, r.source) for r in ring_recs],
+            [(self.pendant.id, 'copurchase'), (self.band.id, 'category')],
+        )
+        # Never ordered: category items only
+        self.assertEqual(
+            list(ProductRecommendation.objects.filter(product=self.chain).values_list('recommended_id', 'source')),
+            [(self.pendant.id, 'category')],
+        )
+
+    def test_product_detail_serves_stored_neighbours(self):
+        from .recommendations import rebuild_recommendations
+        self.order(self.ring, self.chain)
+        rebuild_recommendations()
+        response = self.client.get(self.ring.get_absolute_url())
+        self.assertEqual(response.context['related_products'], [self.chain, self.band])
+
+        # Unavailable neighbours drop out
+        self.chain.available = False
+        self.chain.save()
+        response = self.client.get(self.ring.get_absolute_url())
+        self.assertEqual(response.context['related_products'], [self.band])
+
+
+class AutocompleteTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.ring = make_product(self.rings, 'Ruby Ring', gemstone='Ruby', metal='Gold')
+        make_product(self.rings, 'Gold Band', metal='Gold')
+
+    def suggest(self, query):
+        response = self.client.get(reverse('store:search_autocomplete'), {'q': query})
+        return [(s['type'], s['label']) for s in response.json()['suggestions']]
+
+    def test_prefix_matches_word_starts_without_queries(self):
+        from . import autocomplete
+        autocomplete.get_index()
+        with self.assertNumQueries(0):
+            suggestions = self.suggest('rin')
+        self.assertEqual(suggestions, [('category', 'Rings'), ('product', 'Ruby Ring')])
+        self.assertEqual(self.suggest('ru'), [('gemstone', 'Ruby'), ('product', 'Ruby Ring')])
+        self.assertEqual(self.suggest('GOLD')[0], ('metal', 'Gold'))
+        self.assertEqual(self.suggest(''), [])
+
+    def test_product_changes_are_applied_incrementally(self):
+        from . import autocomplete
+        autocomplete.get_index()
+        self.ring.name = 'Emerald Ring'
+        self.ring.gemstone = 'Emerald'
+        self.ring.save()
+
+        with mock.patch.object(autocomplete, 'build_index') as build_index:
+            self.assertEqual(self.suggest('emer'), [('gemstone', 'Emerald'), ('product', 'Emerald Ring')])
+        build_index.assert_not_called()
+        self.assertEqual(self.suggest('ruby'), [])
+
+        self.ring.delete()
+        self.assertEqual(self.suggest('emer'), [])
+
+    def test_category_changes_rebuild(self):
+        self.assertEqual(self.suggest('band'), [('product', 'Gold Band')])
+        self.rings.name = 'Bands'
+        self.rings.save()
+        self.assertEqual(self.suggest('band')[0], ('category', 'Bands'))
+
+
+class FuzzySearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.necklaces = Category.objects.create(name='Necklaces', slug='necklaces')
+        self.bangles = Category.objects.create(name='Bangles', slug='bangles')
+        self.necklace = make_product(self.necklaces, 'Pearl Necklace', gemstone='Pearl')
+        self.bangle = make_product(self.bangles, 'Gold Bangle', metal='Gold')
+        earrings = Category.objects.create(name='Earrings', slug='earrings')
+        self.earring = make_product(earrings, 'Ruby Earring', gemstone='Ruby')
+
+    def search(self, query):
+        response = self.client.get(reverse('store:search'), {'q': query})
+        return response, {p.id for p in response.context['products']}
+
+    def test_exact_matches_are_not_rewritten(self):
+        from .fuzzy import resolve_query
+        self.assertEqual(resolve_query('pearl'), 'pearl')
+        # Cached: no index lookups, no trigram work
+        with mock.patch('store.fuzzy.get_index') as get_index, self.assertNumQueries(0):
+            self.assertEqual(resolve_query('pearl'), 'pearl')
+        get_index.assert_not_called()
+
+    def test_cached_exact_match_keeps_the_callers_spelling(self):
+        self.search('Pearl')
+        response, ids = self.search('pearl')
+        self.assertEqual(ids, {self.necklace.id})
+        self.assertIsNone(response.context['corrected_query'])
+
+    def test_typos_are_corrected_by_trigram_similarity(self):
+        response, ids = self.search('neklace')
+        self.assertEqual(ids, {self.necklace.id})
+        self.assertEqual(response.context['corrected_query'], 'necklace')
+        self.assertEqual(self.search('perl neckles')[1], {self.necklace.id})
+
+    def test_transliterations_map_to_catalog_terms(self):
+        self.assertEqual(self.search('churi')[1], {self.bangle.id})
+        self.assertEqual(self.search('kaner dul')[1], {self.earring.id})
+        self.assertEqual(self.search('চুড়ি')[1], {self.bangle.id})
+        self.assertEqual(self.search('sona')[1], {self.bangle.id})
+
+    def test_nonsense_stays_empty(self):
+        response, ids = self.search('xqzvw')
+        self.assertEqual(ids, set())
+        self.assertIsNone(response.context['corrected_query'])
+
+
+def make_image_file(name='photo.jpg', size=(1000, 800)):
+    from io import BytesIO
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image
+    buffer = BytesIO()
+    Image.new('RGB', size, (200, 30, 30)).save(buffer, 'JPEG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/jpeg')
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmpdir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.category = Category.objects.create(name='Rings', slug='rings')
+
+    def test_upload_generates_derivatives_and_meta(self):
+        from django.core.files.storage import default_storage
+        from .images import derivative_name
+        product = make_product(self.category, 'Ruby Ring', image=make_image_file())
+        product.refresh_from_db()
+        meta = product.image_meta
+        self.assertEqual((meta['width'], meta['height']), (1000, 800))
+        self.assertEqual(meta['widths'], [320, 640, 960, 1000])
+        self.assertTrue(meta['placeholder'].startswith('data:image/webp;base64,'))
+        self.assertLess(len(meta['placeholder']), 400)
+        for ext in ('webp', 'jpg'):
+            self.assertTrue(default_storage.exists(derivative_name(product.image.name, 320, ext)))
+
+        response = self.client.get(reverse('store:product_list'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '320w.webp 320w')
+        self.assertContains(response, 'width="1000"')
+        self.assertContains(response, 'height="800"')
+
+    def test_replacing_the_upload_replaces_derivatives(self):
+        from django.core.files.storage import default_storage
+        from .images import derivative_name
+        product = make_product(self.category, 'Ruby Ring', image=make_image_file('a.jpg'))
+        old_name = product.image.name
+        product.image = make_image_file('b.jpg', size=(400, 400))
+        product.save()
+        self.assertEqual(product.image_meta['widths'], [320, 400])
+        self.assertFalse(default_storage.exists(derivative_name(old_name, 320, 'jpg')))
+
+    def test_images_without_derivatives_render_plain(self):
+        from django.template import Context, Template
+        product = make_product(self.category, 'Ruby Ring', image=make_image_file())
+        Product.objects.filter(pk=product.pk).update(image_meta={})
+        product.refresh_from_db()
+        html = Template('{% load image_tags %}{% responsive_image product.image alt="x" %}').render(
+            Context({'product': product})
+        )
+        self.assertNotIn('srcset', html)
+        self.assertIn(product.image.url, html)
+
+    def test_backfill_command_uses_worker_pool(self):
+        from django.core.management import call_command
+        product = make_product(self.category, 'Ruby Ring', image=make_image_file())
+        Product.objects.filter(pk=product.pk).update(image_meta={})
+        call_command('generate_image_derivatives', workers=2, stdout=StringIO())
+        product.refresh_from_db()
+        self.assertEqual(product.image_meta['name'], product.image.name)
+        self.assertEqual(product.image_meta['widths'][-1], 1000)
+
+    def test_backfill_refreshes_cached_category_pages(self):
+        from django.core.management import call_command
+        product = make_product(self.category, 'Ruby Ring', image=make_image_file())
+        Product.objects.filter(pk=product.pk).update(image_meta={})
+        url = reverse('store:product_list_by_category', args=['rings'])
+        self.assertNotContains(self.client.get(url), '320w.webp')
+        call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        response = self.client.get(url)
+        self.assertEqual(response['X-Page-Cache'], 'MISS')
+        self.assertContains(response, '320w.webp')
+
+    def test_unrelated_saves_leave_the_backfill_to_the_command(self):
+        product = make_product(self.category, 'Ruby Ring', stock=3, image=make_image_file())
+        Product.objects.filter(pk=product.pk).update(image_meta={})
+        product = Product.objects.get(pk=product.pk)
+        product.stock -= 1
+        with mock.patch('store.images.generate') as generate:
+            product.save()
+        generate.assert_not_called()
+
+    def test_backfill_command_invalidates_gallery_and_hero_pages(self):
+        from django.core.management import call_command
+        from .models import HeroSection, ProductImage
+        product = make_product(self.category, 'Ruby Ring')
+        gallery = ProductImage.objects.create(product=product, image=make_image_file())
+        hero = HeroSection.objects.create(name='Main', is_active=True, background_image=make_image_file())
+        ProductImage.objects.filter(pk=gallery.pk).update(image_meta={})
+        HeroSection.objects.filter(pk=hero.pk).update(background_image_meta={})
+        with mock.patch('store.management.commands.generate_image_derivatives.invalidate_tags') as invalidate:
+            call_command('generate_image_derivatives', workers=1, stdout=StringIO())
+        self.assertEqual(set(invalidate.call_args.args), {
+            'listing', f'product:{product.pk}', f'category:{self.category.pk}', 'hero',
+        })
+
+
+class HeroVideoTranscodeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmpdir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_hero(self, name='clip.mp4'):
+        from .models import HeroSection
+        hero = HeroSection.objects.create(
+            name='Launch', is_active=True, background_type='video', background_video=self.upload(name),
+        )
+        return hero
+
+    @staticmethod
+    def upload(name):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return SimpleUploadedFile(name, b'not really a video', content_type='video/mp4')
+
+    @staticmethod
+    def fake_ffmpeg(command, **kwargs):
+        with open(command[-1], 'wb') as f:
+            f.write(b'output')
+
+    def transcode_pending(self):
+        from django.core.management import call_command
+        with mock.patch('store.video.get_ffmpeg', return_value='/usr/bin/ffmpeg'), \
+                mock.patch('store.video.subprocess.run', side_effect=self.fake_ffmpeg) as run:
+            call_command('transcode_hero_videos', pending=True, stdout=StringIO())
+        return run
+
+    def test_saving_only_marks_pending_for_the_command(self):
+        with mock.patch('store.video.transcode') as transcode, self.captureOnCommitCallbacks(execute=True):
+            hero = self.make_hero()
+        transcode.assert_not_called()
+        self.assertEqual(hero.background_video_meta['status'], 'pending')
+
+        # Until it's done the original is served
+        response = self.client.get('/')
+        self.assertContains(response, f'data-src-high="{hero.background_video.url}"')
+        self.assertNotContains(response, 'autoplay muted')
+
+        self.assertEqual(self.transcode_pending().call_count, 3)
+        hero.refresh_from_db()
+        self.assertEqual(hero.background_video_meta['status'], 'ready')
+        # Nothing left to do
+        self.assertEqual(self.transcode_pending().call_count, 0)
+
+    def test_old_renditions_are_kept_until_the_new_ones_are_saved(self):
+        from django.core.files.storage import default_storage
+        hero = self.make_hero('first.mp4')
+        self.transcode_pending()
+        hero.refresh_from_db()
+        old_files = [*hero.background_video_meta['renditions'].values(), hero.background_video_meta['poster']]
+
+        hero.background_video = self.upload('second.mp4')
+        hero.save()
+        self.assertEqual(hero.background_video_meta['status'], 'pending')
+        self.assertTrue(all(default_storage.exists(name) for name in old_files))
+
+        self.transcode_pending()
+        hero.refresh_from_db()
+        self.assertEqual(hero.background_video_meta['status'], 'ready')
+        self.assertFalse(any(default_storage.exists(name) for name in old_files))
+
+    def test_transcode_stores_renditions_and_poster(self):
+        from django.core.files.storage import default_storage
+        from . import video
+        hero = self.make_hero()
+        with mock.patch('store.video.get_ffmpeg', return_value='/usr/bin/ffmpeg'), \
+                mock.patch('store.video.subprocess.run', side_effect=self.fake_ffmpeg) as run:
+            meta = video.transcode_instance(hero, 'background_video')
+
+        self.assertEqual(meta['status'], 'ready')
+        self.assertEqual(run.call_count, 3)
+        self.assertIn('-an', run.call_args_list[0].args[0])
+        for name in [*meta['renditions'].values(), meta['poster']]:
+            self.assertTrue(default_storage.exists(name))
+
+        cache.clear()
+        response = self.client.get('/')
+        self.assertContains(response, 'low.mp4')
+        self.assertContains(response, 'poster="')
+
+    def test_missing_ffmpeg_fails_gracefully(self):
+        from . import video
+        hero = self.make_hero()
+        with mock.patch('store.video.get_ffmpeg', return_value=None), self.assertLogs('store.video', 'ERROR'):
+            meta = video.transcode_instance(hero, 'background_video')
+        self.assertEqual(meta['status'], 'failed')
+        self.assertEqual(video.get_sources(hero.background_video)['low'], hero.background_video.url)
+
+
+class SitemapTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        stub_image_derivatives(self)
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.ring = make_product(self.rings, 'Ruby Ring', image='products/ruby.jpg')
+        from .models import ProductImage
+        ProductImage.objects.create(product=self.ring, image='products/gallery/ruby-side.jpg')
+        make_product(self.rings, 'Hidden Ring', available=False)
+
+    def test_index_lists_every_section(self):
+        response = self.client.get('/sitemap.xml')
+        self.assertEqual(response.status_code, 200)
+        for section in ('static', 'products', 'categories'):
+            self.assertContains(response, f'http://testserver/sitemap-{section}.xml')
+
+    def test_product_pages_carry_image_entries(self):
+        response = self.client.get('/sitemap-products.xml')
+        self.assertContains(response, 'xmlns:image=')
+        self.assertContains(response, f'<loc>http://testserver{self.ring.get_absolute_url()}</loc>')
+        self.assertContains(response, '<image:loc>http://testserver/media/products/ruby.jpg</image:loc>')
+        self.assertContains(response, '<image:loc>http://testserver/media/products/gallery/ruby-side.jpg</image:loc>')
+        self.assertNotContains(response, 'hidden-ring')
+
+    def test_pages_are_cached_until_products_change(self):
+        self.client.get('/sitemap-products.xml')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/sitemap-products.xml')
+        # The version comes from cached tag versions alone
+        self.assertEqual(len([q for q in queries if 'store_product' in q['sql']]), 0)
+
+        self.ring.name = 'Ruby Band'
+        self.ring.slug = 'ruby-band'
+        self.ring.save()
+        self.assertContains(self.client.get('/sitemap-products.xml'), 'ruby-band')
+
+    def test_gallery_image_replaced_in_place_refreshes_the_page(self):
+        from .models import ProductImage
+        self.client.get('/sitemap-products.xml')
+        gallery = ProductImage.objects.get(product=self.ring)
+        gallery.image = 'products/gallery/ruby-top.jpg'
+        gallery.save()
+        response = self.client.get('/sitemap-products.xml')
+        self.assertContains(response, 'ruby-top.jpg')
+        self.assertNotContains(response, 'ruby-side.jpg')
+
+    def test_unknown_section_is_404(self):
+        self.assertEqual(self.client.get('/sitemap-nope.xml').status_code, 404)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.product = make_product(self.rings, 'Ruby Ring')
+        self.sibling = make_product(self.rings, 'Opal Ring')
+        self.other = make_product(Category.objects.create(name='Chains', slug='chains'), 'Gold Chain')
+        self.url = self.product.get_absolute_url()
+        self.category_url = reverse('store:product_list_by_category', args=['rings'])
+
+    def revalidate(self, url):
+        etag = self.client.get(url)['ETag']
+        return self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_page_is_a_304_without_rendering(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.has_header('Last-Modified'))
+        etag = response['ETag']
+        # Fresh page cache copy: validators from cached versions, no queries
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse([q for q in queries if 'store_product' in q['sql']])
+
+        # Copy expired: rebuilt, but the unchanged page is still a 304
+        from django.test import RequestFactory
+        from .page_cache import _cache_key
+        cache.delete(_cache_key(RequestFactory().get(self.url)))
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=f'"stale", W/{etag}')
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(self.category_url)
+        response = self.client.get(self.category_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_validators_follow_products_theme_and_cart(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.other.price = Decimal('5.00')
+        self.other.save()  # another category: still fresh
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get(self.category_url, HTTP_IF_NONE_MATCH=self.client.get(self.category_url)['ETag']).status_code, 304)
+
+        category_etag = self.client.get(self.category_url)['ETag']
+        self.sibling.price = Decimal('80.00')
+        self.sibling.save()
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(self.category_url, HTTP_IF_NONE_MATCH=category_etag).status_code, 200)
+
+        etag = self.client.get(self.url)['ETag']
+        Theme.objects.create(name='Dark', is_active=True)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(self.url)['ETag']
+        self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1})
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_unavailable_products_and_logged_in_users_get_no_validators(self):
+        from django.contrib.auth.models import User
+        self.product.available = False
+        self.product.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+        User.objects.create_user('buyer', password='secret123')
+        self.client.login(username='buyer', password='secret123')
+        self.assertFalse(self.client.get(self.sibling.get_absolute_url()).has_header('ETag'))
+
+
+class DirtyFieldTrackingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name='Rings', slug='rings')
+        make_product(self.category, 'Ruby Ring', stock=5, discount_percentage=Decimal('10.00'))
+        self.product = Product.objects.get(name='Ruby Ring')
+
+    def test_save_updates_only_changed_columns_without_a_select(self):
+        self.assertFalse(self.product.get_dirty_fields())
+        self.product.stock = 4
+        self.assertEqual(self.product.get_dirty_fields(), {'stock': 5})
+
+        with CaptureQueriesContext(connection) as queries:
+            self.product.save()
+        product_queries = [q['sql'] for q in queries if 'store_product' in q['sql']]
+        self.assertFalse([sql for sql in product_queries if sql.startswith('SELECT')])
+        [update] = [sql for sql in product_queries if sql.startswith('UPDATE')]
+        self.assertIn('"stock"', update)
+        self.assertIn('"updated"', update)
+        self.assertNotIn('"name"', update)
+        self.assertFalse(self.product.get_dirty_fields())
+
+        # Untouched discount: the percentage survives
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.discount_percentage, Decimal('10.00'))
+
+    def test_unchanged_save_without_auto_now_still_signals(self):
+        from django.db.models.signals import post_save
+        from .models import ProductImage
+        stub_image_derivatives(self)
+        image = ProductImage.objects.create(product=self.product, image='products/gallery/a.jpg')
+        image = ProductImage.objects.get(pk=image.pk)
+        received = []
+        post_save.connect(lambda **kwargs: received.append(kwargs['instance']), sender=ProductImage, weak=False,
+                          dispatch_uid='dirty-test')
+        self.addCleanup(post_save.disconnect, sender=ProductImage, dispatch_uid='dirty-test')
+        with CaptureQueriesContext(connection) as queries:
+            image.save()
+        self.assertEqual(received, [image])
+        self.assertTrue([q for q in queries if q['sql'].startswith('UPDATE')])
+
+    def test_discount_amount_change_recalculates_percentage(self):
+        self.product.discount_amount = Decimal('25.00')
+        self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.discount_percentage, Decimal('25.00'))
+
+        # Products built by hand still compare against the stored row
+        detached = Product(pk=self.product.pk, category=self.category, name='Ruby Ring', slug='ruby-ring',
+                           price=Decimal('100.00'), discount_amount=Decimal('25.00'), discount_percentage=Decimal('25.00'),
+                           created=self.product.created)
+        self.assertFalse(detached.is_tracked)
+        detached.save()
+        self.assertEqual(Product.objects.get(pk=self.product.pk).discount_percentage, Decimal('25.00'))
+
+    def test_mutated_json_and_deferred_fields(self):
+        self.product.image_meta['name'] = 'products/x.jpg'
+        self.assertIn('image_meta', self.product.get_dirty_fields())
+
+        product = Product.objects.only('id', 'stock').get(pk=self.product.pk)
+        product.name = 'Ruby Band'  # deferred, but assigned
+        product.save()
+        self.assertEqual(Product.objects.get(pk=product.pk).name, 'Ruby Band')
+
+    def test_stock_only_saves_skip_search_and_facet_work(self):
+        from unittest import mock
+        from . import signals
+
+        with mock.patch.object(signals.search, 'index_product') as index, \
+                mock.patch.object(signals, 'bump_version') as bump:
+            self.product.stock = 3
+            self.product.save()
+            index.assert_not_called()
+            bump.assert_not_called()
+
+            self.product.metal = 'Gold'
+            self.product.save()
+            index.assert_called_once()
+            bump.assert_called_once()
+
+    def test_moving_category_invalidates_both_category_pages(self):
+        other = Category.objects.create(name='Bands', slug='bands')
+        old_url = reverse('store:product_list_by_category', args=['rings'])
+        self.client.get(old_url)
+        self.product.category = other
+        self.product.save()
+        self.assertEqual(self.client.get(old_url)['X-Page-Cache'], 'MISS')
+
+
+class RepricingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.bands = Category.objects.create(name='Bands', slug='bands', parent=self.rings)
+        self.chains = Category.objects.create(name='Chains', slug='chains')
+        self.ring = make_product(self.rings, 'Ruby Ring', price='1234.00')
+        self.band = make_product(self.bands, 'Gold Band', price='200.00', discount_amount=Decimal('20.00'))
+        self.chain = make_product(self.chains, 'Gold Chain', price='500.00')
+
+    def reload(self, product):
+        return Product.objects.get(pk=product.pk)
+
+    def test_fixed_discount_matches_product_save(self):
+        from . import repricing
+        repricing.reprice(Product.objects.filter(pk=self.ring.pk), discount_amount=Decimal('123.40'))
+
+        saved = self.reload(self.chain)
+        saved.price = Decimal('1234.00')
+        saved.discount_amount = Decimal('123.40')
+        saved.save()
+        self.assertEqual(self.reload(self.ring).discount_percentage, self.reload(saved).discount_percentage)
+        self.assertEqual(self.reload(self.ring).discount_percentage, Decimal('10.00'))
+
+    def test_price_change_rounding_and_rollback(self):
+        from . import repricing
+        before = {p.pk: (p.price, p.discount_percentage, p.discount_amount, p.updated) for p in Product.objects.all()}
+        page = reverse('store:product_list_by_category', args=['rings'])
+        self.client.get(page)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            batch = repricing.reprice(
+                Product.objects.filter(category__path__startswith=self.rings.path),
+                price_change=Decimal('10'), rounding_step=Decimal('10'), rounding='up',
+                discount_percentage=Decimal('15'), description='Eid', batch_size=1,
+            )
+        self.assertEqual(batch.product_count, 2)
+        ring, band = self.reload(self.ring), self.reload(self.band)
+        self.assertEqual(ring.price, Decimal('1360.00'))  # 1357.40 rounded up
+        self.assertEqual((band.price, band.discount_percentage, band.discount_amount), (Decimal('220.00'), Decimal('15.00'), None))
+        self.assertGreater(ring.updated, before[ring.pk][3])
+        self.assertEqual(self.reload(self.chain).price, Decimal('500.00'))
+        self.assertEqual(self.client.get(page)['X-Page-Cache'], 'MISS')
+
+        self.assertEqual(repricing.rollback(batch), 2)
+        for product in Product.objects.all():
+            self.assertEqual((product.price, product.discount_percentage, product.discount_amount), before[product.pk][:3])
+        with self.assertRaises(repricing.RepricingError):
+            repricing.rollback(batch)
+
+    def test_failure_rolls_back_the_whole_run(self):
+        from unittest import mock
+        from . import repricing
+
+        original = repricing._write
+        calls = []
+
+        def fail_second_chunk(*args):
+            calls.append(1)
+            if len(calls) == 2:
+                raise RuntimeError('disk full')
+            return original(*args)
+
+        with mock.patch.object(repricing, '_write', fail_second_chunk), self.assertRaises(RuntimeError):
+            repricing.reprice(Product.objects.all(), price_change=Decimal('-50'), batch_size=1)
+        self.assertEqual(self.reload(self.ring).price, Decimal('1234.00'))
+        from .models import RepricingBatch
+        self.assertFalse(RepricingBatch.objects.exists())
+
+    def test_command_and_admin_action(self):
+        from django.contrib.auth.models import User
+        from django.core.management import call_command
+        from .models import RepricingBatch
+
+        out = StringIO()
+        call_command('reprice_products', '--category', 'chains', '--discount-amount', '50', '--dry-run', stdout=out)
+        self.assertIn('Would reprice 1 products', out.getvalue())
+        self.assertIsNone(self.reload(self.chain).discount_amount)
+
+        call_command('reprice_products', '--category', 'chains', '--discount-amount', '50', stdout=StringIO())
+        self.assertEqual(self.reload(self.chain).discount_percentage, Decimal('10.00'))
+        call_command('reprice_products', '--rollback', str(RepricingBatch.objects.get().pk), stdout=StringIO())
+        self.assertIsNone(self.reload(self.chain).discount_percentage)
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        self.client.login(username='admin', password='secret123')
+        url = reverse('admin:store_product_changelist')
+        data = {'action': 'reprice_products', '_selected_action': [self.ring.pk, self.chain.pk]}
+        self.assertContains(self.client.post(url, data), 'Reprice products')
+        response = self.client.post(url, {**data, 'apply': '1', 'price_change': '', 'rounding': 'nearest',
+                                           'discount': 'clear', 'discount_value': '', 'description': ''})
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(url, {**data, 'apply': '1', 'price_change': '-10', 'rounding_step': '100',
+                                           'rounding': 'nearest', 'discount': 'keep', 'description': 'Sale'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.reload(self.ring).price, Decimal('1100.00'))
+        self.assertEqual(self.reload(self.chain).price, Decimal('500.00'))  # 450 -> nearest 100
+
+
+class FlashSaleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        from datetime import timedelta
+        from django.utils import timezone
+        self.now = timezone.now()
+        self.hour = timedelta(hours=1)
+        self.jewelry = Category.objects.create(name='Jewelry', slug='jewelry')
+        self.rings = Category.objects.create(name='Rings', slug='rings', parent=self.jewelry)
+        self.ring = make_product(self.rings, 'Ruby Ring', price='1000.00', metal='Silver', stock=5)
+        self.chain = make_product(Category.objects.create(name='Chains', slug='chains'), 'Gold Chain', price='500.00', metal='Gold')
+
+    def sale(self, percentage, start, end, **scope):
+        from .models import SaleRule
+        return SaleRule.objects.create(
+            name='Sale', discount_percentage=Decimal(percentage),
+            starts_at=self.now + start * self.hour, ends_at=self.now + end * self.hour, **scope,
+        )
+
+    def test_boundaries_are_exact_and_best_rule_wins(self):
+        from . import sales
+        self.sale('10', 0, 2, category=self.jewelry)  # via the parent category
+        self.sale('25', 1, 3, metal='Silver')
+        self.sale('50', -2, -1, product=self.ring)  # already over
+
+        at = lambda hours: self.now + hours * self.hour
+        self.assertEqual(sales.resolve([self.ring], at=at(-0.5)), {})
+        self.assertEqual(sales.resolve([self.ring], at=at(0)), {self.ring.pk: Decimal('10.00')})
+        self.assertEqual(sales.resolve([self.ring, self.chain], at=at(1)), {self.ring.pk: Decimal('25.00')})
+        self.assertEqual(sales.resolve([self.ring], at=at(2.5)), {self.ring.pk: Decimal('25.00')})
+        self.assertEqual(sales.resolve([self.ring], at=at(3)), {})
+        self.assertEqual(sales.next_boundary(at(0)), at(1))
+
+    def test_prices_listings_and_cart_follow_the_sale(self):
+        from unittest import mock
+        from django.utils import timezone
+        self.client.post(reverse('cart:cart_add', args=[self.ring.id]), {'quantity': 2})
+        listing = reverse('store:product_list_by_category', args=['rings'])
+        self.assertNotContains(self.client.get(listing), 'TK.800')
+
+        self.sale('20', 1, 2, product=self.ring)
+        self.assertEqual(self.client.get(listing)['X-Page-Cache'], 'MISS')  # rule saved
+        self.assertNotContains(self.client.get(listing), 'TK.800')
+
+        with mock.patch.object(timezone, 'now', return_value=self.now + self.hour):
+            response = self.client.get(listing)
+            self.assertEqual(response['X-Page-Cache'], 'MISS')  # boundary crossed
+            self.assertContains(response, 'TK.800')
+            self.assertContains(response, '-20%')
+            product = Product.objects.get(pk=self.ring.pk)
+            self.assertEqual(product.discounted_price, Decimal('800.00'))
+            self.assertEqual(self.client.get(reverse('cart:cart_detail')).context['cart'].get_total_price(), Decimal('1600.00'))
+
+        with mock.patch.object(timezone, 'now', return_value=self.now + 2 * self.hour):
+            self.assertNotContains(self.client.get(listing), 'TK.800')
+            self.assertEqual(self.client.get(reverse('cart:cart_detail')).context['cart'].get_total_price(), Decimal('2000.00'))
+
+    def test_own_discount_is_kept_when_bigger(self):
+        self.ring.discount_percentage = Decimal('30.00')
+        self.ring.save()
+        self.sale('20', -1, 1, category=self.rings)
+        product = Product.objects.get(pk=self.ring.pk)
+        self.assertEqual(product.sale_percentage, Decimal('20.00'))
+        self.assertEqual(product.discounted_price, Decimal('700.00'))
+        self.assertEqual(product.current_discount_percentage, Decimal('30.00'))
+
+
+class BulkProductImportTests(TestCase):
+    HEADER = 'id,name,slug,category,price,stock,available,metal,gemstone,is_adjustable,sizes,colors,description\n'
+
+    def setUp(self):
+        cache.clear()
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=self.tmpdir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        Size.objects.create(name='US 6', code='6')
+        Size.objects.create(name='US 7', code='7')
+        Color.objects.create(name='Gold', code='gold')
+        self.existing = make_product(self.rings, 'Ruby Ring', price='100.00', stock=1)
+
+    def run_import(self, content, name='products.csv', batch_size=500):
+        from django.core.files.base import ContentFile
+        from . import bulk_import
+        from .models import ProductImportJob
+        job = ProductImportJob()
+        job.file.save(name, ContentFile(content.encode()))
+        return bulk_import.run(job, batch_size=batch_size)
+
+    def test_creates_updates_and_reports_bad_rows(self):
+        content = self.HEADER + (
+            f'{self.existing.pk},Ruby Ring,ruby-ring,Rings,150.00,7,1,Gold,Ruby,0,"6,7",gold,Updated\n'
+            ',Opal Band,,Rings,90,3,yes,Silver,Opal,1,7,,New\n'
+            ',Ghost Ring,,Nowhere,90,3,1,,,0,,,Bad category\n'
+            ',Cheap Ring,,Rings,abc,3,1,,,0,,,Bad price\n'
+            ',No Price,,Rings,,3,1,,,0,,,Missing price\n'
+        )
+        job = self.run_import(content, batch_size=2)
+        self.assertEqual(job.status, 'done')
+        self.assertEqual((job.total_rows, job.processed_rows, job.progress), (5, 5, 100))
+        self.assertEqual((job.created_count, job.updated_count, job.error_count), (1, 1, 3))
+        self.assertEqual([error['row'] for error in job.errors], [4, 5, 6])
+
+        ring = Product.objects.get(pk=self.existing.pk)
+        self.assertEqual((ring.price, ring.stock, ring.metal, ring.description), (Decimal('150.00'), 7, 'Gold', 'Updated'))
+        self.assertGreater(ring.updated, self.existing.updated)
+        self.assertEqual(sorted(ring.sizes.values_list('code', flat=True)), ['6', '7'])
+        band = Product.objects.get(slug='opal-band')
+        self.assertTrue(band.is_adjustable)
+        self.assertEqual(list(band.sizes.values_list('code', flat=True)), ['7'])
+        self.assertEqual(list(band.colors.all()), [])
+        # Signals were skipped, but the search index was kept up to date
+        self.assertContains(self.client.get(reverse('store:search'), {'q': 'opal'}), 'Opal Band')
+
+    def test_pricing_columns_and_categories_round_trip_through_an_export(self):
+        from .exports import ProductExport
+        other_rings = Category.objects.create(name='Rings', slug='rings-sale')
+        Product.objects.filter(pk=self.existing.pk).update(
+            cost_price=Decimal('40.00'), discount_percentage=Decimal('10.00'), category=other_rings,
+        )
+        content = b''.join(ProductExport().response().streaming_content).decode('utf-8-sig')
+        Product.objects.filter(pk=self.existing.pk).update(
+            cost_price=Decimal('0'), discount_percentage=None, category=self.rings,
+        )
+        job = self.run_import(content)
+        self.assertEqual((job.updated_count, job.error_count), (1, 0))
+        ring = Product.objects.get(pk=self.existing.pk)
+        self.assertEqual((ring.cost_price, ring.discount_percentage, ring.discount_amount, ring.category),
+                         (Decimal('40.00'), Decimal('10.00'), None, other_rings))
+
+        # Two categories share the name: it alone is an error
+        Category.objects.create(name='Gold Bands', slug='gold-bands')
+        Category.objects.create(name='Gold Bands', slug='gold-bands-sale')
+        job = self.run_import(f'id,category\n{self.existing.pk},Gold Bands\n')
+        self.assertIn('ambiguous', job.errors[0]['error'])
+
+    def test_partial_columns_only_touch_those_fields(self):
+        self.existing.sizes.add(Size.objects.get(code='6'))
+        job = self.run_import(f'id,stock\n{self.existing.pk},42\n')
+        self.assertEqual(job.updated_count, 1)
+        ring = Product.objects.get(pk=self.existing.pk)
+        self.assertEqual((ring.stock, ring.price, ring.name), (42, Decimal('100.00'), 'Ruby Ring'))
+        self.assertEqual(ring.sizes.count(), 1)
+
+    def test_queries_per_batch_do_not_grow_with_rows(self):
+        def queries_for(n):
+            rows = ''.join(f',Ring {n}-{i},,Rings,{100 + i},1,1,Gold,,0,"6,7",gold,\n' for i in range(n))
+            with CaptureQueriesContext(connection) as queries:
+                job = self.run_import(self.HEADER + rows)
+            self.assertEqual(job.created_count, n)
+            return len([q for q in queries if 'store_product' in q['sql'] and 'fts' not in q['sql']])
+
+        self.assertEqual(queries_for(5), queries_for(40))
+
+    def test_unsupported_file_fails_the_job(self):
+        job = self.run_import('whatever', name='products.pdf')
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('Unsupported file type', job.errors[0]['error'])
+
+    def test_admin_upload_is_queued_for_the_command(self):
+        from django.contrib.auth.models import User
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.core.management import call_command
+        from .models import ProductImportJob
+
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        self.client.login(username='admin', password='secret123')
+        upload = SimpleUploadedFile('sheet.csv', f'id,stock\n{self.existing.pk},9\n'.encode())
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('admin:store_productimportjob_add'), {'file': upload})
+        self.assertEqual(response.status_code, 302)
+        job = ProductImportJob.objects.get()
+        self.assertEqual(job.status, 'pending')
+
+        call_command('import_products', pending=True, stdout=StringIO(), stderr=StringIO())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.existing.refresh_from_db()
+        self.assertEqual(self.existing.stock, 9)
+        self.assertContains(self.client.get(reverse('admin:store_productimportjob_change', args=[job.pk])), '100% (1/1 rows)')
+
+    def test_jobs_without_a_heartbeat_are_failed(self):
+        from datetime import timedelta
+        from django.core.files.base import ContentFile
+        from django.utils import timezone
+        from . import bulk_import
+        from .models import ProductImportJob
+
+        job = ProductImportJob()
+        job.file.save('sheet.csv', ContentFile(b'id,stock\n'))
+        started = timezone.now() - bulk_import.STALE_AFTER - timedelta(minutes=1)
+        ProductImportJob.objects.filter(pk=job.pk).update(status='running', started_at=started, heartbeat_at=started)
+        alive = ProductImportJob.objects.create(file=job.file.name, status='running', heartbeat_at=timezone.now())
+
+        # Only the cron runner writes; the admin list is read-only
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        self.client.login(username='admin', password='secret123')
+        self.client.get(reverse('admin:store_productimportjob_changelist'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+
+        from django.core.management import call_command
+        stderr = StringIO()
+        call_command('import_products', pending=True, stdout=StringIO(), stderr=stderr)
+        self.assertIn('Marked 1 stalled', stderr.getvalue())
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.errors[-1]['error'], bulk_import.STALE_ERROR)
+        alive.refresh_from_db()
+        self.assertEqual(alive.status, 'running')
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        from django.contrib.auth.models import User
+        User.objects.create_superuser('admin', 'admin@example.com', 'secret123')
+        self.client.login(username='admin', password='secret123')
+        self.rings = Category.objects.create(name='Rings', slug='rings')
+        self.size = Size.objects.create(name='US 6', code='6')
+
+    def read_csv(self, response):
+        import csv
+        self.assertTrue(response.streaming)
+        content = b''.join(response.streaming_content).decode('utf-8-sig')
+        return list(csv.DictReader(StringIO(content)))
+
+    def test_product_export_round_trips_import_columns(self):
+        from .exports import ProductExport
+        ring = make_product(self.rings, 'Ruby Ring', price='100.00', stock=3)
+        ring.sizes.add(self.size)
+        make_product(self.rings, 'Opal Ring', price='80.00')
+
+        rows = self.read_csv(ProductExport().response())
+        self.assertEqual([row['name'] for row in rows], ['Ruby Ring', 'Opal Ring'])
+        self.assertEqual((rows[0]['category'], rows[0]['price'], rows[0]['stock'], rows[0]['sizes']),
+                         ('rings', '100.00', '3', '6'))
+        self.assertEqual(rows[1]['sizes'], '')
+
+    def test_formula_like_text_is_escaped_and_imports_back(self):
+        from django.core.files.base import ContentFile
+        from django.core.files.storage import InMemoryStorage
+        from .bulk_import import iter_rows
+        from .exports import ProductExport, _cell
+        make_product(self.rings, '=HYPERLINK("http://x")', description='-18k gold')
+        rows = self.read_csv(ProductExport().response())
+        self.assertEqual(rows[0]['name'], '\'=HYPERLINK("http://x")')
+        self.assertEqual(rows[0]['description'], "'-18k gold")
+        self.assertEqual(_cell('@SUM(A1)'), "'@SUM(A1)")
+        self.assertEqual(_cell(-5), -5)
+
+        storage = InMemoryStorage()
+        content = b''.join(ProductExport().response().streaming_content)
+        name = storage.save('products.csv', ContentFile(content))
+        self.assertEqual(next(iter_rows(name, storage))['description'], '-18k gold')
+
+    def test_queries_grow_per_chunk_not_per_row(self):
+        from .exports import ProductExport
+        for i in range(12):
+            make_product(self.rings, f'Ring {i}').sizes.add(self.size)
+        export = ProductExport()
+        export.chunk_size = 5
+        with CaptureQueriesContext(connection) as queries:
+            rows = list(export.rows(Product.objects.all()))
+        self.assertEqual(len(rows), 12)
+        # One values() query, then a sizes and a colors query per chunk of 5
+        self.assertEqual(len(queries), 1 + 2 * 3)
+
+    def test_admin_product_export_streams(self):
+        from .exports import xlsx_available
+        make_product(self.rings, 'Ruby Ring')
+        page = self.client.get(reverse('admin:store_product_export'))
+        self.assertContains(page, 'CSV files are streamed')
+        # Only CSV starts straight away; XLSX is built first
+        self.assertEqual('built in full' in page.content.decode(), xlsx_available())
+        self.assertContains(self.client.get(reverse('admin:store_product_changelist')),
+                            reverse('admin:store_product_export'))
+        response = self.client.post(reverse('admin:store_product_export'), {'file_format': 'csv'})
+        self.assertEqual([row['name'] for row in self.read_csv(response)], ['Ruby Ring'])
+
+
+class StorefrontApiTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.jewelry = Category.objects.create(name='Jewelry', slug='jewelry')
+        self.rings = Category.objects.create(name='Rings', slug='rings', parent=self.jewelry)
+        self.ruby = make_product(self.rings, 'Ruby Ring', price='100.00', stock=2, metal='Gold')
+        self.opal = make_product(self.rings, 'Opal Ring', price='80.00', discount_percentage=Decimal('25'))
+        self.hidden = make_product(self.rings, 'Hidden Ring', available=False)
+
+    def get(self, name, *args, **params):
+        return self.client.get(reverse(f'api_v1:{name}', args=args), params)
+
+    def test_product_list_sparse_fields_without_model_instances(self):
+        with mock.patch.object(Product, '__init__', side_effect=AssertionError('instantiated')):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.get('product_list', fields='name,discounted_price,category', sort='price_asc')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()['data'], [
+            {'id': self.opal.pk, 'name': 'Opal Ring', 'discounted_price': '60.00', 'category': 'rings'},
+            {'id': self.ruby.pk, 'name': 'Ruby Ring', 'discounted_price': '100.00', 'category': 'rings'},
+        ])
+        product_queries = [q['sql'] for q in queries if 'store_product' in q['sql']]
+        self.assertEqual(len(product_queries), 1)
+        self.assertNotIn('description', product_queries[0])
+
+    def test_keyset_pagination_and_filters(self):
+        seen, params = [], {'limit': 1, 'fields': 'name', 'category': 'jewelry'}
+        while True:
+            body = self.get('product_list', **params).json()
+            seen += [item['name'] for item in body['data']]
+            if body['next'] is None:
+                break
+            params['cursor'] = body['next_cursor']
+        self.assertEqual(seen, ['Opal Ring', 'Ruby Ring'])
+        self.assertEqual([p['id'] for p in self.get('product_list', metal='Gold').json()['data']], [self.ruby.pk])
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.get('product_list', fields='name,secret').status_code, 400)
+        self.assertIn('single product', self.get('product_list', fields='variants').json()['error'])
+        self.assertEqual(self.get('product_list', limit=500).status_code, 400)
+        self.assertEqual(self.get('product_list', category='nope').status_code, 404)
+        self.assertEqual(self.get('product_detail', self.hidden.pk).status_code, 404)
+        self.assertEqual(self.client.post(reverse('api_v1:product_list')).status_code, 405)
+
+    def test_detail_embeds_variants_and_sizes(self):
+        from .models import ProductVariant
+        size = Size.objects.create(name='US 6', code='6')
+        self.ruby.sizes.add(size)
+        ProductVariant.objects.create(product=self.ruby, size=size, stock=3)
+        data = self.get('product_detail', self.ruby.pk).json()['data']
+        self.assertEqual(data['sizes'], ['6'])
+        self.assertEqual(data['variants'][0]['size'], '6')
+        self.assertEqual(data['images'], [])
+        self.assertTrue(data['url'].endswith(self.ruby.get_absolute_url()))
+        self.assertEqual(self.get('product_variants', self.ruby.pk).json()['data'][0]['stock'], 3)
+        self.assertEqual(self.get('product_images', self.ruby.pk).json()['data'], {'main': None, 'gallery': []})
+
+    def test_categories_come_from_reference_data(self):
+        data = self.get('category_list').json()['data']
+        self.assertEqual([(c['slug'], c['parent']) for c in data],
+                         [('jewelry', None), ('rings', self.jewelry.pk)])
+
+    def test_etag_revalidation_and_invalidation(self):
+        response = self.get('product_detail', self.ruby.pk)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_v1:product_detail', args=[self.ruby.pk]), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # Any entry of a list matches, weak or not
+        url = reverse('api_v1:product_detail', args=[self.ruby.pk])
+        for header in (f'"stale", {etag}', f'W/{etag}', '*'):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=header).status_code, 304)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='"stale", W/"other"').status_code, 200)
+
+        # Other products don't change this one's ETag; its own edits do
+        self.opal.stock = 9
+        self.opal.save()
+        self.assertEqual(self.get('product_detail', self.ruby.pk)['ETag'], etag)
+        self.ruby.price = Decimal('120.00')
+        self.ruby.save()
+        response = self.get('product_detail', self.ruby.pk)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.json()['data']['price'], '120.00')
+
+    def test_flash_sale_prices(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from .models import SaleRule
+        now = timezone.now()
+        SaleRule.objects.create(name='Gold week', discount_percentage=Decimal('30'), metal='Gold',
+                                starts_at=now - timedelta(hours=1), ends_at=now + timedelta(hours=1))
+        data = self.get('product_detail', self.ruby.pk, fields='discounted_price,discount_percentage,on_sale').json()['data']
+        self.assertEqual(data, {'id': self.ruby.pk, 'discounted_price': '70.00', 'discount_percentage': '30.00', 'on_sale': True})
+
+
+class VariantStockIndexTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        from .models import ProductVariant
+        rings = Category.objects.create(name='Rings', slug='rings')
+        self.product = make_product(rings, 'Ruby Ring', stock=10)
+        self.size = Size.objects.create(name='US 6', code='6')
+        self.gold = Color.objects.create(name='Gold', code='gold')
+        self.variant = ProductVariant.objects.create(product=self.product, size=self.size, color=self.gold, stock=2)
+        ProductVariant.objects.create(product=self.product, size=None, color=self.gold, stock=4)
+
+    def add(self, **data):
+        return self.client.post(reverse('cart:cart_add', args=[self.product.id]), {'quantity': 1, **data})
+
+    def cart_quantity(self):
+        return sum(item['quantity'] for item in self.client.session.get('cart', {}).values())
+
+    def test_index_maps_codes_to_variant_and_stock(self):
+        from . import variants
+        index = variants.get_stock_index(self.product.id)
+        self.assertEqual(index[('6', 'gold')], (self.variant.pk, 2))
+        self.assertEqual(variants.lookup(index, 'Adjustable', 'gold')[1], 4)
+        self.assertEqual(variants.lookup(index, '', 'gold')[1], 4)
+        self.assertIsNone(variants.lookup(index, '6', None))
+        with self.assertNumQueries(0):
+            self.assertEqual(variants.get_stock_index(self.product.id), index)
+
+    def test_cart_add_checks_variant_stock_without_variant_queries(self):
+        from . import variants
+        variants.get_stock_index(self.product.id)  # warm
+        with CaptureQueriesContext(connection) as queries:
+            self.add(size='6', color='gold', quantity=2)
+        self.assertFalse([q for q in queries if 'store_productvariant' in q['sql']])
+        self.assertEqual(self.cart_quantity(), 2)
+
+        # Only 2 of this variation exist
+        self.add(size='6', color='gold')
+        self.assertEqual(self.cart_quantity(), 2)
+
+    def test_variant_save_invalidates_index_and_detail_json(self):
+        self.add(size='6', color='gold', quantity=2)
+        self.variant.stock = 5
+        self.variant.save()
+        self.add(size='6', color='gold', quantity=3)
+        self.assertEqual(self.cart_quantity(), 5)
+
+        variants_data = json.loads(self.client.get(self.product.get_absolute_url()).context['variants_json'])
+        self.assertIn({'size': '6', 'color': 'gold', 'stock': 5}, variants_data)
+        self.assertIn({'size': 'Adjustable', 'color': 'gold', 'stock': 4}, variants_data)
+
+        self.size.code = '6.5'
+        self.size.save()
+        from . import variants
+        self.assertIn(('6.5', 'gold'), variants.get_stock_index(self.product.id))
+
+    def test_invalidation_from_another_process_is_seen(self):
+        from django.core.cache import caches
+        from . import variants
+        variants.get_stock_index(self.product.id)  # warm
+        # Saved in another worker: its own connection to the shared cache
+        with mock.patch('store.variants.cache', caches.create_connection('default')):
+            self.variant.stock = 7
+            self.variant.save()
+        self.assertEqual(variants.get_stock_index(self.product.id)[('6', 'gold')][1], 7)
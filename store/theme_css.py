@@ -0,0 +1,89 @@
+"""
+Compile Theme colors into content-hashed stylesheets.
+
+Instead of an inline `style` attribute on every page, each theme is written
+once to THEME_CSS_ROOT/theme-<hash>.css. WhiteNoise serves that directory
+at the site root (WHITENOISE_ROOT) and marks the hashed names immutable;
+files compiled after the server started are served by the
+`theme_stylesheet` view with the same headers until the next restart.
+"""
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+
+from django.conf import settings
+
+FILENAME_RE = re.compile(r'^theme-([0-9a-f]{12})\.css$')
+
+# Stale files are kept this long, so cached HTML still pointing at a
+# previous stylesheet keeps rendering correctly.
+GC_GRACE_SECONDS = 60 * 60 * 24
+
+
+def get_root():
+    return Path(getattr(settings, 'THEME_CSS_ROOT', Path(settings.BASE_DIR) / 'theme_css'))
+
+
+def filename_for(css_hash):
+    return f'theme-{css_hash}.css'
+
+
+def is_immutable_file(path, url):
+    """WHITENOISE_IMMUTABLE_FILE_TEST: hashed theme files never change."""
+    return bool(FILENAME_RE.match(os.path.basename(url)))
+
+
+def render_css(theme):
+    return f'body {{ {theme.css_variables()} }}\n'
+
+
+def compile_theme(theme):
+    """Write the theme's stylesheet if needed and return its content hash."""
+    css = render_css(theme)
+    css_hash = hashlib.sha256(css.encode()).hexdigest()[:12]
+    root = get_root()
+    path = root / filename_for(css_hash)
+    if not path.exists():
+        root.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so a concurrent request never reads a partial file
+        tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_path.write_text(css)
+        os.replace(tmp_path, path)
+    return css_hash
+
+
+def read_stylesheet(css_hash):
+    path = get_root() / filename_for(css_hash)
+    try:
+        return path.read_text()
+    except FileNotFoundError:
+        return None
+
+
+def retire(css_hash):
+    """Mark a stylesheet as no longer used; its grace period starts now."""
+    path = get_root() / filename_for(css_hash)
+    if path.exists():
+        os.utime(path)
+
+
+def collect_garbage(keep_hashes, grace_seconds=GC_GRACE_SECONDS):
+    """
+    Delete compiled files no theme references any more and that were
+    retired more than `grace_seconds` ago. Returns the count removed.
+    """
+    root = get_root()
+    if not root.exists():
+        return 0
+    removed = 0
+    cutoff = time.time() - grace_seconds
+    for path in root.iterdir():
+        match = FILENAME_RE.match(path.name)
+        if not match or match.group(1) in keep_hashes:
+            continue
+        if path.stat().st_mtime < cutoff:
+            path.unlink(missing_ok=True)
+            removed += 1
+    return removed
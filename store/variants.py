@@ -0,0 +1,79 @@
+"""
+Per-product variant stock index.
+
+A product's variants as one map, loaded with a single query and kept in
+the shared cache:
+
+    {(size_code, color_code): (variant_id, stock)}
+
+with None for a variant without a size or color. Add-to-cart validation
+(`lookup()`) and the product page's variants JSON (`as_json()`) both read
+it. A ProductVariant save or delete drops the product's entry; renaming
+or deleting a Size/Color bumps the namespace version (see store.signals).
+Both go through the default cache, which every worker shares
+(settings.CACHES), so no process keeps serving stock another one changed.
+The short timeout bounds staleness after writes that send no signals
+(queryset update(), raw SQL).
+"""
+from django.core.cache import cache
+
+from .caching import bump_version, versioned_key
+
+CACHE_NAMESPACE = 'variants'
+CACHE_TIMEOUT = 60 * 5
+
+# Size value the cart uses for adjustable products (no Size row)
+ADJUSTABLE = 'Adjustable'
+
+
+def _cache_key(product_id):
+    return versioned_key(CACHE_NAMESPACE, product_id)
+
+
+def load(product_id):
+    from .models import ProductVariant
+
+    index = {}
+    rows = ProductVariant.objects.filter(product_id=product_id).order_by('pk').values_list(
+        'size__code', 'color__code', 'id', 'stock',
+    )
+    for size, color, variant_id, stock in rows:
+        # Duplicate combinations: the oldest variant wins
+        index.setdefault((size, color), (variant_id, stock))
+    return index
+
+
+def get_stock_index(product_id):
+    """{(size_code, color_code): (variant_id, stock)}; empty without variants."""
+    key = _cache_key(product_id)
+    index = cache.get(key)
+    if index is None:
+        index = load(product_id)
+        cache.set(key, index, CACHE_TIMEOUT)
+    return index
+
+
+def invalidate(product_id):
+    cache.delete(_cache_key(product_id))
+
+
+def invalidate_all():
+    bump_version(CACHE_NAMESPACE)
+
+
+def lookup(index, size=None, color=None):
+    """
+    (variant_id, stock) for a cart selection, or None if no variant
+    matches. Blank and "Adjustable" sizes match variants without a size.
+    """
+    if not size or size == ADJUSTABLE:
+        size = None
+    return index.get((size, color or None))
+
+
+def as_json(index):
+    """The product page's variants data (the stock check in product_detail.html)."""
+    return [
+        {'size': size or ADJUSTABLE, 'color': color, 'stock': stock}
+        for (size, color), (_, stock) in index.items()
+    ]
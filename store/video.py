@@ -0,0 +1,220 @@
+"""
+Hero video transcoding.
+
+Uploaded hero videos are re-encoded with a local ffmpeg binary into two
+muted H.264 MP4 renditions plus a poster JPEG, stored as
+
+    derivatives/<original path without extension>/<rendition>.mp4
+    derivatives/<original path without extension>/poster.jpg
+
+Transcoding takes minutes of CPU, so it never runs in a web worker: saving
+a HeroSection with a new upload only marks the video "pending" (see
+store.signals), and `transcode_hero_videos --pending`, run from cron or a
+worker, does the work. Until a video is ready the storefront keeps serving
+the original upload.
+
+Progress lives in the model's `<field>_meta` JSON field:
+
+    {'name': <source file name>, 'status': 'pending' | 'ready' | 'failed',
+     'renditions': {'low': <name>, 'high': <name>}, 'poster': <name>}
+
+A pending meta also lists the previous upload's files under 'stale'; they
+are deleted only once the new meta has been saved.
+"""
+import logging
+import os
+import posixpath
+import shutil
+import subprocess
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+# name -> (max size of the shorter side, target video bitrate)
+RENDITIONS = {
+    'low': (480, '700k'),
+    'high': (1080, '2500k'),
+}
+
+POSTER_SECONDS = 1
+
+TRANSCODE_TIMEOUT = 60 * 10
+
+VIDEO_FIELDS = ('background_video', 'mobile_background_video')
+
+PENDING, READY, FAILED = 'pending', 'ready', 'failed'
+
+
+def meta_field_name(field_name):
+    return f'{field_name}_meta'
+
+
+def get_ffmpeg():
+    """Path of the ffmpeg binary, or None if it isn't installed."""
+    return shutil.which(getattr(settings, 'FFMPEG_BINARY', 'ffmpeg'))
+
+
+def derivative_name(name, filename):
+    root, _ = posixpath.splitext(name)
+    return f'derivatives/{root}/{filename}'
+
+
+def _scale_filter(short_side):
+    # Limit the shorter side (portrait mobile videos too), never upscale;
+    # -2 keeps the other side even, as H.264 requires.
+    return (
+        f"scale='if(gte(iw,ih),-2,min(iw,{short_side}))':"
+        f"'if(gte(iw,ih),min(ih,{short_side}),-2)'"
+    )
+
+
+def rendition_command(ffmpeg, source, target, short_side, bitrate):
+    return [
+        ffmpeg, '-y', '-v', 'error', '-i', source,
+        '-an',  # hero videos always play muted
+        '-vf', _scale_filter(short_side),
+        '-c:v', 'libx264', '-preset', 'slow', '-profile:v', 'main', '-pix_fmt', 'yuv420p',
+        '-b:v', bitrate, '-maxrate', bitrate, '-bufsize', bitrate,
+        '-movflags', '+faststart',  # metadata first, so playback starts before the download ends
+        target,
+    ]
+
+
+def poster_command(ffmpeg, source, target, seconds=POSTER_SECONDS):
+    return [
+        ffmpeg, '-y', '-v', 'error', '-ss', str(seconds), '-i', source,
+        '-frames:v', '1', '-q:v', '3', target,
+    ]
+
+
+def _run(command):
+    subprocess.run(command, check=True, capture_output=True, timeout=TRANSCODE_TIMEOUT)
+
+
+def transcode(name, storage=default_storage):
+    """
+    Transcode the stored video `name` and return its (ready) meta dict.
+    Raises if ffmpeg is missing or fails.
+    """
+    ffmpeg = get_ffmpeg()
+    if ffmpeg is None:
+        raise RuntimeError('ffmpeg is not installed')
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # ffmpeg wants real files; storages may be remote
+        source = os.path.join(workdir, 'source' + posixpath.splitext(name)[1])
+        with storage.open(name, 'rb') as src, open(source, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        outputs = {}
+        for rendition, (short_side, bitrate) in RENDITIONS.items():
+            target = os.path.join(workdir, f'{rendition}.mp4')
+            _run(rendition_command(ffmpeg, source, target, short_side, bitrate))
+            outputs[rendition] = target
+        poster = os.path.join(workdir, 'poster.jpg')
+        try:
+            _run(poster_command(ffmpeg, source, poster))
+        except subprocess.CalledProcessError:
+            # Clips shorter than POSTER_SECONDS: use the first frame
+            _run(poster_command(ffmpeg, source, poster, seconds=0))
+
+        meta = {'name': name, 'status': READY, 'renditions': {}}
+        for rendition, path in outputs.items():
+            meta['renditions'][rendition] = _store(storage, derivative_name(name, f'{rendition}.mp4'), path)
+        meta['poster'] = _store(storage, derivative_name(name, 'poster.jpg'), poster)
+    return meta
+
+
+def _store(storage, name, path):
+    storage.delete(name)
+    with open(path, 'rb') as f:
+        return storage.save(name, File(f))
+
+
+def derivative_files(meta):
+    """Every stored file a meta refers to, including stale ones."""
+    names = [*meta.get('renditions', {}).values(), meta.get('poster'), *meta.get('stale', ())]
+    return [name for name in names if name]
+
+
+def delete_derivatives(meta, storage=default_storage):
+    for name in derivative_files(meta):
+        storage.delete(name)
+
+
+def needs_transcode(instance, field_name):
+    fieldfile = getattr(instance, field_name)
+    meta = getattr(instance, meta_field_name(field_name)) or {}
+    return (fieldfile.name or '') != meta.get('name', '')
+
+
+def _save_meta(instance, field_name, meta):
+    setattr(instance, meta_field_name(field_name), meta)
+    type(instance)._default_manager.filter(pk=instance.pk).update(**{meta_field_name(field_name): meta})
+
+
+def mark_pending(instance, field_name):
+    """
+    Record that the field's upload changed; returns True if it needs
+    transcoding (False when the video was removed). The old upload's
+    files are kept until the new meta replaces this one.
+    """
+    fieldfile = getattr(instance, field_name)
+    old_meta = getattr(instance, meta_field_name(field_name)) or {}
+    if not fieldfile:
+        delete_derivatives(old_meta, fieldfile.storage)
+        _save_meta(instance, field_name, {})
+        return False
+    _save_meta(instance, field_name, {
+        'name': fieldfile.name, 'status': PENDING, 'stale': derivative_files(old_meta),
+    })
+    return True
+
+
+def is_pending(instance, field_name):
+    meta = getattr(instance, meta_field_name(field_name)) or {}
+    return meta.get('status') == PENDING and not needs_transcode(instance, field_name)
+
+
+def transcode_instance(instance, field_name):
+    """Transcode one field of a saved instance and store the result."""
+    fieldfile = getattr(instance, field_name)
+    stale = (getattr(instance, meta_field_name(field_name)) or {}).get('stale', ())
+    try:
+        meta = transcode(fieldfile.name, fieldfile.storage)
+    except Exception:
+        logger.exception('Could not transcode %s', fieldfile.name)
+        meta = {'name': fieldfile.name, 'status': FAILED}
+
+    # The upload may have been replaced while we were working (its pending
+    # meta has taken over our stale files)
+    current = type(instance)._default_manager.filter(pk=instance.pk).values_list(field_name, flat=True).first()
+    if current != fieldfile.name:
+        delete_derivatives(meta, fieldfile.storage)
+        return None
+    _save_meta(instance, field_name, meta)
+    for name in stale:
+        fieldfile.storage.delete(name)
+    return meta
+
+
+def get_sources(fieldfile):
+    """
+    {'low': url, 'high': url, 'poster': url or None} for a hero video:
+    the renditions once ready, the original upload until then.
+    """
+    if not fieldfile:
+        return None
+    meta = getattr(fieldfile.instance, meta_field_name(fieldfile.field.name), None) or {}
+    storage = fieldfile.storage
+    if meta.get('name') == fieldfile.name and meta.get('status') == READY:
+        return {
+            'low': storage.url(meta['renditions']['low']),
+            'high': storage.url(meta['renditions']['high']),
+            'poster': storage.url(meta['poster']) if meta.get('poster') else None,
+        }
+    return {'low': fieldfile.url, 'high': fieldfile.url, 'poster': None}
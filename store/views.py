@@ -1,25 +1,70 @@
 from django.shortcuts import render, get_object_or_404
+from django.http import Http404, HttpResponse, JsonResponse
+from django.template.loader import render_to_string
 import json
-from .models import Category, Product
+from .models import Product, Theme
+from . import autocomplete, refdata, theme_css, variants
+from .pagination import paginate
+from .search import search_products
+from .fuzzy import resolve_query
+from .facets import get_facets, normalize_filters
+from .page_cache import add_page_cache_tags, cache_anonymous_page
+from .conditional import conditional_page
+from .recommendations import get_related_products
 from cart.forms import CartAddProductForm
-from django.db.models import Q
 
+
+def _paginated_response(request, products, sort_by, template_name, items_template, context):
+    """
+    Keyset-paginate `products` and either render the full page or, for
+    infinite-scroll requests (?format=json), just the next batch of cards.
+    """
+    page, next_cursor = paginate(products, sort_by, cursor=request.GET.get('cursor'))
+
+    if request.GET.get('format') == 'json':
+        html = render_to_string(items_template, {'products': page}, request=request)
+        return JsonResponse({
+            'html': html,
+            'next_cursor': next_cursor,
+            'has_next': next_cursor is not None,
+        })
+
+    params = request.GET.copy()
+    params.pop('format', None)
+    next_url = None
+    if next_cursor:
+        params['cursor'] = next_cursor
+        next_url = f"?{params.urlencode()}"
+
+    context.update({
+        'products': page,
+        'next_cursor': next_cursor,
+        'next_url': next_url,
+    })
+    return render(request, template_name, context)
+
+@conditional_page
+@cache_anonymous_page
 def product_list(request, category_slug=None):
     category = None
-    categories = Category.objects.all()
     products = Product.objects.filter(available=True)
 
-    # Category Filter
+    # Category Filter (the category and all of its subcategories)
     if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
+        # Unknown slugs are rejected from the in-memory category map, no query
+        category = refdata.get_category(category_slug)
+        if category is None:
+            raise Http404('No Category matches the given query.')
+        products = products.filter(category__path__startswith=category.path)
+        add_page_cache_tags(request, f'category:{category.id}')
+    else:
+        add_page_cache_tags(request, 'listing', 'hero')
 
-    # Search Filter (Name or Description)
+    # Search Filter (full-text index; typo/transliteration tolerant when it finds nothing)
     query = request.GET.get('q')
+    search_query = resolve_query(query)
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | Q(description__icontains=query)
-        )
+        products = search_products(products, search_query)
 
     # Price Filter
     min_price = request.GET.get('min_price')
@@ -37,58 +82,80 @@ def product_list(request, category_slug=None):
         except ValueError:
             pass # Ignore invalid input
 
-    # Sorting
-    sort_by = request.GET.get('sort', 'newest')
-    if sort_by == 'price_asc':
-        products = products.order_by('price')
-    elif sort_by == 'price_desc':
-        products = products.order_by('-price')
-    else: # newest
-        products = products.order_by('-created')
+    # Sorting (applied by the paginator); relevance only makes sense with a query
+    sort_by = request.GET.get('sort', 'relevance' if query else 'newest')
+    if sort_by == 'relevance' and not query:
+        sort_by = 'newest'
 
-    # Helper to generate sort URLs
+    # Helper to generate sort URLs (a new sort always restarts from page one)
     def get_sort_url(sort_value):
         params = request.GET.copy()
         params['sort'] = sort_value
+        params.pop('cursor', None)
         return f"?{params.urlencode()}"
 
-    return render(request, 'store/product_list.html', {
+    return _paginated_response(request, products, sort_by, 'store/product_list.html', 'store/includes/product_cards.html', {
         'category': category,
-        'categories': categories,
-        'products': products,
         'sort_by': sort_by,
+        'query': query,
+        'is_relevance': sort_by == 'relevance',
         'is_newest': sort_by == 'newest',
         'is_price_asc': sort_by == 'price_asc',
         'is_price_desc': sort_by == 'price_desc',
+        'url_relevance': get_sort_url('relevance'),
         'url_newest': get_sort_url('newest'),
         'url_price_asc': get_sort_url('price_asc'),
         'url_price_desc': get_sort_url('price_desc'),
     })
 
+def theme_stylesheet(request, css_hash):
+    """
+    Serve a compiled theme stylesheet that WhiteNoise doesn't know about yet
+    (compiled after the server started). Hashed names never change content.
+    """
+    css = theme_css.read_stylesheet(css_hash)
+    if css is None:
+        # e.g. another server compiled it: rebuild from the theme row
+        theme = Theme.objects.filter(stylesheet_hash=css_hash).first()
+        if theme is None or theme_css.compile_theme(theme) != css_hash:
+            raise Http404('Unknown theme stylesheet.')
+        css = theme_css.read_stylesheet(css_hash)
+
+    response = HttpResponse(css, content_type='text/css; charset=utf-8')
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+@cache_anonymous_page
 def contact(request):
     return render(request, 'store/contact.html')
 
+@cache_anonymous_page
 def about(request):
     return render(request, 'store/about.html')
 
 
+@conditional_page
+@cache_anonymous_page
 def product_detail(request, id, slug):
-    product = get_object_or_404(Product, id=id, slug=slug, available=True)
+    # One prefetch plan for everything the template touches: the category
+    # (breadcrumbs/meta) is joined, gallery images, colors and sizes are
+    # prefetched once and reused by every loop and emptiness check.
+    product = get_object_or_404(
+        Product.objects.select_related('category').prefetch_related('images', 'colors', 'sizes'),
+        id=id, slug=slug, available=True,
+    )
     cart_product_form = CartAddProductForm()
 
-    # Related Products (Same category, excluding current)
-    related_products = Product.objects.filter(category=product.category, available=True).exclude(id=product.id)[:4]
-
-    # Serialize variants for frontend logic
-    variants_data = []
-    if product.variants.exists():
-        for v in product.variants.all():
-            variants_data.append({
-                'size': v.size.code if v.size else 'Adjustable', # Assuming 'Adjustable' or None map to null/string
-                'color': v.color.code if v.color else None,
-                'stock': v.stock
-            })
-            
+    # Related Products ("frequently bought together", topped up from the same category)
+    related_products = get_related_products(product)
+    add_page_cache_tags(
+        request, f'product:{product.id}', f'category:{product.category_id}', 'recommendations',
+        *(f'product:{related.id}' for related in related_products),
+    )
+
+    # Variants for the frontend stock check, from the cached stock index
+    variants_data = variants.as_json(variants.get_stock_index(product.id))
+
     return render(request, 'store/product_detail.html', {
         'product': product, 
         'cart_product_form': cart_product_form,
@@ -96,29 +163,33 @@ def product_detail(request, id, slug):
         'variants_json': json.dumps(variants_data)
     })
 
+@cache_anonymous_page
 def search(request):
     query = request.GET.get('q')
     category_slug = request.GET.get('category')
     min_price = request.GET.get('min_price')
     max_price = request.GET.get('max_price')
-    metal = request.GET.get('metal')
-    sort_by = request.GET.get('sort', 'newest') # newest, price_asc, price_desc
+    metals = request.GET.getlist('metal')
+    sizes = request.GET.getlist('size')
+    colors = request.GET.getlist('color')
+    sort_by = request.GET.get('sort', 'relevance' if query else 'newest') # relevance, newest, price_low, price_high
+    if sort_by == 'relevance' and not query:
+        sort_by = 'newest'
 
-    products = Product.objects.filter(available=True)
-    categories = Category.objects.all()
+    available = Product.objects.filter(available=True)
+    products = available
+    add_page_cache_tags(request, 'listing')
 
-    # Base Search
+    # Base Search (BM25-ranked full-text index; typo/transliteration
+    # tolerant only when the exact query finds nothing)
+    search_query = resolve_query(query)
     if query:
-        products = products.filter(
-            Q(name__icontains=query) | 
-            Q(description__icontains=query) |
-            Q(gemstone__icontains=query) |
-            Q(metal__icontains=query)
-        )
+        products = search_products(products, search_query)
     
     # Filters
     if category_slug:
-        products = products.filter(category__slug=category_slug)
+        category = refdata.get_category(category_slug)
+        products = products.filter(category__path__startswith=category.path) if category else products.none()
     
     if min_price:
         try:
@@ -132,31 +203,56 @@ def search(request):
         except ValueError:
             pass
 
-    if metal:
-         products = products.filter(metal=metal)
+    if metals:
+        products = products.filter(metal__in=metals)
 
-    # Sorting
-    if sort_by == 'price_low':
-        products = products.order_by('price')
-    elif sort_by == 'price_high':
-        products = products.order_by('-price')
-    else:
-        products = products.order_by('-created')
+    if sizes:
+        products = products.filter(id__in=Product.sizes.through.objects.filter(size__code__in=sizes).values('product_id'))
 
-    # Get distinct metals for filter sidebar
-    metals = Product.objects.values_list('metal', flat=True).distinct().exclude(metal='')
+    if colors:
+        products = products.filter(id__in=Product.colors.through.objects.filter(color__code__in=colors).values('product_id'))
+
+    # Sidebar facet counts (cached per filter set; also gives the result total)
+    filters = normalize_filters(
+        query=search_query, category=category_slug, metals=metals, sizes=sizes, colors=colors,
+        min_price=min_price, max_price=max_price,
+    )
+    facets = get_facets(filters, lambda: search_products(available, search_query).values_list('id', flat=True))
+
+    # Price bucket links keep every other filter
+    price_facets = []
+    for bucket in facets['price']:
+        params = request.GET.copy()
+        for key in ('cursor', 'format', 'min_price', 'max_price'):
+            params.pop(key, None)
+        if bucket['min_price'] is not None:
+            params['min_price'] = bucket['min_price']
+        if bucket['max_price'] is not None:
+            params['max_price'] = bucket['max_price']
+        price_facets.append({**bucket, 'url': f"?{params.urlencode()}"})
 
+    # Sorting is applied by the paginator
     context = {
-        'products': products,
-        'categories': categories,
-        'metals': metals,
+        'total_count': facets['total'],
+        'facets': facets,
+        'price_facets': price_facets,
         'query': query,
+        'corrected_query': search_query if search_query != query else None,
         'sort_by': sort_by,
+        'is_relevance': sort_by == 'relevance',
         'is_newest': sort_by == 'newest',
-        'is_price_asc': sort_by == 'price_asc',
-        'is_price_desc': sort_by == 'price_desc',
+        'is_price_asc': sort_by == 'price_low',
+        'is_price_desc': sort_by == 'price_high',
     }
-    return render(request, 'store/search_fixed.html', context)
+    return _paginated_response(request, products, sort_by, 'store/search_fixed.html', 'store/includes/search_cards.html', context)
+
+def search_autocomplete(request):
+    """Search-as-you-type suggestions, served from the in-memory prefix index."""
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({
+        'query': query,
+        'suggestions': autocomplete.suggest(query),
+    })
 
 
 from django.contrib.auth.decorators import login_required